@@ -0,0 +1,101 @@
+"""crm_entries: typed payment columns extracted from data
+
+Revision ID: 3f1a9c2d7b40
+Revises:
+Create Date: 2025-07-01 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1a9c2d7b40'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _columns():
+    return [
+        sa.Column('payment_date', sa.Date(), nullable=True),
+        sa.Column('amount', sa.Numeric(14, 2), nullable=True),
+        sa.Column('iin', sa.String(), nullable=True),
+        sa.Column('fio_normalized', sa.String(), nullable=True),
+        sa.Column('email', sa.String(), nullable=True),
+        sa.Column('phone', sa.String(), nullable=True),
+        sa.Column('month', sa.SmallInteger(), nullable=True),
+        sa.Column('year', sa.SmallInteger(), nullable=True),
+    ]
+
+
+BACKFILL_BATCH = 5000
+
+
+def _backfill(bind):
+    """Колонки для уже загруженных строк — тем же кодом, что и при загрузке.
+
+    Разбор в SQL расходился с загрузкой (форматы дат, dateutil) и падал на
+    невозможных датах вроде 31.02.2025, поэтому строки разбираются в Python
+    пачками по id; неразобранные значения остаются NULL.
+    """
+    from app.crm_fields import extract_payment_fields
+    from app.source_profiles import detect_profile
+
+    crm_entries = sa.table(
+        'crm_entries',
+        sa.column('id', sa.Integer), sa.column('data', sa.JSON),
+        *(sa.column(column.name, column.type) for column in _columns()),
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(crm_entries.c.id, crm_entries.c.data)
+            .where(
+                crm_entries.c.id > last_id,
+                crm_entries.c.payment_date.is_(None),
+                crm_entries.c.amount.is_(None),
+            )
+            .order_by(crm_entries.c.id)
+            .limit(BACKFILL_BATCH)
+        ).all()
+        if not rows:
+            return
+        updates = []
+        for row in rows:
+            data = row.data or {}
+            fields = extract_payment_fields(data, detect_profile(data))
+            updates.append({"entry_id": row.id, **{f"new_{key}": value for key, value in fields.items()}})
+        bind.execute(
+            crm_entries.update()
+            .where(crm_entries.c.id == sa.bindparam('entry_id'))
+            .values({column.name: sa.bindparam(f"new_{column.name}") for column in _columns()}),
+            updates,
+        )
+        last_id = rows[-1].id
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    # Таблица создаётся через Base.metadata.create_all, поэтому на свежей базе
+    # колонки уже могут существовать.
+    existing = {c['name'] for c in sa.inspect(bind).get_columns('crm_entries')}
+    for column in _columns():
+        if column.name not in existing:
+            op.add_column('crm_entries', column)
+
+    _backfill(bind)
+
+    for column in _columns():
+        op.create_index(
+            f'ix_crm_entries_{column.name}', 'crm_entries', [column.name],
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    for column in _columns():
+        op.drop_index(f'ix_crm_entries_{column.name}', table_name='crm_entries')
+        op.drop_column('crm_entries', column.name)
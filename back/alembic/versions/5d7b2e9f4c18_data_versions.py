@@ -0,0 +1,43 @@
+"""data_versions: shared dataset version counters for cache invalidation
+
+Revision ID: 5d7b2e9f4c18
+Revises: 8c2e4d6f1a93
+Create Date: 2025-07-10 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d7b2e9f4c18'
+down_revision: Union[str, None] = '8c2e4d6f1a93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Наборы данных app.versions на этой ревизии
+DATASETS = ('excel_users', 'crm_entries')
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if not inspector.has_table('data_versions'):
+        op.create_table(
+            'data_versions',
+            sa.Column('name', sa.String(), primary_key=True),
+            sa.Column('version', sa.Integer(), nullable=False, server_default='0'),
+        )
+    # Строки заводятся заранее: первое увеличение версии — UPDATE, а не вставка наперегонки
+    data_versions = sa.table('data_versions', sa.column('name', sa.String), sa.column('version', sa.Integer))
+    existing = set(bind.execute(sa.select(data_versions.c.name)).scalars())
+    missing = [{'name': name, 'version': 0} for name in DATASETS if name not in existing]
+    if missing:
+        op.bulk_insert(data_versions, missing)
+
+
+def downgrade() -> None:
+    op.drop_table('data_versions')
@@ -0,0 +1,69 @@
+"""excel_users: full row storage and indexed lookup columns
+
+Revision ID: 8c2e4d6f1a93
+Revises: 3f1a9c2d7b40
+Create Date: 2025-07-03 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c2e4d6f1a93'
+down_revision: Union[str, None] = '3f1a9c2d7b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXED = ['fio', 'summa', 'source', 'payment_date']
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('excel_users'):
+        op.create_table(
+            'excel_users',
+            sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column('email', sa.String()),
+            sa.Column('month', sa.String()),
+            sa.Column('date', sa.String()),
+            sa.Column('fio', sa.String()),
+            sa.Column('summa', sa.Numeric(14, 2)),
+            sa.Column('payment_id', sa.String(), nullable=True),
+            sa.Column('phone', sa.String(), nullable=True),
+            sa.Column('language', sa.String(), nullable=True),
+            sa.Column('source', sa.String()),
+            sa.Column('payment_date', sa.Date(), nullable=True),
+            sa.Column('data', sa.JSON()),
+        )
+        op.create_index('ix_excel_users_id', 'excel_users', ['id'])
+        op.create_index('ix_excel_users_email', 'excel_users', ['email'])
+    else:
+        existing = {c['name'] for c in inspector.get_columns('excel_users')}
+        if 'payment_date' not in existing:
+            op.add_column('excel_users', sa.Column('payment_date', sa.Date(), nullable=True))
+        if 'data' not in existing:
+            op.add_column('excel_users', sa.Column('data', sa.JSON()))
+        op.alter_column(
+            'excel_users', 'summa',
+            type_=sa.Numeric(14, 2),
+            postgresql_using='summa::numeric(14, 2)',
+        )
+
+    for column in INDEXED:
+        op.create_index(f'ix_excel_users_{column}', 'excel_users', [column], if_not_exists=True)
+
+
+def downgrade() -> None:
+    for column in INDEXED:
+        op.drop_index(f'ix_excel_users_{column}', table_name='excel_users')
+    op.alter_column(
+        'excel_users', 'summa',
+        type_=sa.Integer(),
+        postgresql_using='round(summa)::integer',
+    )
+    op.drop_column('excel_users', 'data')
+    op.drop_column('excel_users', 'payment_date')
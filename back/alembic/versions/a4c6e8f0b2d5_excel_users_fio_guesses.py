@@ -0,0 +1,50 @@
+"""excel_users: gender and language guessed from FIO at write time
+
+Revision ID: a4c6e8f0b2d5
+Revises: 5d7b2e9f4c18
+Create Date: 2025-07-12 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.fio_guess import guess_gender_by_fio, guess_language_by_fio
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4c6e8f0b2d5'
+down_revision: Union[str, None] = '5d7b2e9f4c18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+COLUMNS = ['guessed_gender', 'guessed_language']
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    existing = {c['name'] for c in sa.inspect(bind).get_columns('excel_users')}
+    for column in COLUMNS:
+        if column not in existing:
+            op.add_column('excel_users', sa.Column(column, sa.String(), nullable=True))
+        op.create_index(f'ix_excel_users_{column}', 'excel_users', [column], if_not_exists=True)
+
+    # Догадка зависит только от ФИО — считаем по одному разу на уникальное значение
+    fios = [row[0] for row in bind.execute(sa.text("SELECT DISTINCT fio FROM excel_users"))]
+    update = sa.text(
+        "UPDATE excel_users SET guessed_gender = :gender, guessed_language = :language "
+        "WHERE fio IS NOT DISTINCT FROM :fio"
+    )
+    if fios:
+        bind.execute(update, [
+            {"fio": fio, "gender": guess_gender_by_fio(fio), "language": guess_language_by_fio(fio)}
+            for fio in fios
+        ])
+
+
+def downgrade() -> None:
+    for column in COLUMNS:
+        op.drop_index(f'ix_excel_users_{column}', table_name='excel_users')
+        op.drop_column('excel_users', column)
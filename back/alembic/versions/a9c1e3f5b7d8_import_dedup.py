@@ -0,0 +1,139 @@
+"""import dedup: crm_entries.row_hash, imported_files, import_jobs skip counters
+
+Revision ID: a9c1e3f5b7d8
+Revises: f8b0d2e4a6c7
+Create Date: 2025-07-25 12:00:00.000000
+
+"""
+import logging
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9c1e3f5b7d8'
+down_revision: Union[str, None] = 'f8b0d2e4a6c7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH = 5000
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+DONOR_STATS_SQL = """
+    INSERT INTO donor_stats (donor_id, donation_count, amount_count, total_amount,
+                             avg_amount, first_date, last_date, donor_class)
+    SELECT donor_id, count(*), count(amount), coalesce(sum(amount), 0),
+           avg(amount), min(payment_date), max(payment_date),
+           CASE WHEN count(*) = 1 THEN 'single'
+                WHEN count(*) <= 4 THEN 'periodic'
+                ELSE 'frequent' END
+    FROM crm_entries
+    WHERE donor_id IN :donor_ids
+    GROUP BY donor_id
+"""
+
+
+def _backfill_row_hash(bind):
+    """row_hash для уже загруженных строк.
+
+    Хеш считается тем же crm_fields.payment_hash, что и при загрузке, —
+    иначе повторная загрузка старого файла не распознается как дубль.
+    Из каждой группы дублей остаётся строка с наименьшим id, остальные
+    удаляются, а donor_stats их доноров пересчитывается.
+    """
+    from app.crm_fields import payment_hash
+
+    crm_entries = sa.table(
+        'crm_entries',
+        sa.column('id', sa.Integer), sa.column('data', sa.JSON),
+        sa.column('row_hash', sa.String), sa.column('donor_id', sa.Integer),
+    )
+    seen = set()
+    duplicate_ids = []
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(crm_entries.c.id, crm_entries.c.data)
+            .where(crm_entries.c.id > last_id, crm_entries.c.row_hash.is_(None))
+            .order_by(crm_entries.c.id)
+            .limit(BACKFILL_BATCH)
+        ).all()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            row_hash = payment_hash(row.data or {})
+            if row_hash in seen:
+                duplicate_ids.append(row.id)
+            else:
+                seen.add(row_hash)
+                updates.append({"entry_id": row.id, "hash": row_hash})
+        if updates:
+            bind.execute(
+                crm_entries.update()
+                .where(crm_entries.c.id == sa.bindparam('entry_id'))
+                .values(row_hash=sa.bindparam('hash')),
+                updates,
+            )
+        last_id = rows[-1].id
+
+    if not duplicate_ids:
+        return
+    donor_ids = set()
+    for start in range(0, len(duplicate_ids), BACKFILL_BATCH):
+        chunk = duplicate_ids[start:start + BACKFILL_BATCH]
+        donor_ids.update(bind.execute(
+            sa.select(crm_entries.c.donor_id)
+            .where(crm_entries.c.id.in_(chunk), crm_entries.c.donor_id.is_not(None))
+            .distinct()
+        ).scalars())
+        bind.execute(crm_entries.delete().where(crm_entries.c.id.in_(chunk)))
+    donor_ids = sorted(donor_ids)
+    stats_insert = sa.text(DONOR_STATS_SQL).bindparams(sa.bindparam('donor_ids', expanding=True))
+    for start in range(0, len(donor_ids), BACKFILL_BATCH):
+        chunk = donor_ids[start:start + BACKFILL_BATCH]
+        bind.execute(sa.text("DELETE FROM donor_stats WHERE donor_id IN :donor_ids")
+                     .bindparams(sa.bindparam('donor_ids', expanding=True)), {"donor_ids": chunk})
+        bind.execute(stats_insert, {"donor_ids": chunk})
+    logger.warning(
+        "crm_entries: deleted %s duplicate rows (kept the lowest id of each), donor_stats refreshed for %s donors",
+        len(duplicate_ids), len(donor_ids),
+    )
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    crm_columns = {c['name'] for c in inspector.get_columns('crm_entries')}
+    if 'row_hash' not in crm_columns:
+        op.add_column('crm_entries', sa.Column('row_hash', sa.String(64), nullable=True))
+        _backfill_row_hash(bind)
+    op.create_index('ix_crm_entries_row_hash', 'crm_entries', ['row_hash'], unique=True, if_not_exists=True)
+
+    job_columns = {c['name'] for c in inspector.get_columns('import_jobs')}
+    if 'rows_skipped' not in job_columns:
+        op.add_column('import_jobs', sa.Column('rows_skipped', sa.Integer(), nullable=False, server_default='0'))
+    if 'files_skipped' not in job_columns:
+        op.add_column('import_jobs', sa.Column('files_skipped', sa.JSON(), nullable=True))
+
+    if not inspector.has_table('imported_files'):
+        op.create_table(
+            'imported_files',
+            sa.Column('sha256', sa.String(64), primary_key=True),
+            sa.Column('filename', sa.String(), nullable=True),
+            sa.Column('source', sa.String(), nullable=True),
+            sa.Column('job_id', sa.String(), nullable=True),
+            sa.Column('imported_at', sa.DateTime(), nullable=False),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('imported_files')
+    op.drop_column('import_jobs', 'files_skipped')
+    op.drop_column('import_jobs', 'rows_skipped')
+    op.drop_index('ix_crm_entries_row_hash', table_name='crm_entries')
+    op.drop_column('crm_entries', 'row_hash')
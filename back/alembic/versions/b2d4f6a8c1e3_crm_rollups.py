@@ -0,0 +1,57 @@
+"""crm_rollups: month x source x gender x language aggregates
+
+Revision ID: b2d4f6a8c1e3
+Revises: a9c1e3f5b7d8
+Create Date: 2025-07-28 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d4f6a8c1e3'
+down_revision: Union[str, None] = 'a9c1e3f5b7d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not sa.inspect(op.get_bind()).has_table('crm_rollups'):
+        op.create_table(
+            'crm_rollups',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('year', sa.SmallInteger(), nullable=False),
+            sa.Column('month', sa.SmallInteger(), nullable=False),
+            sa.Column('source', sa.String(), nullable=False),
+            sa.Column('gender', sa.String(), nullable=False),
+            sa.Column('language', sa.String(), nullable=False),
+            sa.Column('entry_count', sa.Integer(), nullable=False),
+            sa.Column('amount_count', sa.Integer(), nullable=False),
+            sa.Column('total_amount', sa.Numeric(16, 2), nullable=False),
+            sa.Column('donor_count', sa.Integer(), nullable=False),
+        )
+    op.create_index(
+        'ux_crm_rollups_bucket', 'crm_rollups',
+        ['year', 'month', 'source', 'gender', 'language'], unique=True, if_not_exists=True,
+    )
+
+    # Те же измерения, что в rollups.dimension_exprs
+    op.execute("""
+        INSERT INTO crm_rollups (year, month, source, gender, language,
+                                 entry_count, amount_count, total_amount, donor_count)
+        SELECT coalesce(year, 0), coalesce(month, 0),
+               coalesce(lower(trim(source)), ''),
+               coalesce(lower(trim(coalesce(nullif(data->>'gender', ''), nullif(data->>'пол', '')))), ''),
+               coalesce(lower(trim(coalesce(nullif(data->>'language', ''), nullif(data->>'язык', '')))), ''),
+               count(id), count(amount), coalesce(sum(amount), 0), count(DISTINCT donor_id)
+        FROM crm_entries
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT DO NOTHING
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('crm_rollups')
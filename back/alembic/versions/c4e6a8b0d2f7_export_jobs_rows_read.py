@@ -0,0 +1,28 @@
+"""export_jobs.rows_read: progress of the NDJSON spool pass
+
+Revision ID: c4e6a8b0d2f7
+Revises: b2d4f6a8c1e3
+Create Date: 2025-07-30 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e6a8b0d2f7'
+down_revision: Union[str, None] = 'b2d4f6a8c1e3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('export_jobs')}
+    if 'rows_read' not in columns:
+        op.add_column('export_jobs', sa.Column('rows_read', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    op.drop_column('export_jobs', 'rows_read')
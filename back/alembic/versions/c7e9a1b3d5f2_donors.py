@@ -0,0 +1,98 @@
+"""donors: donor identity table, crm_entries.donor_id and trigram FIO index
+
+Revision ID: c7e9a1b3d5f2
+Revises: a4c6e8f0b2d5
+Create Date: 2025-07-15 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e9a1b3d5f2'
+down_revision: Union[str, None] = 'a4c6e8f0b2d5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+SECONDARY_KEYS = ['fio_normalized', 'email', 'phone']
+
+
+def _senior_empty(key: str, alias: str = '') -> str:
+    """Условие «все более старшие ключи пусты» (ключом служит первый заполненный)."""
+    senior = ['iin'] + SECONDARY_KEYS[:SECONDARY_KEYS.index(key)]
+    return ' AND '.join(f'{alias}{column} IS NULL' for column in senior)
+
+
+def _link_by(key: str) -> str:
+    """Привязывает записи, у которых key — старший заполненный ключ, к первому донору с тем же key."""
+    return f"""
+        UPDATE crm_entries e SET donor_id = d.id
+        FROM (SELECT DISTINCT ON ({key}) {key}, id FROM donors
+              WHERE {key} IS NOT NULL ORDER BY {key}, id) d
+        WHERE e.donor_id IS NULL AND {_senior_empty(key, 'e.')} AND e.{key} = d.{key}
+    """
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if not inspector.has_table('donors'):
+        op.create_table(
+            'donors',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('iin', sa.String(), nullable=True, unique=True),
+            sa.Column('fio_normalized', sa.String(), nullable=True),
+            sa.Column('email', sa.String(), nullable=True),
+            sa.Column('phone', sa.String(), nullable=True),
+        )
+    op.create_index('ix_donors_id', 'donors', ['id'], if_not_exists=True)
+    for key in SECONDARY_KEYS:
+        op.create_index(f'ix_donors_{key}', 'donors', [key], if_not_exists=True)
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_donors_fio_trgm ON donors "
+        "USING gin (fio_normalized gin_trgm_ops)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_donors_email_trgm ON donors "
+        "USING gin (email gin_trgm_ops)"
+    )
+
+    existing = {c['name'] for c in inspector.get_columns('crm_entries')}
+    if 'donor_id' not in existing:
+        op.add_column('crm_entries', sa.Column('donor_id', sa.Integer(), sa.ForeignKey('donors.id'), nullable=True))
+    op.create_index('ix_crm_entries_donor_id', 'crm_entries', ['donor_id'], if_not_exists=True)
+
+    # Заполнение: сначала доноры по ИИН, затем по ФИО, email, телефону (см. DonorResolver)
+    op.execute("""
+        INSERT INTO donors (iin, fio_normalized, email, phone)
+        SELECT DISTINCT ON (iin) iin, fio_normalized, email, phone
+        FROM crm_entries
+        WHERE iin IS NOT NULL AND iin NOT IN (SELECT iin FROM donors WHERE iin IS NOT NULL)
+        ORDER BY iin, id
+    """)
+    op.execute("""
+        UPDATE crm_entries e SET donor_id = d.id
+        FROM donors d
+        WHERE e.donor_id IS NULL AND e.iin = d.iin
+    """)
+    for key in SECONDARY_KEYS:
+        op.execute(_link_by(key))
+        op.execute(f"""
+            INSERT INTO donors (fio_normalized, email, phone)
+            SELECT DISTINCT ON ({key}) fio_normalized, email, phone
+            FROM crm_entries
+            WHERE donor_id IS NULL AND {_senior_empty(key)} AND {key} IS NOT NULL
+            ORDER BY {key}, id
+        """)
+        op.execute(_link_by(key))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_crm_entries_donor_id', table_name='crm_entries')
+    op.drop_column('crm_entries', 'donor_id')
+    op.drop_table('donors')
@@ -0,0 +1,52 @@
+"""donor_stats: per-donor aggregates and donor class
+
+Revision ID: d2f4b6a8c0e1
+Revises: c7e9a1b3d5f2
+Create Date: 2025-07-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2f4b6a8c0e1'
+down_revision: Union[str, None] = 'c7e9a1b3d5f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not sa.inspect(op.get_bind()).has_table('donor_stats'):
+        op.create_table(
+            'donor_stats',
+            sa.Column('donor_id', sa.Integer(), sa.ForeignKey('donors.id'), primary_key=True),
+            sa.Column('donation_count', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('amount_count', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('total_amount', sa.Numeric(14, 2), nullable=False, server_default='0'),
+            sa.Column('avg_amount', sa.Numeric(14, 2), nullable=True),
+            sa.Column('first_date', sa.Date(), nullable=True),
+            sa.Column('last_date', sa.Date(), nullable=True),
+            sa.Column('donor_class', sa.String(), nullable=False),
+        )
+    op.create_index('ix_donor_stats_donor_class', 'donor_stats', ['donor_class'], if_not_exists=True)
+
+    op.execute("""
+        INSERT INTO donor_stats (donor_id, donation_count, amount_count, total_amount,
+                                 avg_amount, first_date, last_date, donor_class)
+        SELECT donor_id, count(*), count(amount), coalesce(sum(amount), 0),
+               avg(amount), min(payment_date), max(payment_date),
+               CASE WHEN count(*) = 1 THEN 'single'
+                    WHEN count(*) <= 4 THEN 'periodic'
+                    ELSE 'frequent' END
+        FROM crm_entries
+        WHERE donor_id IS NOT NULL
+        GROUP BY donor_id
+        ON CONFLICT (donor_id) DO NOTHING
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('donor_stats')
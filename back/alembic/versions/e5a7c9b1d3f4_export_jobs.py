@@ -0,0 +1,43 @@
+"""export_jobs: background CRM export jobs
+
+Revision ID: e5a7c9b1d3f4
+Revises: d2f4b6a8c0e1
+Create Date: 2025-07-21 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a7c9b1d3f4'
+down_revision: Union[str, None] = 'd2f4b6a8c0e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not sa.inspect(op.get_bind()).has_table('export_jobs'):
+        op.create_table(
+            'export_jobs',
+            sa.Column('id', sa.String(), primary_key=True),
+            sa.Column('params_key', sa.String(), nullable=False),
+            sa.Column('params', sa.JSON(), nullable=True),
+            sa.Column('format', sa.String(), nullable=False),
+            sa.Column('status', sa.String(), nullable=False),
+            sa.Column('rows_written', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('total_rows', sa.Integer(), nullable=True),
+            sa.Column('file_path', sa.String(), nullable=True),
+            sa.Column('error', sa.String(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.Column('expires_at', sa.DateTime(), nullable=True),
+        )
+    op.create_index('ix_export_jobs_params_key', 'export_jobs', ['params_key'], if_not_exists=True)
+    op.create_index('ix_export_jobs_status', 'export_jobs', ['status'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_table('export_jobs')
@@ -0,0 +1,41 @@
+"""import_jobs: background /upload_excel jobs
+
+Revision ID: f8b0d2e4a6c7
+Revises: e5a7c9b1d3f4
+Create Date: 2025-07-23 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f8b0d2e4a6c7'
+down_revision: Union[str, None] = 'e5a7c9b1d3f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not sa.inspect(op.get_bind()).has_table('import_jobs'):
+        op.create_table(
+            'import_jobs',
+            sa.Column('id', sa.String(), primary_key=True),
+            sa.Column('source', sa.String(), nullable=True),
+            sa.Column('files', sa.JSON(), nullable=True),
+            sa.Column('status', sa.String(), nullable=False),
+            sa.Column('rows_parsed', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('rows_inserted', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('rows_rejected', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('sheet_errors', sa.JSON(), nullable=True),
+            sa.Column('error', sa.String(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+        )
+    op.create_index('ix_import_jobs_status', 'import_jobs', ['status'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_table('import_jobs')
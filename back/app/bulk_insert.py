@@ -0,0 +1,152 @@
+"""Массовая запись строк CRM в базу.
+
+Для PostgreSQL (psycopg2) строки потоково передаются через COPY пачками во
+временную таблицу и переносятся в crm_entries одним INSERT ... SELECT
+... ON CONFLICT (row_hash) DO NOTHING; для остальных драйверов используется
+insert() ... ON CONFLICT DO NOTHING с executemany. Строки, уже лежащие в
+базе (тот же row_hash), пропускаются. Вся запись идёт в одной транзакции
+сессии — commit/rollback остаются за вызывающим.
+"""
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Callable, Iterable
+
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .crm_fields import extract_payment_fields, payment_hash
+from .source_profiles import SourceProfile
+from .donors import DonorResolver, refresh_donor_stats
+from .models import CRMEntry
+from .rollups import refresh_rollups
+from .versions import CRM_ENTRIES, bump_data_version
+
+logger = logging.getLogger(__name__)
+
+CRM_INSERT_BATCH_SIZE = int(os.getenv("CRM_INSERT_BATCH_SIZE", 5000))
+
+CRM_COLUMNS = [
+    "data", "source", "payment_date", "amount", "iin",
+    "fio_normalized", "email", "phone", "month", "year", "donor_id", "row_hash",
+]
+
+_COPY_NULL = r"\N"
+_INCOMING_TABLE = "crm_entries_incoming"
+
+
+def crm_row(data: dict, source: str | None, profile: SourceProfile | None = None) -> dict:
+    """Строка crm_entries со всеми каноническими колонками и ключом платежа.
+
+    profile — схема листа, определённая один раз на лист (см. source_profiles).
+    """
+    fields = extract_payment_fields(data, profile)
+    return {"data": data, "source": source or "import", **fields, "row_hash": payment_hash(data)}
+
+
+def insert_ignoring_conflicts(db: Session, model, index_elements: list[str]):
+    """insert(model) ... ON CONFLICT (index_elements) DO NOTHING для PostgreSQL и SQLite."""
+    dialects = {"postgresql": postgresql, "sqlite": sqlite}
+    dialect = dialects.get(db.get_bind().dialect.name)
+    if dialect is None:
+        return insert(model)
+    return dialect.insert(model).on_conflict_do_nothing(index_elements=index_elements)
+
+
+def _batches(rows: Iterable[dict], size: int):
+    it = iter(rows)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _copy_value(column: str, value):
+    if value is None:
+        return _COPY_NULL
+    if column == "data":
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return value
+
+
+def _copy_batch(cursor, batch: list[dict]) -> int:
+    """COPY пачки во временную таблицу и перенос новых строк; возвращает число записанных."""
+    columns = ", ".join(CRM_COLUMNS)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow([_copy_value(col, row.get(col)) for col in CRM_COLUMNS])
+    buffer.seek(0)
+    cursor.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS {_INCOMING_TABLE} ON COMMIT DROP AS "
+        f"SELECT {columns} FROM {CRMEntry.__tablename__} WITH NO DATA"
+    )
+    cursor.execute(f"TRUNCATE {_INCOMING_TABLE}")
+    cursor.copy_expert(
+        f"COPY {_INCOMING_TABLE} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{_COPY_NULL}')",
+        buffer,
+    )
+    # ORDER BY ctid — id выдаются в порядке строк файла
+    cursor.execute(
+        f"INSERT INTO {CRMEntry.__tablename__} ({columns}) "
+        f"SELECT {columns} FROM {_INCOMING_TABLE} ORDER BY ctid "
+        f"ON CONFLICT (row_hash) DO NOTHING"
+    )
+    return cursor.rowcount
+
+
+def bulk_insert_crm_entries(
+    db: Session,
+    rows: Iterable[dict],
+    batch_size: int = CRM_INSERT_BATCH_SIZE,
+    progress: Callable[[int], None] | None = None,
+) -> dict:
+    """Записывает строки (см. crm_row) пачками по batch_size.
+
+    Перед записью каждой пачке проставляется donor_id, после записи
+    пересчитываются donor_stats затронутых доноров (см. donors.py) и
+    crm_rollups затронутых месяцев (см. rollups.py).
+    progress(saved) вызывается после каждой пачки.
+
+    Возвращает количество записанных и пропущенных (уже загруженных) строк,
+    время и скорость (rows/sec).
+    """
+    started = time.perf_counter()
+    saved = skipped = 0
+    use_copy = db.get_bind().dialect.driver == "psycopg2"
+    raw_connection = db.connection().connection.dbapi_connection
+    statement = insert_ignoring_conflicts(db, CRMEntry, ["row_hash"]).returning(CRMEntry.id)
+    donors = DonorResolver(db)
+    touched_donors = set()
+    touched_periods = set()
+    for batch in _batches(rows, batch_size):
+        donors.resolve(batch)
+        touched_donors.update(row["donor_id"] for row in batch)
+        touched_periods.update((row["year"], row["month"]) for row in batch)
+        if use_copy:
+            with raw_connection.cursor() as cursor:
+                inserted = _copy_batch(cursor, batch)
+        else:
+            inserted = len(db.execute(statement, batch).all())
+        saved += inserted
+        skipped += len(batch) - inserted
+        if progress:
+            progress(saved)
+    refresh_donor_stats(db, touched_donors)
+    if saved:
+        refresh_rollups(db, touched_periods)
+        bump_data_version(db, CRM_ENTRIES)
+
+    elapsed = time.perf_counter() - started
+    rows_per_sec = round(saved / elapsed, 1) if elapsed > 0 else None
+    logger.info(
+        "CRM bulk insert: %s rows in %.2fs (%s rows/sec), %s duplicates skipped",
+        saved, elapsed, rows_per_sec, skipped,
+    )
+    return {"saved": saved, "skipped": skipped, "seconds": round(elapsed, 3), "rows_per_sec": rows_per_sec}
@@ -1,45 +1,60 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
-from fastapi.responses import StreamingResponse
-import pandas as pd
-import io
+from fastapi import APIRouter, Depends, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from .database import SessionLocal, get_db
+from .database import get_db, get_async_db
 from .models import CRMEntry
-from datetime import datetime
-from dateutil.parser import parse as parse_date
-from collections import defaultdict
-import re
-import calendar
+from .crm_query import compile_crm_filter
+from .crm_fields import MONTH_NAMES
+from .donors import find_donor_ids, donor_stats_summary
+from .pagination import PageParams, paginate_select, set_page_headers, cached_count_async
+from .versions import CRM_ENTRIES
+from .streaming import wants_stream, ndjson_response, STREAM_FETCH_SIZE
+from .export_engine import export_response
+from .rollups import rollup_query, rollup_to_row
+from .response_cache import cached_json_async
 
 router = APIRouter()
 
+def entry_to_row(entry: CRMEntry) -> dict:
+    """Строка ответа /crm: data + месяц (вычислен при загрузке) + источник."""
+    data = entry.data.copy()
+    if entry.payment_date:
+        data['month'] = MONTH_NAMES[entry.month - 1]
+    data['source'] = entry.source
+    return data
+
+
+def crm_filter_query(db: Session, **filters):
+    """Запрос записей CRM под фильтры /crm/filter и ключ этих фильтров для кеша счётчиков."""
+    compiled = compile_crm_filter(**filters)
+    return compiled.apply(db.query(CRMEntry)), compiled.key
+
+
 @router.get("/crm", tags=["CRM"])
-def get_crm(db: Session = Depends(get_db)):
-    month_names = [
-        'Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
-        'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь'
-    ]
-    entries = db.query(CRMEntry).all()
-    result = []
-    for entry in entries:
-        data = entry.data.copy()
-        date_str = data.get('Дата') or data.get('Дата платежа') or data.get('Дата и время')
-        if date_str:
-            try:
-                if '.' in date_str or '/' in date_str:
-                    date_obj = parse_date(date_str, dayfirst=True)
-                else:
-                    date_obj = parse_date(date_str)
-                data['month'] = month_names[date_obj.month - 1]
-            except Exception:
-                pass
-        # Добавляем источник
-        data['source'] = entry.source if hasattr(entry, 'source') else None
-        result.append(data)
-    return result
+async def get_crm(
+    request: Request,
+    stream: bool = Query(False, description="Отдать все строки потоком NDJSON"),
+    page: PageParams = Depends(),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if wants_stream(request, stream):
+        return ndjson_response(lambda stream_db: stream_db.query(CRMEntry).order_by(CRMEntry.id), entry_to_row)
+
+    async def build(response: Response):
+        stmt = select(CRMEntry)
+        entries, has_more = await paginate_select(db, stmt, CRMEntry.id, page)
+        if page.enabled:
+            total = await cached_count_async(db, CRM_ENTRIES, (), stmt)
+            set_page_headers(response, entries[-1].id if entries else None, has_more, total)
+        return [entry_to_row(entry) for entry in entries]
+
+    # Ответ кешируется до следующей записи в crm_entries (см. response_cache)
+    return await cached_json_async(request, db, CRM_ENTRIES, build)
 
 @router.get("/crm/filter", tags=["CRM"])
-def filter_crm(
+async def filter_crm(
+    request: Request,
     year: int | None = Query(None),
     month: str | None = Query(None),
     amount_from: float | None = Query(None, description="Минимальная сумма (Сумма)"),
@@ -50,181 +65,62 @@ def filter_crm(
     type: list[str] | None = Query(None, description="Тип(ы) донатора: single/periodic/frequent"),
     gender: list[str] | None = Query(None, description="Гендер(ы): мужчина/женщина/неизвестно"),
     language: list[str] | None = Query(None, description="Язык(и): казахский/русский/английский/другой"),
-    db: Session = Depends(get_db)
+    stream: bool = Query(False, description="Отдать все строки потоком NDJSON"),
+    page: PageParams = Depends(),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    month_names = [
-        'Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
-        'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь'
-    ]
-    entries = db.query(CRMEntry).all()
-    result = []
-    for entry in entries:
-        data = entry.data.copy()
-        date_str = data.get('Дата') or data.get('Дата платежа') or data.get('Дата и время')
-        date_obj = None
-        if date_str:
-            try:
-                if '.' in date_str or '/' in date_str:
-                    date_obj = parse_date(date_str, dayfirst=True)
-                else:
-                    date_obj = parse_date(date_str)
-                data['month'] = month_names[date_obj.month - 1]
-            except Exception:
-                pass
-        # Добавляем источник
-        data['source'] = entry.source if hasattr(entry, 'source') else None
-        # Фильтрация по месяцу
-        if month:
-            month_query = month.strip().lower()
-            if data.get('month', '').strip().lower() != month_query:
-                continue
-        # Фильтрация по году
-        if year and date_obj:
-            if date_obj.year != year:
-                continue
-        # Фильтрация по дате
-        if date_from and date_to and date_obj:
-            try:
-                dt_from = parse_date(date_from, dayfirst=True)
-                dt_to = parse_date(date_to, dayfirst=True)
-                if not (dt_from <= date_obj <= dt_to):
-                    continue
-            except Exception:
-                continue
-        # Фильтрация по сумме
-        amount = None
-        for sum_field in ["Сумма", "Сумма операции", "Кредит", "Дебет"]:
-            if data.get(sum_field) is not None:
-                try:
-                    amount = float(data[sum_field])
-                    break
-                except Exception:
-                    pass
-        if amount_from is not None and (amount is None or amount < amount_from):
-            continue
-        if amount_to is not None and (amount is None or amount > amount_to):
-            continue
-        # Фильтрация по источнику
-        if source:
-            src_val = (data.get("source") or entry.source or "").strip().lower()
-            if src_val not in {s.strip().lower() for s in source}:
-                continue
-        # Фильтрация по полу
-        if gender:
-            g_val = (data.get("gender") or data.get("пол") or "").strip().lower()
-            if g_val not in {g.strip().lower() for g in gender}:
-                continue
-        # Фильтрация по языку
-        if language:
-            l_val = (data.get("language") or data.get("язык") or "").strip().lower()
-            if l_val not in {lang.strip().lower() for lang in language}:
-                continue
-        result.append(data)
-    # Группировка и фильтрация по типу донатора
-    if type:
-        from collections import defaultdict
-        accepted = {t.strip().lower() for t in type}
-        valid = {"single", "periodic", "frequent"}
-        accepted = accepted & valid
-        if accepted:
-            counter = defaultdict(list)
-            for row in result:
-                key_grp = row.get("ИИН") or row.get("ФИО") or row.get("E-mail & phone number") or row.get("Номер телефон ")
-                if key_grp:
-                    counter[key_grp].append(row)
-
-            temp_res = []
-            for rows in counter.values():
-                cnt = len(rows)
-                clazz = (
-                    "single" if cnt == 1 else
-                    "periodic" if 2 <= cnt <= 4 else
-                    "frequent"
-                )
-                if clazz in accepted:
-                    temp_res.extend(rows)
-            result = temp_res
-    return result
-
-def normalize(value: str | None) -> str | None:
-    """Приводит строку к нижнему регистру, убирает лишние пробелы/переводы строк."""
-    if not value or not isinstance(value, str):
-        return None
-    return re.sub(r"\s+", " ", value).strip().lower()
-
-
-def extract_fio_iin(sender_str: str | None):
-    """Возвращает (fio, iin) из составной строки отправителя."""
-    fio = None
-    iin = None
-    if sender_str:
-        # Первая строка до перевода строки обычно содержит ФИО
-        fio = sender_str.split('\n')[0].strip()
-        match = re.search(r'(?:ИИН|БИН): ?(\d{10,12})', sender_str, re.IGNORECASE)
-        if match:
-            iin = match.group(1)
-    return fio, iin
+    # Все условия фильтра выполняются в PostgreSQL, из базы приходят только подходящие строки;
+    # тип донатора — join с donor_stats вместо перегруппировки результата.
+    # Параметры разбираются один раз, тот же фильтр идёт в поток, страницу и счётчик.
+    compiled = compile_crm_filter(
+        year=year,
+        month=month,
+        amount_from=amount_from,
+        amount_to=amount_to,
+        date_from=date_from,
+        date_to=date_to,
+        source=source,
+        gender=gender,
+        language=language,
+        type=type,
+    )
+    if wants_stream(request, stream):
+        return ndjson_response(
+            lambda stream_db: compiled.apply(stream_db.query(CRMEntry)).order_by(CRMEntry.id),
+            entry_to_row,
+        )
+
+    async def build(response: Response):
+        stmt = compiled.apply(select(CRMEntry))
+        entries, has_more = await paginate_select(db, stmt, CRMEntry.id, page)
+        if page.enabled:
+            total = await cached_count_async(db, CRM_ENTRIES, compiled.key, stmt)
+            set_page_headers(response, entries[-1].id if entries else None, has_more, total)
+        return [entry_to_row(entry) for entry in entries]
+
+    return await cached_json_async(request, db, CRM_ENTRIES, build)
 
 @router.get("/crm/donator_profile", tags=["CRM"])
-def donator_profile(key: str = Query(...), db: Session = Depends(get_db)):
-    """Ищет донора по произвольному ключу (ФИО, ИИН, email, телефон, либо любая
-    подстрока в поле "Отправитель ...").
-
-    Алгоритм поиска:
-    1. Нормализуем key (нижний регистр, trim).  
-    2. Проходим все записи, для каждой собираем возможные значения (ИИН, ФИО,
-       email/телефон, а также извлекаем fio/iin из поля отправителя).  
-    3. Сравниваем нормализованные строки; совпадение при exact == или если одна
-       строка является подстрокой другой.  
-    4. Если среди найденных записей обнаружен ИИН – расширяем выборку всеми
-       записями с тем же ИИН.
+async def donator_profile(request: Request, key: str = Query(...), db: AsyncSession = Depends(get_async_db)):
+    """Ищет донора по произвольному ключу (ФИО, ИИН, email, телефон).
+
+    Записи привязаны к донорам при загрузке (crm_entries.donor_id), поэтому:
+    1. По индексам таблицы donors находим доноров: точное совпадение ИИН,
+       телефона, email или нормализованного ФИО, иначе подстрока ФИО/email.
+    2. Все записи найденных доноров берём одним запросом по donor_id —
+       записи с тем же ИИН уже относятся к одному донору.
+    3. Статистика берётся из donor_stats.
     """
-    entries = db.query(CRMEntry).all()
-    norm_key = normalize(key)
-
-    donations: list[dict] = []
-    found_iin: str | None = None
-
-    for entry in entries:
-        data = entry.data
-
-        candidates: list[str | None] = [
-            data.get("ИИН"),
-            data.get("ФИО"),
-            data.get("E-mail & phone number"),
-            data.get("Номер телефон "),
-        ]
+    return await cached_json_async(request, db, CRM_ENTRIES, lambda response: _donator_profile(key, db))
 
-        # Добавляем данные из поля Отправитель
-        sender_raw = data.get("Отправитель (Наименование, БИК, ИИК, БИН/ИИН)")
-        fio_from_sender, iin_from_sender = extract_fio_iin(sender_raw)
-        candidates.extend([fio_from_sender, iin_from_sender, sender_raw])
 
-        matched = False
-        for cand in candidates:
-            norm_cand = normalize(str(cand)) if cand is not None else None
-            if norm_cand and (
-                norm_cand == norm_key or
-                norm_key in norm_cand or
-                norm_cand in norm_key
-            ):
-                matched = True
-                break
-
-        if matched:
-            donations.append(data)
-            if data.get("ИИН"):
-                found_iin = str(data.get("ИИН"))
-            elif iin_from_sender:
-                found_iin = iin_from_sender
-
-    # Если нашли ИИН — собираем все записи с тем же ИИН для полноты
-    if found_iin:
-        donations = [
-            d.data for d in entries
-            if str(d.data.get("ИИН", "")) == found_iin or
-               extract_fio_iin(d.data.get("Отправитель (Наименование, БИК, ИИК, БИН/ИИН)"))[1] == found_iin
-        ]
+async def _donator_profile(key: str, db: AsyncSession) -> dict:
+    # Поиск донора и сводка — общие sync-функции, выполняются через run_sync той же сессии
+    donor_ids = await db.run_sync(find_donor_ids, key)
+    donations: list[dict] = []
+    if donor_ids:
+        stmt = select(CRMEntry.data).where(CRMEntry.donor_id.in_(donor_ids)).order_by(CRMEntry.id)
+        donations = list(await db.scalars(stmt))
     if not donations:
         return {"error": "Donator not found"}
     donator_info = {
@@ -232,33 +128,45 @@ def donator_profile(key: str = Query(...), db: Session = Depends(get_db)):
         "ФИО": donations[0].get("ФИО"),
         "E-mail & phone number": donations[0].get("E-mail & phone number")
     }
-    amounts = []
-    dates = []
-    for d in donations:
-        for sum_field in ["Сумма", "Сумма операции", "Кредит", "Дебет"]:
-            if d.get(sum_field) is not None:
-                try:
-                    amounts.append(float(d[sum_field]))
-                    break
-                except Exception:
-                    pass
-        for date_field in ["Дата", "Дата платежа", "Дата и время"]:
-            if d.get(date_field):
-                dates.append(str(d[date_field]))
-                break
-    stats = {
-        "total_count": len(donations),
-        "total_amount": sum(amounts) if amounts else 0,
-        "average_amount": sum(amounts)/len(amounts) if amounts else 0,
-        "first_donation": min(dates) if dates else None,
-        "last_donation": max(dates) if dates else None
-    }
+    # Агрегаты поддерживаются при загрузке (donor_stats), повторно не считаются
+    stats = await db.run_sync(donor_stats_summary, donor_ids)
     return {
         "donator_info": donator_info,
         "donations": donations,
         "stats": stats
     }
 
+@router.get("/crm/analytics", tags=["CRM"])
+async def crm_analytics(
+    request: Request,
+    year: int | None = Query(None),
+    month: str | None = Query(None),
+    source: list[str] | None = Query(None, description="Источник(и)"),
+    gender: list[str] | None = Query(None, description="Гендер(ы)"),
+    language: list[str] | None = Query(None, description="Язык(и)"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Сводка для дашборда: месяц × источник × пол × язык из crm_rollups.
+
+    unique_donors считается внутри ячейки; суммировать его между ячейками нельзя.
+    """
+    async def build(response: Response):
+        stmt = rollup_query(year=year, month=month, source=source, gender=gender, language=language)
+        rollups = [] if stmt is None else list(await db.scalars(stmt))
+        total_amount = sum(rollup.total_amount for rollup in rollups)
+        amount_count = sum(rollup.amount_count for rollup in rollups)
+        return {
+            "rows": [rollup_to_row(rollup) for rollup in rollups],
+            "totals": {
+                "count": sum(rollup.entry_count for rollup in rollups),
+                "total_amount": float(total_amount),
+                "average_gift": float(total_amount / amount_count) if amount_count else 0,
+            },
+        }
+
+    # crm_rollups меняется в тех же транзакциях, что и версия crm_entries
+    return await cached_json_async(request, db, CRM_ENTRIES, build)
+
 # ========================= Экспорт CRM в Excel =========================
 
 @router.get("/crm/export_excel", tags=["CRM"])
@@ -273,12 +181,14 @@ def export_crm_excel(
     type: str = Query(None, regex="^(single|periodic|frequent)$"),
     gender: str = Query(None),
     language: str = Query(None),
+    format: str = Query("xlsx", pattern="^(xlsx|csv|parquet)$", description="xlsx / csv / parquet"),
     db: Session = Depends(get_db)
 ):
-    """Формирует Excel-файл с теми же фильтрами, что и /crm/filter."""
+    """Формирует Excel-файл (или csv/parquet) с теми же фильтрами, что и /crm/filter."""
 
     # Получаем данные тем же способом, что /crm/filter
-    rows = filter_crm(
+    query, _ = crm_filter_query(
+        db,
         year=year,
         month=month,
         amount_from=amount_from,
@@ -289,32 +199,9 @@ def export_crm_excel(
         type=type,
         gender=gender,
         language=language,
-        db=db,
-    )
-
-    if not rows:
-        raise HTTPException(status_code=404, detail="Нет данных под выбранные фильтры")
-
-    df = pd.DataFrame(rows)
-    buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False)
-    buffer.seek(0)
-
-    return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=crm_filtered.xlsx"},
     )
+    # Строки идут из курсора прямо в файл экспорта (см. export_engine)
+    rows = (entry_to_row(entry) for entry in query.order_by(CRMEntry.id).yield_per(STREAM_FETCH_SIZE))
+    return export_response(rows, format, "crm_filtered")
 
 # (эндпоинт /crm/combined_users_excel удалён по требованию)
-
-def hit(cand: str | None, key: str) -> bool:
-    if not cand:
-        return False
-    if key.isdigit() and len(key) in (10, 12):      # ИИН/БИН
-        return cand == key
-    if "@" in key:                                  # e-mail
-        return cand == key
-    # ФИО – допускаем подстроку
-    return key in cand or cand in key
@@ -0,0 +1,177 @@
+"""Извлечение канонических полей платежа из CRMEntry.data.
+
+Поля вычисляются один раз при загрузке (upload_excel, manual_crm_entry)
+и хранятся в типизированных колонках crm_entries, поэтому при чтении
+больше не нужно заново разбирать даты и суммы из JSON.
+"""
+import hashlib
+import json
+import math
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from .dates import parse_date
+from .source_profiles import ROW_HASH_COLUMNS, SourceProfile, detect_profile
+
+MONTH_NAMES = [
+    'Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
+    'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь'
+]
+
+_IIN_RE = re.compile(r'(?:ИИН|БИН): ?(\d{10,12})', re.IGNORECASE)
+_EMAIL_RE = re.compile(r'[^\s@,;]+@[^\s@,;]+')
+_PHONE_RE = re.compile(r'\+?\d[\d\s\-()]{8,}\d')
+
+
+def normalize(value: str | None) -> str | None:
+    """Приводит строку к нижнему регистру, убирает лишние пробелы/переводы строк."""
+    if not value or not isinstance(value, str):
+        return None
+    return re.sub(r"\s+", " ", value).strip().lower()
+
+
+def extract_fio_iin(sender_str: str | None):
+    """Возвращает (fio, iin) из составной строки отправителя."""
+    fio = None
+    iin = None
+    if sender_str:
+        # Первая строка до перевода строки обычно содержит ФИО
+        fio = sender_str.split('\n')[0].strip()
+        match = _IIN_RE.search(sender_str)
+        if match:
+            iin = match.group(1)
+    return fio, iin
+
+
+def _as_text(value) -> str | None:
+    """Строковое представление значения из Excel (990823401201.0 -> '990823401201')."""
+    if value is None:
+        return None
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return None
+        if value.is_integer():
+            value = int(value)
+    text = str(value).strip()
+    return text or None
+
+
+def parse_payment_date(value) -> date | None:
+    """Дата платежа из ячейки выгрузки (см. dates.parse_date)."""
+    return parse_date(value)
+
+
+def parse_amount(data: dict, profile: SourceProfile | None = None) -> Decimal | None:
+    """Первое поле суммы, которое приводится к числу."""
+    profile = profile or detect_profile(data)
+    return _first_amount(data, profile.columns["amount"])
+
+
+def _first_amount(data: dict, columns) -> Decimal | None:
+    for sum_field in columns:
+        value = data.get(sum_field)
+        if value is None:
+            continue
+        try:
+            amount = Decimal(str(value).strip())
+        except InvalidOperation:
+            continue
+        if amount.is_finite():
+            return amount
+    return None
+
+
+def _digits(value) -> str | None:
+    text = _as_text(value)
+    if not text:
+        return None
+    digits = re.sub(r'\D', '', text)
+    return digits or None
+
+
+def extract_payment_fields(data: dict, profile: SourceProfile | None = None) -> dict:
+    """Канонические колонки CRMEntry, вычисленные из data.
+
+    profile — схема листа (см. source_profiles); без неё определяется по ключам строки.
+    """
+    profile = profile or detect_profile(data)
+    payment_date = parse_payment_date(profile.first(data, "date"))
+
+    sender_fio, sender_iin = extract_fio_iin(_as_text(profile.first(data, "sender")))
+    iin = _digits(profile.first(data, "iin")) or sender_iin
+    fio = _as_text(profile.first(data, "fio")) or sender_fio
+
+    email = None
+    for field in profile.columns["email"]:
+        match = _EMAIL_RE.search(_as_text(data.get(field)) or '')
+        if match:
+            email = match.group(0).lower()
+            break
+
+    phone = None
+    for field in profile.columns["phone"]:
+        match = _PHONE_RE.search(_as_text(data.get(field)) or '')
+        if match:
+            phone = normalize_phone(match.group(0))
+            break
+
+    if payment_date:
+        month = payment_date.month
+    else:
+        stored = str(data.get('month') or '').strip().capitalize()
+        month = MONTH_NAMES.index(stored) + 1 if stored in MONTH_NAMES else None
+
+    return {
+        "payment_date": payment_date,
+        "amount": parse_amount(data, profile),
+        "iin": iin,
+        "fio_normalized": normalize(fio),
+        "email": email,
+        "phone": phone,
+        "month": month,
+        "year": payment_date.year if payment_date else None,
+    }
+
+
+def normalize_phone(value) -> str | None:
+    """Оставляет только цифры, 8XXXXXXXXXX приводится к 7XXXXXXXXXX."""
+    digits = _digits(value)
+    if digits and len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    return digits
+
+
+def _first_text(data: dict, columns) -> str | None:
+    return next((_as_text(data.get(field)) for field in columns if _as_text(data.get(field))), None)
+
+
+def payment_hash(data: dict) -> str:
+    """Стабильный ключ платежа для дедупликации загрузок (crm_entries.row_hash).
+
+    Если в строке есть идентификатор платежа банка — ключ строится по нему,
+    дате, сумме и ИИН. Иначе — по всему содержимому строки: два разных
+    пожертвования на одну сумму в один день не должны склеиться.
+    Колонки берутся по ROW_HASH_COLUMNS, а не по профилю листа: ключ не
+    должен меняться при добавлении синонимов в реестр.
+    """
+    payment_id = _first_text(data, ROW_HASH_COLUMNS["payment_id"])
+    if payment_id:
+        payment_date = next(
+            (parse_payment_date(data[field]) for field in ROW_HASH_COLUMNS["date"] if data.get(field)), None
+        )
+        amount = _first_amount(data, ROW_HASH_COLUMNS["amount"])
+        _, sender_iin = extract_fio_iin(_first_text(data, ROW_HASH_COLUMNS["sender"]))
+        iin = _digits(_first_text(data, ROW_HASH_COLUMNS["iin"])) or sender_iin
+        parts = [
+            "id",
+            payment_id,
+            payment_date.isoformat() if payment_date else "",
+            # Как в колонке amount Numeric(14, 2)
+            str(amount.quantize(Decimal("0.01"))) if amount is not None else "",
+            iin or "",
+        ]
+        raw = "\x1f".join(parts)
+    else:
+        raw = "row\x1f" + json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
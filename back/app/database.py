@@ -1,13 +1,63 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
 from dotenv import load_dotenv
+from functools import lru_cache
 import os
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# По умолчанию тот же адрес с async-драйвером (postgresql -> postgresql+asyncpg)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# Настройки пула соединений (для каждого из двух движков)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+# statement_timeout PostgreSQL в миллисекундах; 0 — без ограничения
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+
+_ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+# Ключ pg_advisory_xact_lock для записи в crm_entries, donors и производные таблицы
+CRM_WRITE_LOCK = 0x43524D57
+
+
+def _is_postgres(url) -> bool:
+    return url.get_backend_name() == "postgresql"
+
+
+def _pool_options(url) -> dict:
+    # У SQLite свой пул без этих параметров
+    if url.get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def _sync_connect_args(url) -> dict:
+    if _is_postgres(url) and DB_STATEMENT_TIMEOUT_MS:
+        return {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return {}
+
+
+def _async_connect_args(url) -> dict:
+    if _is_postgres(url) and DB_STATEMENT_TIMEOUT_MS:
+        return {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+    return {}
+
+
+_url = make_url(DATABASE_URL)
+engine = create_engine(DATABASE_URL, connect_args=_sync_connect_args(_url), **_pool_options(_url))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -17,3 +67,36 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def lock_crm_writes(db: Session):
+    """Ждёт и держит до commit/rollback общую блокировку записи CRM.
+
+    Загрузки и ручной ввод во всех воркерах по очереди определяют и
+    создают доноров и пересчитывают агрегаты. Повторный вызов в той же
+    транзакции не ждёт. SQLite и так пускает писателей по одному.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(select(func.pg_advisory_xact_lock(CRM_WRITE_LOCK)))
+
+
+def async_database_url():
+    if ASYNC_DATABASE_URL:
+        return make_url(ASYNC_DATABASE_URL)
+    return _url.set(drivername=_ASYNC_DRIVERS.get(_url.get_backend_name(), _url.drivername))
+
+
+@lru_cache(maxsize=None)
+def get_async_engine():
+    """Async-движок (asyncpg) для горячих эндпоинтов чтения; создаётся при первом запросе."""
+    url = async_database_url()
+    return create_async_engine(url, connect_args=_async_connect_args(url), **_pool_options(url))
+
+
+# Объекты после commit не перечитываются: ленивой загрузки в async-сессии нет
+AsyncSessionLocal = async_sessionmaker(class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal(bind=get_async_engine()) as db:
+        yield db
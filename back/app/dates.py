@@ -0,0 +1,96 @@
+"""Общий разбор дат из выгрузок и параметров запросов.
+
+Сначала проверяются фиксированные форматы выгрузок — DD.MM.YYYY,
+DD/MM/YYYY и ISO (YYYY-MM-DD), — срезами строки, без strptime и dateutil.
+Только непохожие строки уходят в dateutil (dayfirst для дат с точками и
+слешами). В выгрузке одни и те же даты повторяются тысячи раз, поэтому
+результат разбора строки запоминается в ограниченном кеше.
+
+parse_date_column — тот же разбор для целой колонки pandas: фиксированные
+форматы векторно, остальное — по уникальным значениям через кеш.
+"""
+import math
+import os
+from datetime import date, datetime
+from functools import lru_cache
+
+import pandas as pd
+from dateutil.parser import parse as dateutil_parse
+
+DATE_CACHE_SIZE = int(os.getenv("DATE_CACHE_SIZE", 65536))
+
+# Форматы для векторного разбора колонки, в порядке частоты в выгрузках
+COLUMN_FORMATS = ("%d.%m.%Y", "%d/%m/%Y", "ISO8601")
+
+
+def _fixed_format(text: str) -> date | None:
+    """DD.MM.YYYY, DD/MM/YYYY или YYYY-MM-DD (YYYY/MM/DD) в начале строки; время после даты не важно."""
+    if len(text) < 10 or (len(text) > 10 and text[10] not in " T"):
+        return None
+    if text[2] in "./" and text[5] == text[2]:
+        day, month, year = text[0:2], text[3:5], text[6:10]
+    elif text[4] in "-/." and text[7] == text[4]:
+        year, month, day = text[0:4], text[5:7], text[8:10]
+    else:
+        return None
+    if not (day.isdigit() and month.isdigit() and year.isdigit()):
+        return None
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse_text(text: str) -> date | None:
+    parsed = _fixed_format(text)
+    if parsed is not None:
+        return parsed
+    try:
+        if '.' in text or '/' in text:
+            return dateutil_parse(text, dayfirst=True).date()
+        return dateutil_parse(text).date()
+    except Exception:
+        return None
+
+
+def parse_date(value) -> date | None:
+    """Дата из значения ячейки или параметра; None — пусто или не разобрано."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return None if value is pd.NaT else value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    text = str(value).strip()
+    if not text or text.lower() in ('nan', 'nat', 'none'):
+        return None
+    return _parse_text(text)
+
+
+def parse_date_column(col: pd.Series) -> pd.Series:
+    """Векторный разбор колонки в datetime64; неразобранные значения — NaT."""
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col
+    text = col.astype(str).str.strip().where(col.notna())
+    parsed = pd.Series(pd.NaT, index=col.index, dtype="datetime64[ns]")
+    missing = text.notna()
+    for fmt in COLUMN_FORMATS:
+        if not missing.any():
+            return parsed
+        if fmt == "ISO8601":
+            # Смещения часового пояса приводятся к UTC и отбрасываются
+            values = pd.to_datetime(text[missing], format=fmt, errors='coerce', utc=True).dt.tz_localize(None)
+        else:
+            # exact=False: время после даты («01.03.2025 10:15») не мешает
+            values = pd.to_datetime(text[missing], format=fmt, errors='coerce', exact=False)
+        parsed[missing] = values
+        missing = parsed.isna() & text.notna()
+    if missing.any():
+        # Редкие форматы — по уникальным строкам через тот же кеш
+        rest = text[missing]
+        lookup = {value: _parse_text(value) for value in rest.unique()}
+        parsed[missing] = pd.to_datetime(rest.map(lookup), errors='coerce')
+    return parsed
@@ -0,0 +1,187 @@
+"""Привязка записей CRM к донорам.
+
+При загрузке каждой строке crm_entries проставляется donor_id. Донор
+определяется по старшему из заполненных ключей: ИИН, нормализованное
+ФИО, email, телефон. Профиль донора после этого ищется одним
+индексированным запросом, без перебора всей таблицы.
+
+Агрегаты по донору (число и сумма пожертвований, даты, класс
+single/periodic/frequent) хранятся в donor_stats и пересчитываются только
+для доноров, затронутых записью.
+"""
+from typing import Iterable
+
+from sqlalchemy import case, delete, func, insert, or_, select
+from sqlalchemy.orm import Session
+
+from .database import lock_crm_writes
+from .crm_fields import normalize, normalize_phone, _digits
+from .models import CRMEntry, Donor, DonorStats
+
+# Ключи личности донора в порядке старшинства
+IDENTITY_KEYS = ("iin", "fio_normalized", "email", "phone")
+
+
+class DonorResolver:
+    """Проставляет donor_id строкам (см. bulk_insert.crm_row) и создаёт недостающих доноров.
+
+    Держит соответствие ключ -> donor_id на время одной загрузки, поэтому
+    каждая пачка стоит один SELECT по известным ключам и один INSERT новых доноров.
+    До первого SELECT берётся блокировка записи CRM (database.lock_crm_writes):
+    параллельная загрузка или ручной ввод в другом воркере ждут commit и
+    видят уже созданных доноров, а не создают второго с тем же ключом.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.known = {key: {} for key in IDENTITY_KEYS}
+        self.locked = False
+
+    def _remember(self, donor_id: int, identity: dict):
+        for key in IDENTITY_KEYS:
+            value = identity.get(key)
+            if value:
+                self.known[key].setdefault(value, donor_id)
+
+    def _load(self, rows: list[dict]):
+        conditions = []
+        for key in IDENTITY_KEYS:
+            values = {row[key] for row in rows if row.get(key)} - self.known[key].keys()
+            if values:
+                conditions.append(getattr(Donor, key).in_(values))
+        if not conditions:
+            return
+        for donor in self.db.query(Donor).filter(or_(*conditions)).order_by(Donor.id):
+            self._remember(donor.id, {key: getattr(donor, key) for key in IDENTITY_KEYS})
+
+    def _match(self, row: dict) -> int | None:
+        # Решает старший из заполненных ключей: строка с ИИН не приклеивается
+        # к донору с другим ИИН по ФИО, строка с ФИО — к другому ФИО по email
+        for key in IDENTITY_KEYS:
+            value = row.get(key)
+            if value:
+                return self.known[key].get(value)
+        return None
+
+    def resolve(self, rows: list[dict]):
+        """Заполняет row["donor_id"]; строки без ключей остаются без донора."""
+        if not self.locked:
+            lock_crm_writes(self.db)
+            self.locked = True
+        self._load(rows)
+        new_donors = []
+        for row in rows:
+            identity = {key: row.get(key) for key in IDENTITY_KEYS}
+            if not any(identity.values()):
+                row["donor_id"] = None
+                continue
+            donor_id = self._match(row)
+            if donor_id is None:
+                # Временный отрицательный id, пока донор не записан в базу
+                new_donors.append(identity)
+                donor_id = -len(new_donors)
+                self._remember(donor_id, identity)
+            row["donor_id"] = donor_id
+
+        if not new_donors:
+            return
+        ids = self.db.execute(
+            insert(Donor).returning(Donor.id, sort_by_parameter_order=True), new_donors
+        ).scalars().all()
+        real = {-(i + 1): donor_id for i, donor_id in enumerate(ids)}
+        for mapping in self.known.values():
+            for value, donor_id in mapping.items():
+                if donor_id < 0:
+                    mapping[value] = real[donor_id]
+        for row in rows:
+            if row["donor_id"] is not None and row["donor_id"] < 0:
+                row["donor_id"] = real[row["donor_id"]]
+
+
+def find_donor_ids(db: Session, key: str) -> list[int]:
+    """Доноры по произвольному ключу: ИИН, телефон, email или ФИО.
+
+    Сначала точное совпадение по индексам, затем поиск подстроки в ФИО и
+    email (GIN-индекс pg_trgm обслуживает LIKE '%...%').
+    """
+    norm_key = normalize(key)
+    if not norm_key:
+        return []
+    conditions = [Donor.fio_normalized == norm_key, Donor.email == norm_key]
+    digits = _digits(key)
+    if digits:
+        conditions += [Donor.iin == digits, Donor.phone == normalize_phone(digits)]
+    ids = [donor_id for (donor_id,) in db.query(Donor.id).filter(or_(*conditions)).order_by(Donor.id)]
+    if ids:
+        return ids
+
+    pattern = "%" + norm_key.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    query = db.query(Donor.id).filter(or_(
+        Donor.fio_normalized.like(pattern, escape="\\"),
+        Donor.email.like(pattern, escape="\\"),
+    ))
+    return [donor_id for (donor_id,) in query.order_by(Donor.id)]
+
+
+# Класс донора по числу пожертвований — те же границы, что в /crm/filter
+def donor_class_expr(count):
+    return case(
+        (count == 1, "single"),
+        (count <= 4, "periodic"),
+        else_="frequent",
+    )
+
+
+DONOR_STATS_CHUNK = 5000
+
+
+def refresh_donor_stats(db: Session, donor_ids: Iterable[int]):
+    """Пересчитывает donor_stats только для переданных доноров.
+
+    Вызывается в той же транзакции после вставки, правки или удаления
+    записей crm_entries; commit остаётся за вызывающим. DELETE + INSERT
+    идут под блокировкой записи CRM, поэтому параллельные пересчёты одних
+    и тех же доноров не сталкиваются на первичном ключе donor_stats.
+    """
+    lock_crm_writes(db)
+    donor_ids = sorted({donor_id for donor_id in donor_ids if donor_id is not None})
+    for start in range(0, len(donor_ids), DONOR_STATS_CHUNK):
+        chunk = donor_ids[start:start + DONOR_STATS_CHUNK]
+        db.execute(delete(DonorStats).where(DonorStats.donor_id.in_(chunk)))
+        count = func.count(CRMEntry.id)
+        amount_count = func.count(CRMEntry.amount)
+        total = func.coalesce(func.sum(CRMEntry.amount), 0)
+        aggregates = (
+            select(
+                CRMEntry.donor_id,
+                count,
+                amount_count,
+                total,
+                func.avg(CRMEntry.amount),
+                func.min(CRMEntry.payment_date),
+                func.max(CRMEntry.payment_date),
+                donor_class_expr(count),
+            )
+            .where(CRMEntry.donor_id.in_(chunk))
+            .group_by(CRMEntry.donor_id)
+        )
+        db.execute(insert(DonorStats).from_select([
+            "donor_id", "donation_count", "amount_count", "total_amount",
+            "avg_amount", "first_date", "last_date", "donor_class",
+        ], aggregates))
+
+
+def donor_stats_summary(db: Session, donor_ids: list[int]) -> dict:
+    """Сводные агрегаты по одному или нескольким донорам из donor_stats."""
+    rows = db.query(DonorStats).filter(DonorStats.donor_id.in_(donor_ids)).all()
+    amount_count = sum(row.amount_count for row in rows)
+    total_amount = sum(row.total_amount for row in rows)
+    first_dates = [row.first_date for row in rows if row.first_date]
+    last_dates = [row.last_date for row in rows if row.last_date]
+    return {
+        "total_count": sum(row.donation_count for row in rows),
+        "total_amount": float(total_amount),
+        "average_amount": float(total_amount / amount_count) if amount_count else 0,
+        "first_donation": min(first_dates).isoformat() if first_dates else None,
+        "last_donation": max(last_dates).isoformat() if last_dates else None,
+    }
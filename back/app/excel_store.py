@@ -0,0 +1,257 @@
+"""Колоночный снимок таблицы excel_users для быстрой фильтрации.
+
+Снимок держит даты (datetime64), суммы (float64) и категориальные коды
+источника, пола, языка и ключа донора в массивах NumPy, поэтому каждый
+фильтр apply_filters — это одна булева маска. Строки-словари
+материализуются только для прошедших фильтр записей.
+
+Снимок перестраивается, когда меняется версия набора excel_users
+(см. versions.py), так что все воркеры видят одни и те же данные.
+Правки существующих строк (update_excel_users) воркер, который их
+сделал, после commit применяет к своему снимку на месте, без перезагрузки.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .fio_guess import effective_gender, effective_language
+from .models import ExcelUser
+from .versions import EXCEL_USERS, get_data_version
+
+
+def _codes(values: list) -> tuple[np.ndarray, dict]:
+    """Категориальные коды (-1 для None) и словарь значение -> код.
+
+    pandas выбирает самый узкий тип кодов (int8/int16), сравнения по ним дешёвые.
+    """
+    categorical = pd.Categorical(values)
+    lookup = {value: code for code, value in enumerate(categorical.categories)}
+    # Копия: codes у Categorical только для чтения, а правки меняют коды на месте
+    return categorical.codes.copy(), lookup
+
+
+def _derived(row: dict, source, guessed_gender, guessed_language) -> tuple:
+    """Источник, пол, язык и ключ донора строки так, как их сравнивают фильтры.
+
+    Догадки по ФИО берутся из колонок excel_users; ручные значения в строке важнее.
+    """
+    gender = effective_gender(row, guessed_gender)
+    language = effective_language(row, guessed_language)
+    return (
+        str(source or "").strip().lower(),
+        gender.strip().lower() if gender else "неизвестно",
+        language.strip().lower() if language else "неизвестно",
+        row.get("ФИО") or row.get("E-mail") or None,
+    )
+
+
+def user_record(user: ExcelUser) -> tuple:
+    """Запись для from_rows / apply_updates из строки excel_users."""
+    return (
+        {**(user.data or {}), "id": user.id}, user.payment_date, user.summa,
+        user.source, user.guessed_gender, user.guessed_language,
+    )
+
+
+class ExcelColumnStore:
+    def __init__(self, version: int, rows: list[dict], payment_dates: list, amounts: list,
+                 sources: list[str], genders: list[str], languages: list[str], group_keys: list):
+        self.version = version
+        self.rows = np.empty(len(rows), dtype=object)
+        self.rows[:] = rows
+        self.ids = np.array([row["id"] for row in rows], dtype=np.int64)
+        self.payment_date = pd.to_datetime(pd.Series(payment_dates, dtype=object)).to_numpy(dtype="datetime64[D]")
+        self.amount = np.array([np.nan if a is None else float(a) for a in amounts], dtype=np.float64)
+        self.source, self.source_lookup = _codes(sources)
+        self.gender, self.gender_lookup = _codes(genders)
+        self.language, self.language_lookup = _codes(languages)
+        # Коды доноров — intp, чтобы индексировать ими без приведения типа.
+        # Строки без ключа попадают в последнюю корзину, её размер всегда 0.
+        group, self.group_lookup = _codes(group_keys)
+        self.group_count = len(self.group_lookup)
+        self.group = group.astype(np.intp)
+        self.group[self.group < 0] = self.group_count
+        self.group_total = self._count_groups(self.group)
+        # Даты как целые дни: NaT — минимальное int64 и не проходит нижнюю границу
+        self.days = self.payment_date.view(np.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def from_rows(cls, version: int, records) -> "ExcelColumnStore":
+        """records — (строка, payment_date, сумма, источник, пол по ФИО, язык по ФИО)."""
+        rows, payment_dates, amounts, sources, genders, languages, group_keys = [], [], [], [], [], [], []
+        for row, payment_date, amount, source, guessed_gender, guessed_language in records:
+            source, gender, language, group_key = _derived(row, source, guessed_gender, guessed_language)
+            rows.append(row)
+            payment_dates.append(payment_date)
+            amounts.append(amount)
+            sources.append(source)
+            genders.append(gender)
+            languages.append(language)
+            group_keys.append(group_key)
+        return cls(version, rows, payment_dates, amounts, sources, genders, languages, group_keys)
+
+    @classmethod
+    def load(cls, db: Session, version: int) -> "ExcelColumnStore":
+        query = (
+            db.query(
+                ExcelUser.id, ExcelUser.data, ExcelUser.payment_date, ExcelUser.summa,
+                ExcelUser.source, ExcelUser.guessed_gender, ExcelUser.guessed_language,
+            )
+            .order_by(ExcelUser.id)
+            .yield_per(10000)
+        )
+        return cls.from_rows(version, (
+            ({**(data or {}), "id": user_id}, payment_date, summa, source, gender, language)
+            for user_id, data, payment_date, summa, source, gender, language in query
+        ))
+
+    def apply_updates(self, version: int, records) -> bool:
+        """Применяет правки существующих строк на месте и принимает версию version.
+
+        records — как у from_rows. False, если какой-то строки нет в снимке:
+        тогда снимок надо перестроить целиком.
+        """
+        positions = np.searchsorted(self.ids, [row["id"] for row, *_ in records])
+        if not all(p < len(self.ids) and self.ids[p] == row["id"] for p, (row, *_) in zip(positions, records)):
+            return False
+        for position, (row, payment_date, amount, source, guessed_gender, guessed_language) in zip(positions, records):
+            source, gender, language, group_key = _derived(row, source, guessed_gender, guessed_language)
+            self.rows[position] = row
+            # days — представление payment_date, запись сюда меняет и дату
+            self.days[position] = np.datetime64(payment_date if payment_date is not None else "NaT", "D").astype(np.int64)
+            self.amount[position] = np.nan if amount is None else float(amount)
+            self._set_code("source", position, source)
+            self._set_code("gender", position, gender)
+            self._set_code("language", position, language)
+            self._set_group(position, group_key)
+        self.version = version
+        return True
+
+    def _set_code(self, field: str, position: int, value):
+        codes = getattr(self, field)
+        lookup = getattr(self, f"{field}_lookup")
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(lookup)
+            if code > np.iinfo(codes.dtype).max:
+                codes = codes.astype(np.int32)
+                setattr(self, field, codes)
+        codes[position] = code
+
+    def _set_group(self, position: int, key):
+        if key is not None and key not in self.group_lookup:
+            # Новый донор занимает место корзины строк без ключа, корзина сдвигается
+            self.group_lookup[key] = self.group_count
+            self.group[self.group == self.group_count] = self.group_count + 1
+            self.group_count += 1
+            self.group_total = np.append(self.group_total, 0)
+        code = self.group_count if key is None else self.group_lookup[key]
+        previous = self.group[position]
+        if previous < self.group_count:
+            self.group_total[previous] -= 1
+        if code < self.group_count:
+            self.group_total[code] += 1
+        self.group[position] = code
+
+    def all(self) -> np.ndarray:
+        return np.ones(len(self.rows), dtype=bool)
+
+    def isin(self, field: str, values) -> np.ndarray:
+        """Маска строк, у которых категориальное поле (source/gender/language) входит в values."""
+        codes = getattr(self, field)
+        lookup = getattr(self, f"{field}_lookup")
+        mask = np.zeros(len(codes), dtype=bool)
+        for value in values:
+            if value in lookup:
+                mask |= codes == lookup[value]
+        return mask
+
+    def date_between(self, date_from, date_to) -> np.ndarray:
+        lower = np.datetime64(date_from, "D").astype(np.int64)
+        upper = np.datetime64(date_to, "D").astype(np.int64)
+        return (self.days >= lower) & (self.days <= upper)
+
+    def _count_groups(self, groups: np.ndarray) -> np.ndarray:
+        counts = np.bincount(groups, minlength=self.group_count + 1)
+        counts[self.group_count] = 0
+        return counts
+
+    def group_counts(self, mask: np.ndarray) -> np.ndarray:
+        """Число строк каждого донора среди mask; последняя корзина (без ключа) — 0."""
+        if mask.all():
+            return self.group_total
+        return self._count_groups(self.group[mask])
+
+    def by_group(self, groups: np.ndarray) -> np.ndarray:
+        """Маска строк по булевой маске доноров (результат над group_counts)."""
+        return groups[self.group]
+
+    def materialize(self, mask: np.ndarray) -> list[dict]:
+        return self.rows[mask].tolist()
+
+    def page(self, mask: np.ndarray, after_id: int | None, limit: int | None) -> tuple[list[dict], bool]:
+        """Строки mask с id > after_id, не больше limit, и признак следующей страницы."""
+        # Снимок упорядочен по id, поэтому начало страницы находится бинарным поиском
+        start = 0 if after_id is None else int(np.searchsorted(self.ids, after_id, side="right"))
+        positions = np.flatnonzero(mask[start:]) + start
+        has_more = limit is not None and len(positions) > limit
+        if limit is not None:
+            positions = positions[:limit]
+        return self.rows[positions].tolist(), has_more
+
+
+_store: ExcelColumnStore | None = None
+_store_lock = threading.Lock()
+# Ключ session.info для правок, ждущих commit
+_PENDING_UPDATES = "excel_store_updates"
+
+
+def get_excel_store(db: Session) -> ExcelColumnStore:
+    """Актуальный снимок excel_users; перестраивается при смене версии набора."""
+    global _store
+    version = get_data_version(db, EXCEL_USERS)
+    store = _store
+    if store is not None and store.version == version:
+        return store
+    with _store_lock:
+        if _store is None or _store.version != version:
+            _store = ExcelColumnStore.load(db, version)
+        return _store
+
+
+def queue_store_updates(db: Session, users: list[ExcelUser]):
+    """Запоминает правки строк, чтобы после commit применить их к снимку на месте.
+
+    Вызывается сразу после bump_data_version в той же транзакции: строка
+    data_versions заблокирована до commit, поэтому снимок версии version - 1
+    вместе с этими правками и есть снимок версии version.
+    """
+    version = get_data_version(db, EXCEL_USERS)
+    db.info.setdefault(_PENDING_UPDATES, []).append((version, [user_record(user) for user in users]))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending_updates(session: Session):
+    global _store
+    pending = session.info.pop(_PENDING_UPDATES, None)
+    if not pending:
+        return
+    with _store_lock:
+        for version, records in pending:
+            # Снимок отстал или ушёл вперёд — его перестроит get_excel_store
+            if _store is None or _store.version != version - 1:
+                return
+            if not _store.apply_updates(version, records):
+                _store = None
+                return
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending_updates(session: Session):
+    session.info.pop(_PENDING_UPDATES, None)
@@ -0,0 +1,160 @@
+"""Потоковое чтение больших Excel-файлов.
+
+Загруженный файл сначала сбрасывается во временный файл на диске, затем
+листы читаются построчно (openpyxl read_only для .xlsx, xlrd on_demand для
+.xls) и отдаются DataFrame-пачками фиксированного размера. Пиковая память
+не зависит от размера книги.
+"""
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator
+
+import pandas as pd
+import xlrd
+from fastapi import UploadFile
+from openpyxl import load_workbook
+
+EXCEL_CHUNK_ROWS = int(os.getenv("EXCEL_CHUNK_ROWS", 10000))
+
+
+def upload_suffix(file: UploadFile) -> str:
+    return os.path.splitext(file.filename or "")[1].lower() or ".xlsx"
+
+
+def save_upload(file: UploadFile, out) -> str:
+    """Копирует содержимое UploadFile в открытый файл out кусками по 1 МБ.
+
+    Возвращает sha256 содержимого — отпечаток файла для повторных загрузок.
+    """
+    digest = hashlib.sha256()
+    file.file.seek(0)
+    while chunk := file.file.read(1024 * 1024):
+        digest.update(chunk)
+        out.write(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def spooled_upload(file: UploadFile):
+    """Копирует UploadFile во временный файл и удаляет его после использования."""
+    tmp = tempfile.NamedTemporaryFile(suffix=upload_suffix(file), delete=False)
+    try:
+        with tmp:
+            save_upload(file, tmp)
+        yield tmp.name
+    finally:
+        os.unlink(tmp.name)
+
+
+def _is_xls(path: str) -> bool:
+    return path.lower().endswith(".xls")
+
+
+def _header(values) -> list[str]:
+    """Имена колонок как у pandas.read_excel: пустые -> 'Unnamed: i', повторы -> 'name.1'."""
+    header = []
+    seen: dict[str, int] = {}
+    for i, value in enumerate(values):
+        name = f"Unnamed: {i}" if value is None or value == "" else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        header.append(name)
+    return header
+
+
+def _chunks(rows: Iterator[tuple], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    header = None
+    buffer = []
+    yielded = False
+    for row in rows:
+        if header is None:
+            header = _header(row)
+            continue
+        if all(value is None or value == "" for value in row):
+            continue
+        # Строки в read_only-режиме могут быть короче или длиннее заголовка
+        width = len(header)
+        buffer.append(tuple(row[:width]) + (None,) * (width - len(row)))
+        if len(buffer) >= chunk_rows:
+            yield pd.DataFrame(buffer, columns=header)
+            yielded = True
+            buffer = []
+    if header is not None and (buffer or not yielded):
+        yield pd.DataFrame(buffer, columns=header)
+
+
+def _xls_rows(sheet, datemode) -> Iterator[tuple]:
+    for r in range(sheet.nrows):
+        row = []
+        for cell in sheet.row(r):
+            if cell.ctype == xlrd.XL_CELL_DATE:
+                row.append(xlrd.xldate.xldate_as_datetime(cell.value, datemode))
+            elif cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+                row.append(None)
+            else:
+                row.append(cell.value)
+        yield tuple(row)
+
+
+def sheet_headers(path: str) -> list[tuple[str, list[str]]]:
+    """(имя листа, колонки) для каждого листа с заголовком; строки данных не читаются.
+
+    Имена колонок те же, что у пачек iter_sheet_chunks.
+    """
+    headers = []
+    if _is_xls(path):
+        book = xlrd.open_workbook(path, on_demand=True)
+        try:
+            for name in book.sheet_names():
+                first = next(_xls_rows(book.sheet_by_name(name), book.datemode), None)
+                if first is not None:
+                    headers.append((name, _header(first)))
+                book.unload_sheet(name)
+        finally:
+            book.release_resources()
+        return headers
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            ws.reset_dimensions()
+            first = next(ws.iter_rows(values_only=True), None)
+            if first is not None:
+                headers.append((ws.title, _header(first)))
+    finally:
+        wb.close()
+    return headers
+
+
+def iter_sheet_chunks(path: str, chunk_rows: int = EXCEL_CHUNK_ROWS) -> Iterator[tuple[str, pd.DataFrame]]:
+    """Отдаёт (имя листа, DataFrame) пачками по chunk_rows строк.
+
+    Первая строка листа считается заголовком. У каждого листа есть хотя бы
+    одна (возможно пустая) пачка, чтобы вызывающий код видел его колонки.
+    """
+    if _is_xls(path):
+        book = xlrd.open_workbook(path, on_demand=True)
+        try:
+            for name in book.sheet_names():
+                sheet = book.sheet_by_name(name)
+                for chunk in _chunks(_xls_rows(sheet, book.datemode), chunk_rows):
+                    yield name, chunk
+                book.unload_sheet(name)
+        finally:
+            book.release_resources()
+        return
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            # Размеры листа в файле бывают неверными — читаем строки как есть
+            ws.reset_dimensions()
+            for chunk in _chunks(ws.iter_rows(values_only=True), chunk_rows):
+                yield ws.title, chunk
+    finally:
+        wb.close()
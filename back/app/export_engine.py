@@ -0,0 +1,178 @@
+"""Экспорт больших выборок в xlsx / csv / parquet без DataFrame в памяти.
+
+Строки проходят два шага:
+1. поток строк (курсор базы или снимок) пишется построчно во временный
+   NDJSON-файл, попутно собирается порядок колонок — как у pd.DataFrame(rows);
+2. из временного файла формируется результат: xlsx через openpyxl в режиме
+   write_only, csv через модуль csv, parquet через pyarrow (необязательная
+   зависимость) пачками по EXPORT_BATCH_ROWS строк.
+
+Результат пишется в SpooledTemporaryFile (мелкие файлы остаются в памяти,
+крупные уходят на диск) и отдаётся клиенту кусками.
+"""
+import csv
+import io
+import os
+import tempfile
+from typing import Callable, Iterable, Iterator
+
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from openpyxl import Workbook
+
+EXPORT_SPOOL_BYTES = int(os.getenv("EXPORT_SPOOL_BYTES", 16 * 1024 * 1024))
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", 10000))
+EXPORT_CHUNK_BYTES = 1024 * 1024
+
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class ExportError(ValueError):
+    """Экспорт в запрошенный формат невозможен."""
+
+
+class _Spool:
+    """Временный NDJSON со строками выборки, порядок колонок и их типы для parquet."""
+
+    def __init__(self, rows: Iterable[dict], progress: Callable[[int, int], None] | None = None):
+        self.file = tempfile.TemporaryFile()
+        self.columns: dict[str, set] = {}
+        self.count = 0
+        self.progress = progress
+        for row in rows:
+            if progress and self.count and self.count % EXPORT_BATCH_ROWS == 0:
+                progress(self.count, 0)
+            for key, value in row.items():
+                kinds = self.columns.setdefault(key, set())
+                if value is not None:
+                    kinds.add(type(value))
+            self.file.write(orjson.dumps(row, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE))
+            self.count += 1
+        if progress:
+            progress(self.count, 0)
+        self.file.seek(0)
+
+    def rows(self) -> Iterator[list]:
+        self.file.seek(0)
+        header = list(self.columns)
+        for written, line in enumerate(self.file):
+            if self.progress and written and written % EXPORT_BATCH_ROWS == 0:
+                self.progress(self.count, written)
+            row = orjson.loads(line)
+            yield [row.get(column) for column in header]
+
+    def close(self):
+        self.file.close()
+
+
+def _write_xlsx(spool: _Spool, out):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append(list(spool.columns))
+    for values in spool.rows():
+        ws.append([_cell(value) for value in values])
+    wb.save(out)
+
+
+def _cell(value):
+    # Списки и словари из JSON openpyxl записать не может — как pandas, пишем их строкой
+    if isinstance(value, (list, dict)):
+        return str(value)
+    return value
+
+
+def _write_csv(spool: _Spool, out):
+    text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text)
+    writer.writerow(list(spool.columns))
+    for values in spool.rows():
+        writer.writerow(["" if value is None else value for value in values])
+    text.flush()
+    text.detach()
+
+
+def _parquet_type(pa, kinds: set):
+    if kinds and kinds <= {bool}:
+        return pa.bool_()
+    if kinds and kinds <= {int}:
+        return pa.int64()
+    if kinds and kinds <= {int, float}:
+        return pa.float64()
+    return pa.string()
+
+
+def _write_parquet(spool: _Spool, out):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Экспорт в parquet требует пакет pyarrow")
+    schema = pa.schema([(name, _parquet_type(pa, kinds)) for name, kinds in spool.columns.items()])
+    as_text = [pa.types.is_string(field.type) for field in schema]
+    with pq.ParquetWriter(out, schema) as writer:
+        batch = []
+        for values in spool.rows():
+            batch.append([
+                str(value) if text and value is not None and not isinstance(value, str) else value
+                for value, text in zip(values, as_text)
+            ])
+            if len(batch) >= EXPORT_BATCH_ROWS:
+                writer.write_table(pa.Table.from_pylist([dict(zip(schema.names, row)) for row in batch], schema))
+                batch = []
+        if batch or not spool.count:
+            writer.write_table(pa.Table.from_pylist([dict(zip(schema.names, row)) for row in batch], schema))
+
+
+_WRITERS = {"xlsx": _write_xlsx, "csv": _write_csv, "parquet": _write_parquet}
+
+
+def write_export(rows: Iterable[dict], fmt: str, out, progress: Callable[[int, int], None] | None = None) -> int:
+    """Пишет строки в out в формате fmt, возвращает число строк.
+
+    progress(read, written) вызывается каждые EXPORT_BATCH_ROWS строк обоих
+    шагов: read — строк в NDJSON, written — переданных писателю формата.
+    """
+    if fmt not in _WRITERS:
+        raise ExportError(f"Неизвестный формат экспорта: {fmt}")
+    spool = _Spool(rows, progress)
+    try:
+        if spool.count:
+            _WRITERS[fmt](spool, out)
+        return spool.count
+    finally:
+        spool.close()
+
+
+def _iter_file(file) -> Iterator[bytes]:
+    try:
+        file.seek(0)
+        while chunk := file.read(EXPORT_CHUNK_BYTES):
+            yield chunk
+    finally:
+        file.close()
+
+
+def export_response(rows: Iterable[dict], fmt: str, filename: str) -> StreamingResponse:
+    """Ответ с файлом экспорта; 404, если строк нет, 400 — если формат недоступен."""
+    out = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    try:
+        written = write_export(rows, fmt, out)
+    except ExportError as e:
+        out.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        out.close()
+        raise
+    if not written:
+        out.close()
+        raise HTTPException(status_code=404, detail="Нет данных под выбранные фильтры")
+    return StreamingResponse(
+        _iter_file(out),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{fmt}"},
+    )
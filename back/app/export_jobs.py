@@ -0,0 +1,211 @@
+"""Фоновый экспорт CRM: задание, прогресс, ссылка на готовый файл.
+
+POST /crm/export_jobs ставит задание в пул потоков процесса (внешний брокер
+не нужен) и сразу отвечает его id. Воркер читает выборку курсором и пишет
+файл через export_engine в EXPORT_DIR, по ходу обновляя rows_read (шаг
+NDJSON) и rows_written (запись xlsx/csv/parquet). GET /crm/export_jobs/{id}
+отдаёт статус и процент (0–50% — чтение, 50–100% — запись), .../download — готовый
+файл. Файлы живут EXPORT_TTL_SECONDS, затем удаляются.
+
+Повторный запрос с теми же фильтрами и форматом при неизменных данных
+(версия crm_entries входит в ключ) возвращает уже существующее задание.
+"""
+import hashlib
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+
+from .crm import crm_filter_query, entry_to_row
+from .database import SessionLocal, get_db
+from .export_engine import EXPORT_FORMATS, write_export
+from .models import CRMEntry, ExportJob
+from .schemas import CRMExportJobCreate
+from .streaming import STREAM_FETCH_SIZE
+from .versions import CRM_ENTRIES, get_data_version
+
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", 2))
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_TTL_SECONDS = int(os.getenv("EXPORT_TTL_SECONDS", 3600))
+# Задание без обновления прогресса дольше этого считается брошенным (процесс перезапущен)
+EXPORT_STALE_SECONDS = int(os.getenv("EXPORT_STALE_SECONDS", 1800))
+
+QUEUED, RUNNING, DONE, FAILED, EXPIRED = "queued", "running", "done", "failed", "expired"
+
+router = APIRouter()
+_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+
+
+def _params_key(filters_key: tuple, fmt: str, version: int) -> str:
+    raw = json.dumps(["crm", list(filters_key), fmt, version], default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _set(db: Session, job_id: str, **values):
+    db.query(ExportJob).filter(ExportJob.id == job_id).update(
+        {**values, "updated_at": datetime.utcnow()}
+    )
+    db.commit()
+
+
+def _remove(path: str | None):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def _run_job(job_id: str):
+    # Отдельные сессии: данные читаются курсором, прогресс коммитится независимо
+    db = SessionLocal()
+    jobs_db = SessionLocal()
+    path = None
+    try:
+        job = jobs_db.get(ExportJob, job_id)
+        path = os.path.join(EXPORT_DIR, f"{job.id}.{job.format}")
+        query, _ = crm_filter_query(db, **job.params)
+        _set(jobs_db, job_id, status=RUNNING, total_rows=query.order_by(None).count())
+
+        rows = (entry_to_row(entry) for entry in query.order_by(CRMEntry.id).yield_per(STREAM_FETCH_SIZE))
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        # Пишем во временный файл: скачать можно только целиком записанный
+        with open(path + ".part", "wb") as out:
+            written = write_export(
+                rows, job.format, out,
+                lambda read, done: _set(jobs_db, job_id, rows_read=read, rows_written=done),
+            )
+        if not written:
+            _remove(path + ".part")
+            _set(jobs_db, job_id, status=FAILED, rows_written=0, error="Нет данных под выбранные фильтры")
+            return
+        os.replace(path + ".part", path)
+        _set(
+            jobs_db, job_id,
+            status=DONE,
+            rows_read=written,
+            rows_written=written,
+            total_rows=written,
+            file_path=path,
+            expires_at=datetime.utcnow() + timedelta(seconds=EXPORT_TTL_SECONDS),
+        )
+    except Exception as e:
+        jobs_db.rollback()
+        if path:
+            _remove(path + ".part")
+        _set(jobs_db, job_id, status=FAILED, error=str(e))
+    finally:
+        db.close()
+        jobs_db.close()
+
+
+def cleanup_expired_exports(db: Session):
+    """Удаляет файлы заданий с истёкшим сроком и помечает задания expired."""
+    expired = db.query(ExportJob).filter(
+        ExportJob.status == DONE,
+        ExportJob.expires_at <= datetime.utcnow(),
+    ).all()
+    for job in expired:
+        _remove(job.file_path)
+        job.status = EXPIRED
+        job.file_path = None
+    if expired:
+        db.commit()
+
+
+def _reusable(job: ExportJob, now: datetime) -> bool:
+    if job.status == DONE:
+        return job.expires_at > now and bool(job.file_path) and os.path.exists(job.file_path)
+    return job.updated_at > now - timedelta(seconds=EXPORT_STALE_SECONDS)
+
+
+def job_status(job: ExportJob) -> dict:
+    percent = None
+    if job.status == DONE:
+        percent = 100.0
+    elif job.total_rows:
+        # Оба шага проходят все строки: чтение — первая половина, запись — вторая
+        done = min(job.rows_read or 0, job.total_rows) + min(job.rows_written, job.total_rows)
+        percent = round(done / (2 * job.total_rows) * 100, 1)
+    elif job.total_rows == 0:
+        percent = 0.0
+    return {
+        "id": job.id,
+        "status": job.status,
+        "format": job.format,
+        "rows_read": job.rows_read or 0,
+        "rows_written": job.rows_written,
+        "total_rows": job.total_rows,
+        "percent": percent,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "expires_at": job.expires_at.isoformat() if job.expires_at else None,
+        "download_url": f"/api/crm/export_jobs/{job.id}/download" if job.status == DONE else None,
+    }
+
+
+@router.post("/crm/export_jobs", tags=["CRM"], status_code=202)
+def create_export_job(body: CRMExportJobCreate, db: Session = Depends(get_db)):
+    """Ставит экспорт /crm/export_excel в фон; те же фильтры, что у /crm/filter."""
+    cleanup_expired_exports(db)
+    params = body.model_dump(exclude={"format"})
+    _, filters_key = crm_filter_query(db, **params)
+    params_key = _params_key(filters_key, body.format, get_data_version(db, CRM_ENTRIES))
+
+    now = datetime.utcnow()
+    candidates = (
+        db.query(ExportJob)
+        .filter(ExportJob.params_key == params_key, ExportJob.status.in_([QUEUED, RUNNING, DONE]))
+        .order_by(ExportJob.created_at.desc())
+    )
+    for job in candidates:
+        if _reusable(job, now):
+            return job_status(job)
+
+    job = ExportJob(
+        id=uuid.uuid4().hex,
+        params_key=params_key,
+        params=params,
+        format=body.format,
+        status=QUEUED,
+        rows_read=0,
+        rows_written=0,
+        created_at=now,
+        updated_at=now,
+    )
+    db.add(job)
+    db.commit()
+    _executor.submit(_run_job, job.id)
+    return job_status(job)
+
+
+def _get_job(db: Session, job_id: str) -> ExportJob:
+    job = db.get(ExportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задание экспорта не найдено")
+    return job
+
+
+@router.get("/crm/export_jobs/{job_id}", tags=["CRM"])
+def get_export_job(job_id: str, db: Session = Depends(get_db)):
+    cleanup_expired_exports(db)
+    return job_status(_get_job(db, job_id))
+
+
+@router.get("/crm/export_jobs/{job_id}/download", tags=["CRM"])
+def download_export_job(job_id: str, db: Session = Depends(get_db)):
+    cleanup_expired_exports(db)
+    job = _get_job(db, job_id)
+    if job.status == EXPIRED:
+        raise HTTPException(status_code=410, detail="Срок хранения файла истёк, создайте задание заново")
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"Файл ещё не готов: {job.status}")
+    if not os.path.exists(job.file_path):
+        raise HTTPException(status_code=410, detail="Файл экспорта удалён, создайте задание заново")
+    return FileResponse(
+        job.file_path,
+        media_type=EXPORT_FORMATS[job.format],
+        filename=f"crm_filtered.{job.format}",
+    )
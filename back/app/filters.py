@@ -0,0 +1,89 @@
+"""Скомпилированные фильтры /crm/filter, /crm/export_excel и *_excel_2025.
+
+Параметры запроса разбираются один раз на запрос: месяц — в номер, даты —
+в date, списки источников/пола/языка — в множества в нижнем регистре.
+Результат — CompiledFilter: упорядоченный список предикатов, дешёвые и
+селективные первыми. У предиката есть условие SQL (уходит в WHERE, данные
+фильтрует база) или векторная проверка над колоночным снимком
+(excel_store), которая выполняется в Python.
+"""
+from dataclasses import dataclass, field
+from typing import Callable
+
+import numpy as np
+from sqlalchemy import false
+
+from .crm_fields import MONTH_NAMES
+
+_LOWER_MONTHS = [name.lower() for name in MONTH_NAMES]
+
+
+def as_list(value) -> list | None:
+    if value is None or isinstance(value, list):
+        return value
+    return [value]
+
+
+def lower_set(values, aliases: dict | None = None) -> frozenset:
+    """Значения фильтра без пробелов по краям, в нижнем регистре, с учётом синонимов."""
+    normalized = (str(value).strip().lower() for value in values)
+    if aliases:
+        return frozenset(aliases.get(value, value) for value in normalized)
+    return frozenset(normalized)
+
+
+def month_number(name: str) -> int | None:
+    """Номер месяца (1-12) по русскому названию; None — название не распознано."""
+    name = name.strip().lower()
+    return _LOWER_MONTHS.index(name) + 1 if name in _LOWER_MONTHS else None
+
+
+def filter_key(**params) -> tuple:
+    """Ключ нормализованных параметров для кешей (порядок значений в списках не важен)."""
+    return tuple(
+        (name, tuple(sorted(value)) if isinstance(value, (list, set, frozenset)) else value)
+        for name, value in params.items()
+    )
+
+
+@dataclass
+class Predicate:
+    name: str
+    # Условие WHERE и, если нужно, join, который оно требует
+    sql: object | None = None
+    join: Callable | None = None
+    # Проверка над колоночным снимком: (снимок, текущая маска) -> новая маска
+    mask: Callable | None = None
+
+
+@dataclass
+class CompiledFilter:
+    key: tuple
+    predicates: list[Predicate] = field(default_factory=list)
+    # Заведомо пустой результат (например, неизвестный месяц)
+    empty: bool = False
+
+    def add(self, name: str, **parts):
+        self.predicates.append(Predicate(name, **parts))
+
+    def apply(self, stmt):
+        """Условия фильтра в запросе (Query или select()) — фильтрует база."""
+        if self.empty:
+            return stmt.where(false())
+        for predicate in self.predicates:
+            if predicate.join is not None:
+                stmt = predicate.join(stmt)
+            if predicate.sql is not None:
+                stmt = stmt.where(predicate.sql)
+        return stmt
+
+    def mask(self, store) -> np.ndarray:
+        """Булева маска строк снимка; предикаты идут по порядку, пока остаются строки."""
+        mask = store.all()
+        if self.empty:
+            return ~mask
+        for predicate in self.predicates:
+            if not mask.any():
+                break
+            mask = predicate.mask(store, mask)
+        return mask
@@ -0,0 +1,79 @@
+"""Определение пола и языка донора по ФИО.
+
+Результаты запоминаются в ограниченном LRU-кеше по нормализованному ФИО
+(доноры повторяются часто). Ручные значения из строки (gender, язык)
+имеют приоритет над догадкой и кеш не затрагивают.
+"""
+import os
+from functools import lru_cache
+
+FIO_GUESS_CACHE_SIZE = int(os.getenv("FIO_GUESS_CACHE_SIZE", 100_000))
+
+
+def normalize_fio(fio) -> str | None:
+    """Ключ кеша: нижний регистр, пробелы схлопнуты и обрезаны."""
+    if not fio or not isinstance(fio, str):
+        return None
+    return " ".join(fio.lower().split()) or None
+
+
+def guess_gender_by_fio(fio: str) -> str:
+    key = normalize_fio(fio)
+    if key is None:
+        return "неизвестно"
+    return _guess_gender(key)
+
+
+def guess_language_by_fio(fio: str) -> str:
+    key = normalize_fio(fio)
+    if key is None:
+        return "неизвестно"
+    return _guess_language(key)
+
+
+def effective_gender(row: dict, guessed: str | None = None) -> str:
+    """Пол строки: ручное значение, иначе догадка по ФИО."""
+    return row.get("gender") or guessed or guess_gender_by_fio(row.get("ФИО"))
+
+
+def effective_language(row: dict, guessed: str | None = None) -> str:
+    """Язык строки: ручное значение (кроме 'неизвестно'), иначе догадка по ФИО."""
+    language = row.get("язык")
+    if not language or language == "неизвестно":
+        language = guessed or guess_language_by_fio(row.get("ФИО"))
+    return language
+
+
+@lru_cache(maxsize=FIO_GUESS_CACHE_SIZE)
+def _guess_gender(fio: str) -> str:
+    fio_parts = fio.split()
+    if len(fio_parts) < 2:
+        return "неизвестно"
+    surname = fio_parts[0]
+    otchestvo = fio_parts[-1] if len(fio_parts) > 2 else ""
+    # Женские окончания
+    if surname.endswith(("ова", "ева", "ина", "ая", "ская", "цкая")) or \
+       otchestvo.endswith(("овна", "евна", "ична", "қызы", "кызы", "гызи", "гулы")):
+        return "женщина"
+    # Мужские окончания
+    if surname.endswith(("ов", "ев", "ин", "ский", "цкий")) or \
+       otchestvo.endswith(("ович", "евич", "ич", "улы", "оглы")):
+        return "мужчина"
+    return "неизвестно"
+
+
+@lru_cache(maxsize=FIO_GUESS_CACHE_SIZE)
+def _guess_language(fio_lower: str) -> str:
+    kazakh_letters = set("әөүқғңұhі")
+    kazakh_endings = ("улы", "қызы", "кызы", "оглы", "гулы", "бек", "хан", "бай", "жан", "гали", "мырза", "нур")
+    russian_endings = ("ов", "ова", "ев", "ева", "ин", "ина", "ский", "ская", "цкий", "цкая", "ович", "овна", "евич", "евна", "ич", "ична")
+    # Казахские буквы
+    if any(ch in kazakh_letters for ch in fio_lower):
+        return "казахский"
+    # Казахские окончания
+    if any(fio_lower.endswith(end) for end in kazakh_endings):
+        return "казахский"
+    # Русские окончания
+    if any(fio_lower.endswith(end) for end in russian_endings):
+        return "русский"
+    return "неизвестно"
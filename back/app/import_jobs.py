@@ -0,0 +1,101 @@
+"""Задания фоновой загрузки CRM из Excel.
+
+/upload_excel сохраняет файлы в IMPORT_DIR, создаёт запись import_jobs и
+сразу отвечает её id. Дальше (см. upload_excel.run_import):
+1. файлы разбираются параллельно в пуле процессов IMPORT_PROCESSES — каждый
+   процесс пишет готовые строки crm_entries пачками во временный файл;
+2. строки всех файлов записываются в базу одной транзакцией (bulk_insert).
+
+Ход загрузки — статус, число разобранных, записанных и отброшенных строк,
+ошибки по листам — отдаёт GET /crm/import_jobs/{id}.
+
+Загрузка идемпотентна: файл, уже загруженный ранее (по sha256 в
+imported_files), не разбирается, а строки, уже лежащие в crm_entries (по
+row_hash), пропускаются и считаются в rows_skipped.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from .database import get_db
+from .models import ImportJob
+
+IMPORT_DIR = os.getenv("IMPORT_DIR", "imports")
+IMPORT_PROCESSES = int(os.getenv("IMPORT_PROCESSES", min(4, os.cpu_count() or 1)))
+
+QUEUED, PARSING, INSERTING, DONE, NO_VALID_DATA, FAILED = (
+    "queued", "parsing", "inserting", "done", "no_valid_data", "failed",
+)
+
+router = APIRouter()
+
+_parse_pool: ProcessPoolExecutor | None = None
+_parse_pool_lock = threading.Lock()
+
+
+def parse_pool() -> ProcessPoolExecutor:
+    """Пул процессов разбора Excel: разбор упирается в CPU.
+
+    spawn — чтобы дочерние процессы не наследовали соединения пула
+    SQLAlchemy и потоки сервера. Пул создаётся при первой загрузке.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=IMPORT_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _parse_pool
+
+
+def reset_parse_pool():
+    """Пересоздаёт пул при следующем обращении — после падения процесса разбора."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
+
+# Запись в базу — по одной загрузке за раз в процессе: загрузки всё равно
+# ждут друг друга на блокировке записи CRM (см. donors.DonorResolver)
+import_runner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="import")
+
+
+def set_job(db: Session, job_id: str, **values):
+    db.query(ImportJob).filter(ImportJob.id == job_id).update(
+        {**values, "updated_at": datetime.utcnow()}
+    )
+    db.commit()
+
+
+def job_status(job: ImportJob) -> dict:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "source": job.source,
+        "files": job.files,
+        "rows_parsed": job.rows_parsed,
+        "rows_inserted": job.rows_inserted,
+        "rows_rejected": job.rows_rejected,
+        "rows_skipped": job.rows_skipped,
+        "files_skipped": job.files_skipped or [],
+        "sheet_errors": job.sheet_errors or [],
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "updated_at": job.updated_at.isoformat(),
+    }
+
+
+@router.get("/crm/import_jobs/{job_id}", tags=["CRM"])
+def get_import_job(job_id: str, db: Session = Depends(get_db)):
+    job = db.get(ImportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задание загрузки не найдено")
+    return job_status(job)
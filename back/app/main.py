@@ -5,6 +5,10 @@ from . import models, database, crm
 from .routes import router
 from .upload_excel import router as upload_excel_router
 from .merge_excel import router as merge_excel_router
+from .export_jobs import router as export_jobs_router
+from .import_jobs import router as import_jobs_router
+from .pagination import PAGE_HEADERS
+from .response_cache import CACHE_HEADERS, router as response_cache_router
 import os
 from fastapi.openapi.utils import get_openapi
 from fastapi.security import OAuth2PasswordBearer
@@ -31,6 +35,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Курсор следующей страницы и общее число строк (см. pagination.py), ETag кеша ответов
+    expose_headers=PAGE_HEADERS + CACHE_HEADERS,
 )
 
 # Подключаем static/ — для фото профиля
@@ -42,6 +48,9 @@ app.include_router(router, prefix="/api")
 app.include_router(crm.router, prefix="/api")
 app.include_router(upload_excel_router, prefix="/api")
 app.include_router(merge_excel_router, prefix="/api")
+app.include_router(export_jobs_router, prefix="/api")
+app.include_router(import_jobs_router, prefix="/api")
+app.include_router(response_cache_router, prefix="/api")
 
 # Добавляем схему безопасности Bearer для Swagger UI
 @app.on_event("startup")
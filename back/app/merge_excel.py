@@ -1,373 +1,511 @@
-from fastapi import APIRouter, UploadFile, File, Query, Body, Form, HTTPException
+from fastapi import APIRouter, UploadFile, File, Query, Body, Form, HTTPException, Depends, Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
 from typing import List, Optional
-import pandas as pd
-import io
+import zipfile
+from contextlib import ExitStack
 import numpy as np
-from datetime import datetime
+import pandas as pd
 from collections import defaultdict, Counter
-from fastapi.responses import StreamingResponse
+from .excel_stream import spooled_upload, iter_sheet_chunks, sheet_headers
+from .workbook_inspect import validate_workbook, WorkbookError
+from .database import get_db
+from .models import ExcelUser
+from .schemas import ExcelUserFieldUpdate
+from .fio_guess import guess_gender_by_fio, guess_language_by_fio, effective_gender
+from .excel_store import ExcelColumnStore, get_excel_store, queue_store_updates
+from .versions import EXCEL_USERS, bump_data_version
+from .pagination import PageParams, paginate_query, set_page_headers, cached_count
+from .export_engine import export_response
+from .crm_fields import parse_payment_date, parse_amount
+from .dates import parse_date
+from .source_profiles import FIELDS, detect_profile
+from .offload import run_blocking
+from .filters import CompiledFilter, filter_key, lower_set
+from .response_cache import cached_json
 
 router = APIRouter()
 
-# Словарь синонимов для унификации полей
-FIELD_SYNONYMS = {
-    "Дата": ["Дата", "Дата платежа"],
-    "E-mail": ["E-mail", "Электронная почта"],
-    "Сумма": ["Сумма", "Сумма платежа"],
-    # Добавь другие пары, если нужно
-}
+# Поля, которые есть в каждой строке 2025 (пустые — None). Синонимы
+# колонок сводятся к каноническим именам по реестру source_profiles.
+REQUIRED_FIELDS = [FIELDS[field].name for field in ("date", "email", "amount")]
+
+# Строки 2025 хранятся в таблице excel_users: вся строка целиком — в data,
+# поля для поиска и фильтрации — в отдельных индексированных колонках.
+
+def _text(value):
+    if value is None:
+        return None
+    text = str(value).strip()
+    return text or None
+
+
+def excel_user_columns(row: dict) -> dict:
+    """Индексируемые колонки ExcelUser, вычисленные из строки.
+
+    Загруженные строки уже сведены к каноническим именам (source_profiles);
+    идентификатор платежа ищется по всем синонимам — в строках, добавленных
+    вручную или до реестра, он может лежать под другим именем.
+    """
+    fio, email, date, amount, phone = (
+        row.get(FIELDS[field].name) for field in ("fio", "email", "date", "amount", "phone")
+    )
+    return {
+        "fio": _text(fio),
+        "email": _text(email),
+        "date": _text(date),
+        "payment_date": parse_payment_date(date),
+        "summa": parse_amount({FIELDS["amount"].name: amount}),
+        "month": _text(row.get("month")),
+        "phone": _text(phone),
+        "language": _text(row.get("язык")),
+        "source": _text(row.get("источник")),
+        "payment_id": _text(detect_profile(row).first(row, "payment_id")),
+        "guessed_gender": guess_gender_by_fio(fio),
+        "guessed_language": guess_language_by_fio(fio),
+    }
+
+
+def excel_user_values(row: dict) -> dict:
+    """Значения колонок excel_users для новой строки."""
+    row = jsonable_encoder({k: v for k, v in row.items() if k != "id"})
+    return {"data": row, **excel_user_columns(row)}
+
 
-# Глобальное хранилище для всех загруженных пользователей (на время жизни процесса)
-all_users_data = []
+def new_excel_user(row: dict) -> ExcelUser:
+    return ExcelUser(**excel_user_values(row))
+
+
+def save_excel_user(user: ExcelUser, row: dict):
+    """Сохраняет изменённую строку: JSON перезаписывается целиком, колонки пересчитываются."""
+    row = jsonable_encoder({k: v for k, v in row.items() if k != "id"})
+    user.data = row
+    for column, value in excel_user_columns(row).items():
+        setattr(user, column, value)
+
+
+def update_excel_users(db: Session, updates: dict[int, dict]) -> list[int]:
+    """Применяет {id: {поле: значение}} одним запросом по первичному ключу.
+
+    Возвращает id, которых нет в базе. commit остаётся за вызывающим;
+    после него правки попадают в снимок excel_store этого воркера на месте.
+    """
+    users = {user.id: user for user in db.query(ExcelUser).filter(ExcelUser.id.in_(list(updates)))}
+    for user_id, fields in updates.items():
+        if user_id in users:
+            save_excel_user(users[user_id], {**users[user_id].data, **fields})
+    if users:
+        bump_data_version(db, EXCEL_USERS)
+        queue_store_updates(db, list(users.values()))
+    return [user_id for user_id in updates if user_id not in users]
+
+
+def user_to_row(user: ExcelUser) -> dict:
+    return {**(user.data or {}), "id": user.id}
+
+
+def load_users_data(db: Session, source: list[str] | None = None) -> list[dict]:
+    """Все строки 2025 в порядке id; фильтр по источнику выполняется в базе."""
+    query = db.query(ExcelUser)
+    if source:
+        source_set = {s.strip().lower() for s in source}
+        query = query.filter(func.lower(func.trim(func.coalesce(ExcelUser.source, ""))).in_(source_set))
+    return [user_to_row(user) for user in query.order_by(ExcelUser.id)]
 
 @router.post("/upload_excel_2025", tags=["Excel"])
 async def upload_excel_2025(
     files: List[UploadFile] = File(...),
-    sources: List[str] = Form(...)
+    sources: List[str] = Form(...),
+    db: Session = Depends(get_db)
 ):
-    global all_users_data
-    dataframes = []
-    for file, source in zip(files, sources):
-        content = await file.read()
-        excel = pd.read_excel(io.BytesIO(content), sheet_name=None)
-        for sheet_name, sheet_df in excel.items():
-            sheet_df['month'] = sheet_name  # Добавляем столбец с названием листа
-            sheet_df['источник'] = source   # Добавляем столбец источник
-            dataframes.append(sheet_df)
-
-    # Собираем все уникальные столбцы
-    all_columns = set()
-    for df in dataframes:
-        all_columns.update(df.columns)
-    all_columns = list(all_columns)
-
-    # Приводим все датафреймы к общему набору столбцов
-    normalized_dfs = []
-    for df in dataframes:
-        for col in all_columns:
-            if col not in df.columns:
-                df[col] = None
-        normalized_dfs.append(df[all_columns])
-
-    # Объединяем все строки
-    result_df = pd.concat(normalized_dfs, ignore_index=True)
-
-    # Заменяем NaN, inf, -inf на None для корректного JSON
-    result_df = result_df.replace([np.nan, np.inf, -np.inf], None)
-
-    # Преобразуем в список словарей
-    result = result_df.to_dict(orient='records')
-
-    # Унификация полей по синонимам и сортировка
-    final_result = []
-    next_id = len(all_users_data) + 1
-    for row in result:
-        # Унификация полей
-        for main_field, synonyms in FIELD_SYNONYMS.items():
-            value = None
-            for syn in synonyms:
-                if row.get(syn) not in [None, '', [], {}]:
-                    value = row[syn]
-                    break
-            row[main_field] = value
-            # Удаляем все синонимы, кроме основного
-            for syn in synonyms:
-                if syn != main_field and syn in row:
-                    del row[syn]
-        # Фильтрация и коррекция полей (если нужно)
-        # ...
-        # Сортировка: сначала заполненные, потом пустые
-        not_null = {k: v for k, v in row.items() if v not in [None, '', [], {}] and k != "источник"}
-        is_null = {k: v for k, v in row.items() if v in [None, '', [], {}] and k != "источник"}
-        ordered_row = {**not_null, **is_null}
-        # Добавляем телефон и язык, даже если их нет
-        if "телефон" not in ordered_row:
-            ordered_row["телефон"] = None
-        if "язык" not in ordered_row:
-            ordered_row["язык"] = None
-        # Поле 'источник' всегда в конце
-        if "источник" in row:
-            ordered_row["источник"] = row["источник"]
-        # Добавляем уникальный id
-        ordered_row["id"] = next_id
-        next_id += 1
-        final_result.append(ordered_row)
-
-    all_users_data.extend(final_result)
-    return final_result
+    # Разбор книг и запись блокируют — выполняются в пуле offload, не в event loop
+    return await run_blocking(import_excel_2025, files, sources, db)
+
+
+def _upload_columns(paths: list[str]) -> set:
+    """Общий набор колонок всех листов после сведения синонимов — по одним заголовкам."""
+    columns = set(REQUIRED_FIELDS) | {"month", "источник"}
+    for path in paths:
+        for _, header in sheet_headers(path):
+            columns.update(detect_profile(header).rename(pd.DataFrame(columns=header)).columns)
+    return columns
+
+
+def _ordered_row(row: dict, all_columns: set) -> dict:
+    # Приводим строку к общему набору столбцов
+    for col in all_columns:
+        row.setdefault(col, None)
+    # Сортировка: сначала заполненные, потом пустые
+    not_null = {k: v for k, v in row.items() if v not in [None, '', [], {}] and k != "источник"}
+    is_null = {k: v for k, v in row.items() if v in [None, '', [], {}] and k != "источник"}
+    ordered_row = {**not_null, **is_null}
+    # Добавляем телефон и язык, даже если их нет
+    if "телефон" not in ordered_row:
+        ordered_row["телефон"] = None
+    if "язык" not in ordered_row:
+        ordered_row["язык"] = None
+    # Поле 'источник' всегда в конце
+    if "источник" in row:
+        ordered_row["источник"] = row["источник"]
+    return ordered_row
+
+
+def import_excel_2025(files: List[UploadFile], sources: List[str], db: Session) -> dict:
+    """Записывает строки книг в excel_users пачками по мере чтения, одной транзакцией.
+
+    Набор колонок берётся заранее из заголовков листов, поэтому каждая пачка
+    пишется и освобождается сразу, а память не растёт с размером загрузки.
+    """
+    for file in files:
+        try:
+            validate_workbook(file.file)
+        except (WorkbookError, zipfile.BadZipFile) as e:
+            raise HTTPException(status_code=400, detail=f"{file.filename}: {e}")
+    uploads = list(zip(files, sources))
+    inserted = 0
+    # Файлы читаются с диска пачками (см. excel_stream), без BytesIO всей книги
+    with ExitStack() as stack:
+        paths = [stack.enter_context(spooled_upload(file)) for file, _ in uploads]
+        all_columns = _upload_columns(paths)
+        for path, (_, source) in zip(paths, uploads):
+            for sheet_name, sheet_df in iter_sheet_chunks(path):
+                # Схема выгрузки — по заголовку, синонимы сводятся одним переименованием на лист
+                sheet_df = detect_profile(sheet_df.columns).rename(sheet_df)
+                sheet_df['month'] = sheet_name  # Добавляем столбец с названием листа
+                sheet_df['источник'] = source   # Добавляем столбец источник
+                # Заменяем NaN, inf, -inf на None для корректного JSON
+                sheet_df = sheet_df.astype(object).replace([np.nan, np.inf, -np.inf], None)
+                rows = [
+                    excel_user_values(_ordered_row(row, all_columns))
+                    for row in sheet_df.to_dict(orient='records')
+                ]
+                if rows:
+                    # id выдаёт последовательность базы, поэтому они уникальны между воркерами
+                    db.execute(insert(ExcelUser), rows)
+                    inserted += len(rows)
+
+    bump_data_version(db, EXCEL_USERS)
+    db.commit()
+    return {"status": "success", "rows_inserted": inserted}
+
+# GET-эндпоинты ниже отдают ответ из кеша до следующей записи в excel_users
+# (все пути записи увеличивают версию EXCEL_USERS, см. response_cache)
 
 @router.get("/count_users_excel_2025", tags=["Excel"])
-def count_users_excel_2025():
-    return {"all_users": len(all_users_data)}
+def count_users_excel_2025(request: Request, db: Session = Depends(get_db)):
+    def build(response: Response):
+        return {"all_users": db.query(func.count(ExcelUser.id)).scalar()}
+
+    return cached_json(request, db, EXCEL_USERS, build)
 
 @router.get("/all_users_excel_2025", tags=["Excel"])
-def all_users_excel_2025():
-    result = []
-    for row in all_users_data:
-        gender = row.get("gender")
-        if not gender:
-            fio = row.get("ФИО")
-            gender = guess_gender_by_fio(fio)
-        row_with_gender = dict(row)
-        row_with_gender["gender"] = gender
-        # Добавляем телефон и язык, даже если их нет
-        if "телефон" not in row_with_gender:
-            row_with_gender["телефон"] = None
-        if "язык" not in row_with_gender:
-            row_with_gender["язык"] = None
-        # Формируем новый словарь: все поля кроме 'источник', потом 'источник'
-        ordered = {k: v for k, v in row_with_gender.items() if k != "источник"}
-        if "источник" in row_with_gender:
-            ordered["источник"] = row_with_gender["источник"]
-        result.append(ordered)
-    return result
+def all_users_excel_2025(
+    request: Request,
+    page: PageParams = Depends(),
+    db: Session = Depends(get_db)
+):
+    def build(response: Response):
+        query = db.query(ExcelUser)
+        users, has_more = paginate_query(query, ExcelUser.id, page)
+        if page.enabled:
+            total = cached_count(db, EXCEL_USERS, (), query)
+            set_page_headers(response, users[-1].id if users else None, has_more, total)
+        result = []
+        for user in users:
+            row = user_to_row(user)
+            row_with_gender = dict(row)
+            row_with_gender["gender"] = effective_gender(row, user.guessed_gender)
+            # Добавляем телефон и язык, даже если их нет
+            if "телефон" not in row_with_gender:
+                row_with_gender["телефон"] = None
+            if "язык" not in row_with_gender:
+                row_with_gender["язык"] = None
+            # Формируем новый словарь: все поля кроме 'источник', потом 'источник'
+            ordered = {k: v for k, v in row_with_gender.items() if k != "источник"}
+            if "источник" in row_with_gender:
+                ordered["источник"] = row_with_gender["источник"]
+            result.append(ordered)
+        return result
+
+    return cached_json(request, db, EXCEL_USERS, build)
 
 def parse_date_safe(date_str):
-    return datetime.strptime(date_str, "%d.%m.%Y")
+    """Дата из параметра запроса (DD.MM.YYYY и другие форматы dates.py); ValueError — не разобрана."""
+    parsed = parse_date(date_str)
+    if parsed is None:
+        raise ValueError(f"Unrecognized date: {date_str!r}")
+    return parsed
 
 @router.get("/filter_users_by_date_excel_2025", tags=["Excel"])
 def filter_users_by_date_excel_2025(
+    request: Request,
     date_from: str = Query(..., description="Начальная дата в формате DD.MM.YYYY"),
-    date_to: str = Query(..., description="Конечная дата в формате DD.MM.YYYY")
+    date_to: str = Query(..., description="Конечная дата в формате DD.MM.YYYY"),
+    db: Session = Depends(get_db)
 ):
-    filtered = []
-    dt_from = parse_date_safe(date_from)
-    dt_to = parse_date_safe(date_to)
-    for row in all_users_data:
-        date_val = row.get("Дата")
-        if date_val:
-            try:
-                # Поддержка форматов ISO, dd/mm/yyyy, dd.mm.yyyy
-                if isinstance(date_val, str) and "/" in date_val:
-                    dt = datetime.strptime(date_val, "%d/%m/%Y")
-                elif isinstance(date_val, str) and "." in date_val:
-                    dt = datetime.strptime(date_val, "%d.%m.%Y")
-                else:
-                    dt = datetime.fromisoformat(str(date_val).replace("Z", ""))
-                if dt_from <= dt <= dt_to:
-                    filtered.append(row)
-            except Exception:
-                continue
-    return filtered
+    def build(response: Response):
+        dt_from = parse_date_safe(date_from)
+        dt_to = parse_date_safe(date_to)
+        # Дата уже разобрана при загрузке (колонка payment_date)
+        query = db.query(ExcelUser).filter(ExcelUser.payment_date.between(dt_from, dt_to))
+        return [user_to_row(user) for user in query.order_by(ExcelUser.id)]
+
+    return cached_json(request, db, EXCEL_USERS, build)
+
+# Поля строки, для которых есть индексированные колонки в excel_users
+INDEXED_FIELDS = {
+    "ФИО": ExcelUser.fio,
+    "E-mail": ExcelUser.email,
+}
 
 @router.get("/filter_users_by_count_excel_2025", tags=["Excel"])
 def filter_users_by_count_excel_2025(
+    request: Request,
     type: str = Query(..., regex="^(single|periodic|frequent)$", description="single/periodic/frequent"),
-    by: str = Query("ФИО", description="Ключ для группировки: 'ФИО' или 'E-mail'")
+    by: str = Query("ФИО", description="Ключ для группировки: 'ФИО' или 'E-mail'"),
+    db: Session = Depends(get_db)
 ):
-    counter = defaultdict(list)
-    for row in all_users_data:
-        key = row.get(by)
-        if key:
-            counter[key].append(row)
-    if type == "single":
-        result = [rows[0] for rows in counter.values() if len(rows) == 1]
-    elif type == "periodic":
-        result = [row for rows in counter.values() if 2 <= len(rows) <= 4 for row in rows]
-    elif type == "frequent":
-        result = [row for rows in counter.values() if len(rows) >= 5 for row in rows]
-    else:
-        result = []
-    return result
+    def build(response: Response):
+        if by in INDEXED_FIELDS:
+            # Число строк на ключ считает база (GROUP BY по индексу), строки отбираются join-ом
+            column = INDEXED_FIELDS[by]
+            counts = (
+                db.query(column.label("key"), func.count(ExcelUser.id).label("cnt"))
+                .filter(column.isnot(None))
+                .group_by(column)
+                .subquery()
+            )
+            bounds = {"single": counts.c.cnt == 1, "periodic": counts.c.cnt.between(2, 4), "frequent": counts.c.cnt >= 5}
+            query = db.query(ExcelUser).join(counts, counts.c.key == column).filter(bounds[type])
+            return [user_to_row(user) for user in query.order_by(ExcelUser.id)]
+        counter = defaultdict(list)
+        for row in load_users_data(db):
+            key = row.get(by)
+            if key:
+                counter[key].append(row)
+        if type == "single":
+            result = [rows[0] for rows in counter.values() if len(rows) == 1]
+        elif type == "periodic":
+            result = [row for rows in counter.values() if 2 <= len(rows) <= 4 for row in rows]
+        elif type == "frequent":
+            result = [row for rows in counter.values() if len(rows) >= 5 for row in rows]
+        else:
+            result = []
+        return result
+
+    return cached_json(request, db, EXCEL_USERS, build)
 
 @router.get("/user_analytics_excel_2025", tags=["Excel"])
 def user_analytics_excel_2025(
+    request: Request,
     key: str = Query(..., description="Значение для поиска (ФИО или E-mail)"),
-    by: str = Query("ФИО", description="Поле для поиска: 'ФИО' или 'E-mail'")
+    by: str = Query("ФИО", description="Поле для поиска: 'ФИО' или 'E-mail'"),
+    db: Session = Depends(get_db)
 ):
-    user_rows = [row for row in all_users_data if row.get(by) == key]
-    if not user_rows:
-        return {"error": "User not found"}
-
-    # Считаем суммы
-    amounts = []
-    dates = []
-    months = []
-    for row in user_rows:
-        # Сумма
-        try:
-            if row.get("Сумма") is not None:
-                amounts.append(float(row["Сумма"]))
-        except Exception:
-            pass
-        # Дата
-        date_val = row.get("Дата")
-        if date_val:
+    def build(response: Response):
+        if by in INDEXED_FIELDS:
+            query = db.query(ExcelUser).filter(INDEXED_FIELDS[by] == key).order_by(ExcelUser.id)
+            user_rows = [user_to_row(user) for user in query]
+        else:
+            user_rows = [row for row in load_users_data(db) if row.get(by) == key]
+        if not user_rows:
+            return {"error": "User not found"}
+
+        # Считаем суммы
+        amounts = []
+        dates = []
+        months = []
+        for row in user_rows:
+            # Сумма
             try:
-                if isinstance(date_val, str) and "/" in date_val:
-                    dt = datetime.strptime(date_val, "%d/%m/%Y")
-                elif isinstance(date_val, str) and "." in date_val:
-                    dt = datetime.strptime(date_val, "%d.%m.%Y")
-                else:
-                    dt = datetime.fromisoformat(str(date_val).replace("Z", ""))
-                dates.append(dt)
-                months.append(dt.strftime("%Y-%m"))
+                if row.get("Сумма") is not None:
+                    amounts.append(float(row["Сумма"]))
             except Exception:
                 pass
+            # Дата
+            date_val = row.get("Дата")
+            dt = parse_date(date_val)
+            if dt:
+                dates.append(dt)
+                months.append(dt.strftime("%Y-%m"))
 
-    gender = guess_gender_by_fio(key) if by == "ФИО" else "неизвестно"
-
-    stats = {
-        "total_count": len(user_rows),
-        "total_amount": sum(amounts) if amounts else 0,
-        "average_amount": sum(amounts)/len(amounts) if amounts else 0,
-        "min_amount": min(amounts) if amounts else None,
-        "max_amount": max(amounts) if amounts else None,
-        "first_transaction": min(dates).strftime("%Y-%m-%d") if dates else None,
-        "last_transaction": max(dates).strftime("%Y-%m-%d") if dates else None,
-        "most_frequent_month": Counter(months).most_common(1)[0][0] if months else None
-    }
-    return {
-        "user_info": {by: key, "gender": gender},
-        "stats": stats,
-        "transactions": user_rows
-    }
+        gender = guess_gender_by_fio(key) if by == "ФИО" else "неизвестно"
+
+        stats = {
+            "total_count": len(user_rows),
+            "total_amount": sum(amounts) if amounts else 0,
+            "average_amount": sum(amounts)/len(amounts) if amounts else 0,
+            "min_amount": min(amounts) if amounts else None,
+            "max_amount": max(amounts) if amounts else None,
+            "first_transaction": min(dates).strftime("%Y-%m-%d") if dates else None,
+            "last_transaction": max(dates).strftime("%Y-%m-%d") if dates else None,
+            "most_frequent_month": Counter(months).most_common(1)[0][0] if months else None
+        }
+        return {
+            "user_info": {by: key, "gender": gender},
+            "stats": stats,
+            "transactions": user_rows
+        }
 
-def guess_gender_by_fio(fio: str) -> str:
-    if not fio or not isinstance(fio, str):
-        return "неизвестно"
-    fio_parts = fio.strip().split()
-    if len(fio_parts) < 2:
-        return "неизвестно"
-    surname = fio_parts[0].lower()
-    otchestvo = fio_parts[-1].lower() if len(fio_parts) > 2 else ""
-    # Женские окончания
-    if surname.endswith(("ова", "ева", "ина", "ая", "ская", "цкая")) or \
-       otchestvo.endswith(("овна", "евна", "ична", "қызы", "кызы", "гызи", "гулы")):
-        return "женщина"
-    # Мужские окончания
-    if surname.endswith(("ов", "ев", "ин", "ский", "цкий")) or \
-       otchestvo.endswith(("ович", "евич", "ич", "улы", "оглы")):
-        return "мужчина"
-    return "неизвестно"
-
-def guess_language_by_fio(fio: str) -> str:
-    if not fio or not isinstance(fio, str):
-        return "неизвестно"
-    fio_lower = fio.lower()
-    kazakh_letters = set("әөүқғңұhі")
-    kazakh_endings = ("улы", "қызы", "кызы", "оглы", "гулы", "бек", "хан", "бай", "жан", "гали", "мырза", "нур")
-    russian_endings = ("ов", "ова", "ев", "ева", "ин", "ина", "ский", "ская", "цкий", "цкая", "ович", "овна", "евич", "евна", "ич", "ична")
-    # Казахские буквы
-    if any(ch in kazakh_letters for ch in fio_lower):
-        return "казахский"
-    # Казахские окончания
-    if any(fio_lower.endswith(end) for end in kazakh_endings):
-        return "казахский"
-    # Русские окончания
-    if any(fio_lower.endswith(end) for end in russian_endings):
-        return "русский"
-    return "неизвестно"
+    return cached_json(request, db, EXCEL_USERS, build)
 
 @router.get("/users_with_unknown_gender_excel_2025", tags=["Excel"])
-def users_with_unknown_gender_excel_2025():
-    result = []
-    for row in all_users_data:
-        fio = row.get("ФИО")
-        gender = guess_gender_by_fio(fio)
-        if gender == "неизвестно":
-            row_with_gender = dict(row)
-            row_with_gender["gender"] = gender
-            result.append(row_with_gender)
-    return result
+def users_with_unknown_gender_excel_2025(request: Request, db: Session = Depends(get_db)):
+    def build(response: Response):
+        # Пол по ФИО посчитан при записи — отбор идёт по индексу
+        query = db.query(ExcelUser).filter(ExcelUser.guessed_gender == "неизвестно").order_by(ExcelUser.id)
+        return [{**user_to_row(user), "gender": "неизвестно"} for user in query]
+
+    return cached_json(request, db, EXCEL_USERS, build)
 
 @router.post("/set_user_phone_excel_2025", tags=["Excel"])
 def set_user_phone_excel_2025(
     id: int = Body(..., description="ID пользователя"),
-    phone: str = Body(..., description="Новый телефон")
+    phone: str = Body(..., description="Новый телефон"),
+    db: Session = Depends(get_db)
 ):
-    updated = 0
-    for row in all_users_data:
-        if row.get("id") == id:
-            row["телефон"] = phone
-            updated += 1
-    return {"updated": updated}
+    not_found = update_excel_users(db, {id: {"телефон": phone}})
+    db.commit()
+    return {"updated": 0 if not_found else 1}
 
 @router.post("/set_user_language_excel_2025", tags=["Excel"])
 def set_user_language_excel_2025(
     id: int = Body(..., description="ID пользователя"),
-    language: str = Body(..., description="Новый язык")
+    language: str = Body(..., description="Новый язык"),
+    db: Session = Depends(get_db)
 ):
-    updated = 0
-    for row in all_users_data:
-        if row.get("id") == id:
-            row["язык"] = language
-            updated += 1
-    return {"updated": updated}
+    not_found = update_excel_users(db, {id: {"язык": language}})
+    db.commit()
+    return {"updated": 0 if not_found else 1}
 
 @router.post("/set_user_gender_excel_2025", tags=["Excel"])
 def set_user_gender_excel_2025(
     id: int = Body(..., description="ID пользователя"),
-    gender: str = Body(..., description="Новый пол: 'мужчина', 'женщина', 'неизвестно'")
+    gender: str = Body(..., description="Новый пол: 'мужчина', 'женщина', 'неизвестно'"),
+    db: Session = Depends(get_db)
+):
+    not_found = update_excel_users(db, {id: {"gender": gender}})
+    db.commit()
+    return {"updated": 0 if not_found else 1}
+
+# Короткие имена полей для пакетного обновления
+BATCH_FIELD_ALIASES = {
+    "phone": "телефон",
+    "language": "язык",
+    "gender": "gender",
+}
+
+@router.post("/batch_update_users_excel_2025", tags=["Excel"])
+def batch_update_users_excel_2025(
+    updates: list[ExcelUserFieldUpdate] = Body(..., description="Список изменений {id, field, value}"),
+    db: Session = Depends(get_db)
 ):
-    updated = 0
-    for row in all_users_data:
-        if row.get("id") == id:
-            row["gender"] = gender
-            updated += 1
-    return {"updated": updated}
+    """Применяет много правок за один запрос и одну транзакцию."""
+    by_id = defaultdict(dict)
+    for item in updates:
+        by_id[item.id][BATCH_FIELD_ALIASES.get(item.field, item.field)] = item.value
+    not_found = update_excel_users(db, by_id)
+    db.commit()
+    return {"updated": len(by_id) - len(not_found), "not_found": not_found}
 
 @router.get("/filter_users_by_gender_excel_2025", tags=["Excel"])
 def filter_users_by_gender_excel_2025(
-    gender: str = Query(..., description="Гендер: мужчина/женщина/неизвестно (регистр и варианты не важны)")
+    request: Request,
+    gender: str = Query(..., description="Гендер: мужчина/женщина/неизвестно (регистр и варианты не важны)"),
+    db: Session = Depends(get_db)
 ):
-    gender_norm = gender.strip().lower()
-    gender_map = {
-        "мужчина": "мужчина",
-        "женщина": "женщина",
-        "неизвестно": "неизвестно",
-        "муж": "мужчина",
-        "жен": "женщина",
-        "male": "мужчина",
-        "female": "женщина"
-    }
-    gender_norm = gender_map.get(gender_norm, gender_norm)
-    result = []
-    for row in all_users_data:
-        g = row.get("gender")
-        if not g:
-            fio = row.get("ФИО")
-            g = guess_gender_by_fio(fio)
-        if g and g.strip().lower() == gender_norm:
-            result.append(row)
-    return result
+    def build(response: Response):
+        return apply_filters(get_excel_store(db), gender=[gender])
+
+    return cached_json(request, db, EXCEL_USERS, build)
 
 @router.get("/filter_users_by_language_excel_2025", tags=["Excel"])
 def filter_users_by_language_excel_2025(
-    language: str = Query(..., description="Язык: казахский/русский/английский/другой (регистр и варианты не важны)")
+    request: Request,
+    language: str = Query(..., description="Язык: казахский/русский/английский/другой (регистр и варианты не важны)"),
+    db: Session = Depends(get_db)
 ):
-    lang_norm = language.strip().lower()
-    lang_map = {
-        "казахский": "казахский",
-        "русский": "русский",
-        "английский": "английский",
-        "английский язык": "английский",
-        "english": "английский",
-        "другой": "другой",
-        "other": "другой"
-    }
-    lang_norm = lang_map.get(lang_norm, lang_norm)
-    result = []
-    for row in all_users_data:
-        l = row.get("язык")
-        if not l or l == "неизвестно":
-            fio = row.get("ФИО")
-            l = guess_language_by_fio(fio)
-        l_norm = l.strip().lower() if l else "неизвестно"
-        if lang_norm == "другой":
-            if l_norm not in ("казахский", "русский", "английский"):
-                result.append(row)
-        elif l_norm == lang_norm:
-            result.append(row)
-    return result
+    def build(response: Response):
+        return apply_filters(get_excel_store(db), language=[language])
+
+    return cached_json(request, db, EXCEL_USERS, build)
 
 # --------- Расширенная функция фильтрации -------------------------
 # Теперь параметры type / gender / language / source могут быть списками,
 # чтобы поддерживать выбор нескольких значений одного поля
 # (?type=single&type=frequent).
+# Фильтры работают по колоночному снимку (см. excel_store): каждый — булева
+# маска над массивами NumPy, строки собираются только для прошедших записей.
+# Параметры разбираются один раз в CompiledFilter (см. filters.py).
+
+GENDER_ALIASES = {
+    "мужчина": "мужчина",
+    "женщина": "женщина",
+    "неизвестно": "неизвестно",
+    "муж": "мужчина",
+    "жен": "женщина",
+    "male": "мужчина",
+    "female": "женщина",
+}
+
+LANGUAGE_ALIASES = {
+    "казахский": "казахский",
+    "русский": "русский",
+    "английский": "английский",
+    "английский язык": "английский",
+    "english": "английский",
+    "другой": "другой",
+    "other": "другой",
+}
+
+KNOWN_LANGUAGES = ("казахский", "русский", "английский")
+
+
+def _source_mask(accepted: frozenset):
+    return lambda store, mask: mask & store.isin("source", accepted)
+
+
+def _type_mask(accepted: frozenset):
+    def check(store, mask):
+        # Число строк донора (ФИО/Email) среди уже отобранных
+        counts = store.group_counts(mask)
+        by_type = np.zeros(len(counts), dtype=bool)
+        if "single" in accepted:
+            by_type |= counts == 1
+        if "periodic" in accepted:
+            by_type |= (counts >= 2) & (counts <= 4)
+        if "frequent" in accepted:
+            by_type |= counts >= 5
+        return mask & store.by_group(by_type)
+    return check
 
-def apply_filters(
-    data: list[dict],
+
+def _date_mask(dt_from, dt_to):
+    return lambda store, mask: mask & store.date_between(dt_from, dt_to)
+
+
+def _amount_mask(amount_from: float | None, amount_to: float | None):
+    # Строки без суммы не проходят: сравнение с NaN ложно
+    def check(store, mask):
+        if amount_from is not None:
+            mask = mask & (store.amount >= amount_from)
+        if amount_to is not None:
+            mask = mask & (store.amount <= amount_to)
+        return mask
+    return check
+
+
+def _language_mask(accepted: frozenset):
+    def check(store, mask):
+        by_language = store.isin("language", accepted)
+        if "другой" in accepted:
+            by_language |= ~store.isin("language", KNOWN_LANGUAGES)
+        return mask & by_language
+    return check
+
+
+def compile_excel_filter(
     type: list[str] | None = None,
     date_from: str | None = None,
     date_to: str | None = None,
@@ -376,136 +514,56 @@ def apply_filters(
     gender: list[str] | None = None,
     language: list[str] | None = None,
     source: list[str] | None = None,
-) -> list[dict]:
-    filtered = data
-
-    # 2. Фильтр по источнику (можно несколько значений)
+) -> CompiledFilter:
+    """Фильтр *_excel_2025, разобранный один раз; проверки — маски над снимком.
+
+    Тип донора считается среди строк, уже отобранных по источнику, поэтому
+    его проверка стоит сразу после источника; остальные — дешёвые сравнения
+    массивов, каждая сужает маску.
+    """
+    if type and not lower_set(type) <= {"single", "periodic", "frequent"}:
+        raise HTTPException(status_code=400, detail="Unsupported type value")
+    source, type = (lower_set(values) if values else None for values in (source, type))
+    gender = lower_set(gender, GENDER_ALIASES) if gender else None
+    language = lower_set(language, LANGUAGE_ALIASES) if language else None
+    compiled = CompiledFilter(filter_key(
+        type=type, date_from=date_from, date_to=date_to, amount_from=amount_from,
+        amount_to=amount_to, gender=gender, language=language, source=source,
+    ))
     if source:
-        source_set = {s.strip().lower() for s in source}
-        filtered = [row for row in filtered if str(row.get("источник", "")).strip().lower() in source_set]
-
-    # 3. Фильтр по типу донаций (single/periodic/frequent) — список значений
+        compiled.add("source", mask=_source_mask(source))
     if type:
-        from collections import defaultdict
-        accepted = {t.strip().lower() for t in type}
-        valid = {"single", "periodic", "frequent"}
-        if not accepted <= valid:
-            raise HTTPException(status_code=400, detail="Unsupported type value")
-
-        counter = defaultdict(list)
-        for row in filtered:
-            key = row.get("ФИО") or row.get("E-mail")  # группируем по ФИО/Email
-            if key:
-                counter[key].append(row)
-
-        temp = []
-        for rows in counter.values():
-            cnt = len(rows)
-            cls = (
-                "single"   if cnt == 1 else
-                "periodic" if 2 <= cnt <= 4 else
-                "frequent"
-            )
-            if cls in accepted:
-                temp.extend(rows)
-        filtered = temp
-
-    # 4. Фильтр по периоду (дата)
+        compiled.add("type", mask=_type_mask(type))
+    # Период: неразборчивые даты фильтр не применяют
     if date_from and date_to:
         try:
             dt_from = parse_date_safe(date_from)
             dt_to = parse_date_safe(date_to)
-            temp = []
-            for row in filtered:
-                date_val = row.get("Дата")
-                if date_val:
-                    try:
-                        if isinstance(date_val, str) and "/" in date_val:
-                            dt = datetime.strptime(date_val, "%d/%m/%Y")
-                        elif isinstance(date_val, str) and "." in date_val:
-                            dt = datetime.strptime(date_val, "%d.%m.%Y")
-                        else:
-                            dt = datetime.fromisoformat(str(date_val).replace("Z", ""))
-                        if dt_from <= dt <= dt_to:
-                            temp.append(row)
-                    except Exception:
-                        continue
-            filtered = temp
-        except Exception:
+        except ValueError:
             pass
-
-    # 5. Фильтр по сумме (Сумма)
+        else:
+            compiled.add("date", mask=_date_mask(dt_from, dt_to))
     if amount_from is not None or amount_to is not None:
-        temp = []
-        for row in filtered:
-            try:
-                amount = float(row.get("Сумма")) if row.get("Сумма") is not None else None
-            except Exception:
-                amount = None
-            if amount is not None:
-                if amount_from is not None and amount < amount_from:
-                    continue
-                if amount_to is not None and amount > amount_to:
-                    continue
-                temp.append(row)
-        filtered = temp
-
-    # 6. Фильтр по полу (может быть несколько значений)
+        compiled.add("amount", mask=_amount_mask(amount_from, amount_to))
     if gender:
-        accepted_raw = gender
-        gender_map_single = {
-            "мужчина": "мужчина",
-            "женщина": "женщина",
-            "неизвестно": "неизвестно",
-            "муж": "мужчина",
-            "жен": "женщина",
-            "male": "мужчина",
-            "female": "женщина",
-        }
-        accepted = {gender_map_single.get(g.strip().lower(), g.strip().lower()) for g in accepted_raw}
-        temp = []
-        for row in filtered:
-            g = row.get("gender")
-            if not g:
-                fio = row.get("ФИО")
-                g = guess_gender_by_fio(fio)
-            g_norm = g.strip().lower() if g else "неизвестно"
-            if g_norm in accepted:
-                temp.append(row)
-        filtered = temp
-
-    # 7. Фильтр по языку (список значений)
+        compiled.add("gender", mask=lambda store, mask: mask & store.isin("gender", gender))
     if language:
-        lang_map_single = {
-            "казахский": "казахский",
-            "русский": "русский",
-            "английский": "английский",
-            "английский язык": "английский",
-            "english": "английский",
-            "другой": "другой",
-            "other": "другой",
-        }
-        accepted_raw = language
-        accepted = {lang_map_single.get(l.strip().lower(), l.strip().lower()) for l in accepted_raw}
-
-        temp = []
-        for row in filtered:
-            l = row.get("язык")
-            if not l or l == "неизвестно":
-                fio = row.get("ФИО")
-                l = guess_language_by_fio(fio)
-            l_norm = l.strip().lower() if l else "неизвестно"
-            if "другой" in accepted:
-                if l_norm not in ("казахский", "русский", "английский"):
-                    temp.append(row)
-            if l_norm in accepted:
-                temp.append(row)
-        filtered = temp
-
-    return filtered
+        compiled.add("language", mask=_language_mask(language))
+    return compiled
+
+
+def filter_mask(store: ExcelColumnStore, *args, **kwargs) -> np.ndarray:
+    """Булева маска строк снимка, прошедших все фильтры (параметры — как у compile_excel_filter)."""
+    return compile_excel_filter(*args, **kwargs).mask(store)
+
+
+def apply_filters(store: ExcelColumnStore, *args, **kwargs) -> list[dict]:
+    """Отфильтрованные строки в порядке id (параметры — как у compile_excel_filter)."""
+    return store.materialize(filter_mask(store, *args, **kwargs))
 
 @router.get("/filter_users_excel_2025", tags=["Excel"])
 def filter_users_excel_2025(
+    request: Request,
     type: list[str] | None = Query(None, description="Тип(ы) донаций: single/periodic/frequent"),
     date_from: str | None = Query(None, description="Начальная дата DD.MM.YYYY"),
     date_to: str | None = Query(None, description="Конечная дата DD.MM.YYYY"),
@@ -514,18 +572,29 @@ def filter_users_excel_2025(
     gender: list[str] | None = Query(None, description="Пол(ы): мужчина/женщина/неизвестно"),
     language: list[str] | None = Query(None, description="Язык(и): казахский/русский/английский/другой"),
     source: list[str] | None = Query(None, description="Источник(и)"),
+    page: PageParams = Depends(),
+    db: Session = Depends(get_db)
 ):
-    return apply_filters(
-        all_users_data,
-        type,
-        date_from,
-        date_to,
-        amount_from,
-        amount_to,
-        gender,
-        language,
-        source,
-    )
+    def build(response: Response):
+        store = get_excel_store(db)
+        mask = filter_mask(
+            store,
+            type,
+            date_from,
+            date_to,
+            amount_from,
+            amount_to,
+            gender,
+            language,
+            source,
+        )
+        if not page.enabled:
+            return store.materialize(mask)
+        rows, has_more = store.page(mask, page.after_id, page.limit)
+        set_page_headers(response, rows[-1]["id"] if rows else None, has_more, int(mask.sum()))
+        return rows
+
+    return cached_json(request, db, EXCEL_USERS, build)
 
 @router.get("/export_users_excel_2025", tags=["Excel"])
 def export_users_excel_2025(
@@ -537,9 +606,11 @@ def export_users_excel_2025(
     gender: list[str] | None = Query(None),
     language: list[str] | None = Query(None),
     source: list[str] | None = Query(None),
+    format: str = Query("xlsx", pattern="^(xlsx|csv|parquet)$", description="xlsx / csv / parquet"),
+    db: Session = Depends(get_db)
 ):
     rows = apply_filters(
-        all_users_data,
+        get_excel_store(db),
         type,
         date_from,
         date_to,
@@ -549,44 +620,34 @@ def export_users_excel_2025(
         language,
         source,
     )
-
-    if not rows:
-        raise HTTPException(404, "Нет данных под выбранные фильтры")
-
-    df = pd.DataFrame(rows)
-    buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False)
-    buffer.seek(0)
-
-    return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=filtered_users.xlsx"}
-    )
+    # Файл пишется построчно (см. export_engine), без промежуточного DataFrame
+    return export_response(rows, format, "filtered_users")
 
 @router.post("/add_user_excel_2025", tags=["Excel"])
-def add_user_excel_2025(user: dict = Body(...)):
-    global all_users_data
-    # Корректно формируем id
-    next_id = len(all_users_data) + 1 if all_users_data else 1
+def add_user_excel_2025(user: dict = Body(...), db: Session = Depends(get_db)):
     user = dict(user)
-    user["id"] = next_id
     # Добавляем телефон и язык, даже если их нет
     if "телефон" not in user:
         user["телефон"] = None
     if "язык" not in user:
         user["язык"] = None
-    all_users_data.append(user)
-    return user
+    # id выдаёт последовательность базы
+    db_user = new_excel_user(user)
+    db.add(db_user)
+    bump_data_version(db, EXCEL_USERS)
+    db.commit()
+    return user_to_row(db_user)
 
 @router.put("/update_user_excel_2025", tags=["Excel"])
 def update_user_excel_2025(
     id: int = Body(..., description="ID пользователя"),
-    updates: dict = Body(..., description="Поля для обновления")
+    updates: dict = Body(..., description="Поля для обновления"),
+    db: Session = Depends(get_db)
 ):
-    for user in all_users_data:
-        if user.get("id") == id:
-            user.update(updates)
-            return {"success": True, "user": user}
-    raise HTTPException(status_code=404, detail="User not found") 
\ No newline at end of file
+    user = db.get(ExcelUser, id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    save_excel_user(user, {**user.data, **updates})
+    bump_data_version(db, EXCEL_USERS)
+    db.commit()
+    return {"success": True, "user": user_to_row(user)} 
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, JSON
+from sqlalchemy import Column, Integer, SmallInteger, String, JSON, Date, DateTime, Numeric, ForeignKey, Index
 from .database import Base
 
 
@@ -23,18 +23,142 @@ class CRMEntry(Base):
     id = Column(Integer, primary_key=True, index=True)
     data = Column(JSON)
     source = Column(String, default="import")
+    # Канонические поля, извлечённые из data при загрузке (см. crm_fields.py)
+    payment_date = Column(Date, nullable=True, index=True)
+    amount = Column(Numeric(14, 2), nullable=True, index=True)
+    iin = Column(String, nullable=True, index=True)
+    fio_normalized = Column(String, nullable=True, index=True)
+    email = Column(String, nullable=True, index=True)
+    phone = Column(String, nullable=True, index=True)
+    month = Column(SmallInteger, nullable=True, index=True)  # 1..12
+    year = Column(SmallInteger, nullable=True, index=True)
+    donor_id = Column(Integer, ForeignKey("donors.id"), nullable=True, index=True)
+    # Ключ платежа (crm_fields.payment_hash): повторная загрузка той же строки пропускается
+    row_hash = Column(String(64), nullable=True, unique=True, index=True)
+
+
+class Donor(Base):
+    """Донор, к которому при загрузке привязываются записи CRM (см. donors.py).
+
+    Для нечёткого поиска по fio_normalized миграция создаёт GIN-индекс pg_trgm.
+    """
+    __tablename__ = "donors"
+
+    id = Column(Integer, primary_key=True, index=True)
+    iin = Column(String, nullable=True, unique=True)
+    fio_normalized = Column(String, nullable=True, index=True)
+    email = Column(String, nullable=True, index=True)
+    phone = Column(String, nullable=True, index=True)
+
+
+class DonorStats(Base):
+    """Агрегаты по донору; пересчитываются для затронутых доноров при каждой записи в crm_entries."""
+    __tablename__ = "donor_stats"
+
+    donor_id = Column(Integer, ForeignKey("donors.id"), primary_key=True)
+    donation_count = Column(Integer, nullable=False, default=0)
+    amount_count = Column(Integer, nullable=False, default=0)  # Записи с распознанной суммой
+    total_amount = Column(Numeric(14, 2), nullable=False, default=0)
+    avg_amount = Column(Numeric(14, 2), nullable=True)
+    first_date = Column(Date, nullable=True)
+    last_date = Column(Date, nullable=True)
+    donor_class = Column(String, nullable=False, index=True)  # single / periodic / frequent
 
 
 class ExcelUser(Base):
+    """Строка загрузки 2025 (/upload_excel_2025, /add_user_excel_2025)."""
     __tablename__ = "excel_users"
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     email = Column(String, index=True)
     month = Column(String)
-    date = Column(String)  # Можно заменить на DateTime, если нужно строгое хранение даты
-    fio = Column(String)
-    summa = Column(Integer)
+    date = Column(String)  # Дата как в исходном файле
+    fio = Column(String, index=True)
+    summa = Column(Numeric(14, 2), index=True)
     payment_id = Column(String, nullable=True)
     phone = Column(String, nullable=True)
     language = Column(String, nullable=True)
-    source = Column(String)
+    source = Column(String, index=True)
+    payment_date = Column(Date, nullable=True, index=True)  # Разобранная дата для фильтров
+    guessed_gender = Column(String, nullable=True, index=True)  # Пол по ФИО, считается при записи
+    guessed_language = Column(String, nullable=True, index=True)  # Язык по ФИО, считается при записи
+    data = Column(JSON)  # Вся строка целиком, в том виде, в котором её отдаёт API
+
+
+class DataVersion(Base):
+    """Счётчик изменений набора данных; по нему воркеры сбрасывают свои кеши."""
+    __tablename__ = "data_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class ExportJob(Base):
+    """Фоновый экспорт CRM (см. export_jobs.py)."""
+    __tablename__ = "export_jobs"
+
+    id = Column(String, primary_key=True)  # uuid4 hex
+    params_key = Column(String, nullable=False, index=True)  # Хеш фильтров, формата и версии данных
+    params = Column(JSON)
+    format = Column(String, nullable=False)
+    status = Column(String, nullable=False, index=True)  # queued / running / done / failed / expired
+    rows_read = Column(Integer, nullable=False, default=0)  # Строк выборки, сброшенных во временный NDJSON
+    rows_written = Column(Integer, nullable=False, default=0)  # Строк, записанных в файл формата
+    total_rows = Column(Integer, nullable=True)
+    file_path = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)  # Пульс работающего задания
+    expires_at = Column(DateTime, nullable=True)
+
+
+class ImportJob(Base):
+    """Фоновая загрузка /upload_excel (см. import_jobs.py)."""
+    __tablename__ = "import_jobs"
+
+    id = Column(String, primary_key=True)  # uuid4 hex
+    source = Column(String, nullable=True)
+    files = Column(JSON)  # Имена загруженных файлов
+    status = Column(String, nullable=False, index=True)  # queued / parsing / inserting / done / no_valid_data / failed
+    rows_parsed = Column(Integer, nullable=False, default=0)
+    rows_inserted = Column(Integer, nullable=False, default=0)
+    rows_rejected = Column(Integer, nullable=False, default=0)  # Строки без месяца
+    rows_skipped = Column(Integer, nullable=False, default=0)  # Уже загруженные строки (row_hash)
+    files_skipped = Column(JSON)  # Уже загруженные файлы (imported_files)
+    sheet_errors = Column(JSON)  # [{"file", "sheet", "error"}]
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class ImportedFile(Base):
+    """Отпечаток (sha256) успешно загруженного через /upload_excel файла."""
+    __tablename__ = "imported_files"
+
+    sha256 = Column(String(64), primary_key=True)
+    filename = Column(String, nullable=True)
+    source = Column(String, nullable=True)
+    job_id = Column(String, nullable=True)
+    imported_at = Column(DateTime, nullable=False)
+
+
+class CRMRollup(Base):
+    """Агрегаты CRM по месяцу × источнику × полу × языку для /crm/analytics (см. rollups.py).
+
+    Пустое измерение хранится как 0 / '' — иначе его нельзя включить в уникальный ключ.
+    """
+    __tablename__ = "crm_rollups"
+    __table_args__ = (
+        Index("ux_crm_rollups_bucket", "year", "month", "source", "gender", "language", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    year = Column(SmallInteger, nullable=False)  # 0 — дата не распознана
+    month = Column(SmallInteger, nullable=False)  # 1..12, 0 — не определён
+    source = Column(String, nullable=False)
+    gender = Column(String, nullable=False)
+    language = Column(String, nullable=False)
+    entry_count = Column(Integer, nullable=False)
+    amount_count = Column(Integer, nullable=False)  # Записи с распознанной суммой
+    total_amount = Column(Numeric(16, 2), nullable=False)
+    donor_count = Column(Integer, nullable=False)  # Уникальные доноры в ячейке
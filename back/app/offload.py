@@ -0,0 +1,28 @@
+"""Вынос блокирующей работы из event loop.
+
+async-эндпоинты загрузки (разбор Excel pandas/openpyxl, копирование файлов,
+синхронные сессии SQLAlchemy) выполняют тяжёлую часть в отдельном пуле
+потоков размером BLOCKING_WORKERS. Пул не общий с пулом, в котором FastAPI
+выполняет обычные def-эндпоинты, поэтому большая загрузка не отнимает
+потоки у /crm и остальных чтений, а event loop остаётся свободным.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", 4))
+
+T = TypeVar("T")
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+
+async def run_blocking(func: Callable[..., T], *args, **kwargs) -> T:
+    """Выполняет func(*args, **kwargs) в пуле BLOCKING_WORKERS и ждёт результат.
+
+    Если все потоки пула заняты, вызов ждёт в очереди, не занимая event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,128 @@
+"""Keyset-пагинация списков: ?limit=&cursor=.
+
+Курсор — непрозрачная строка с последним отданным id. Следующая страница
+выбирается условием id > last_id по первичному ключу, поэтому цена
+страницы не зависит от её номера. Тело ответа остаётся JSON-массивом:
+курсор следующей страницы и общее число строк приходят в заголовках
+X-Next-Cursor и X-Total-Count. Без limit эндпоинты отдают всё, как раньше.
+"""
+import base64
+import binascii
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import Select, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Query as SAQuery, Session
+
+from .versions import get_data_version, get_data_version_async
+
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 5000))
+COUNT_CACHE_SIZE = int(os.getenv("COUNT_CACHE_SIZE", 1024))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_HEADER = "X-Total-Count"
+PAGE_HEADERS = [NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER]
+
+
+def encode_cursor(last_id: int) -> str:
+    raw = json.dumps({"id": last_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return int(json.loads(raw)["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class PageParams:
+    """Параметры страницы; limit=None — отдать всё без пагинации."""
+
+    def __init__(
+        self,
+        limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Размер страницы"),
+        cursor: str | None = Query(None, description="Курсор из заголовка X-Next-Cursor"),
+    ):
+        self.limit = limit
+        self.after_id = decode_cursor(cursor) if cursor else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit is not None or self.after_id is not None
+
+
+def paginate_query(query: SAQuery, id_column, page: PageParams) -> tuple[list, bool]:
+    """(строки страницы, есть ли следующая) — порядок по id_column."""
+    if page.after_id is not None:
+        query = query.filter(id_column > page.after_id)
+    query = query.order_by(id_column)
+    if page.limit is None:
+        return query.all(), False
+    rows = query.limit(page.limit + 1).all()
+    return rows[:page.limit], len(rows) > page.limit
+
+
+async def paginate_select(db: AsyncSession, stmt: Select, id_column, page: PageParams) -> tuple[list, bool]:
+    """То же, что paginate_query, для select() в async-сессии."""
+    if page.after_id is not None:
+        stmt = stmt.where(id_column > page.after_id)
+    stmt = stmt.order_by(id_column)
+    if page.limit is None:
+        return (await db.scalars(stmt)).all(), False
+    rows = (await db.scalars(stmt.limit(page.limit + 1))).all()
+    return rows[:page.limit], len(rows) > page.limit
+
+
+def set_page_headers(response: Response, last_id: int | None, has_more: bool, total: int | None = None):
+    if has_more and last_id is not None:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last_id)
+    if total is not None:
+        response.headers[TOTAL_COUNT_HEADER] = str(total)
+
+
+_counts: OrderedDict = OrderedDict()
+_counts_lock = threading.Lock()
+
+
+def _cached(key) -> int | None:
+    with _counts_lock:
+        if key in _counts:
+            _counts.move_to_end(key)
+            return _counts[key]
+    return None
+
+
+def _remember(key, total: int):
+    with _counts_lock:
+        _counts[key] = total
+        while len(_counts) > COUNT_CACHE_SIZE:
+            _counts.popitem(last=False)
+
+
+def cached_count(db: Session, dataset: str, params: tuple, query: SAQuery) -> int:
+    """COUNT(*) запроса, закешированный до следующего изменения набора dataset.
+
+    params — нормализованные параметры фильтра, отличающие один запрос от другого.
+    """
+    key = (dataset, get_data_version(db, dataset), params)
+    total = _cached(key)
+    if total is None:
+        total = query.order_by(None).count()
+        _remember(key, total)
+    return total
+
+
+async def cached_count_async(db: AsyncSession, dataset: str, params: tuple, stmt: Select) -> int:
+    """cached_count для select() в async-сессии; кеш общий."""
+    key = (dataset, await get_data_version_async(db, dataset), params)
+    total = _cached(key)
+    if total is None:
+        total = await db.scalar(select(func.count()).select_from(stmt.order_by(None).subquery()))
+        _remember(key, total)
+    return total
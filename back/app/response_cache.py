@@ -0,0 +1,190 @@
+"""Кеш готовых ответов для частых чтений CRM и *_excel_2025.
+
+Ключ — путь, нормализованные параметры запроса и версия набора данных
+(см. versions.py): любая запись (загрузки, ручной ввод, правки) увеличивает
+версию в той же транзакции, поэтому старые ответы просто перестают
+совпадать по ключу и вытесняются LRU. TTL ограничивает жизнь записи на
+случай изменений мимо счётчика версий.
+
+ETag вычисляется из того же ключа, поэтому If-None-Match проверяется до
+построения ответа и даже без записи в кеше этого воркера: совпал — 304.
+В ключ входит и номер окна TTL по настенным часам (одинаковый во всех
+воркерах): по истечении окна ETag меняется, так что 304 тоже не продлевает
+ответ дольше TTL, даже если увеличение версии было пропущено.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Awaitable, Callable
+
+import orjson
+from fastapi import APIRouter, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .pagination import PAGE_HEADERS
+from .versions import get_data_version, get_data_version_async
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 512))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 300))
+# Ответы больше этого размера не хранятся (ETag/304 для них всё равно работают)
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", 8 * 1024 * 1024))
+
+CACHE_STATUS_HEADER = "X-Cache"
+CACHE_HEADERS = ["ETag", CACHE_STATUS_HEADER]
+
+router = APIRouter()
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    headers: dict
+    expires_at: float
+
+
+class ResponseCache:
+    """LRU с TTL и счётчиками попаданий; безопасен для нескольких потоков."""
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = dict(hits=0, misses=0, not_modified=0, expired=0, evictions=0, too_large=0)
+
+    def count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key) -> CachedResponse | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                self._stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, key, body: bytes, headers: dict):
+        if len(body) > RESPONSE_CACHE_MAX_ENTRY_BYTES:
+            self.count("too_large")
+            return
+        with self._lock:
+            self._entries[key] = CachedResponse(body, headers, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hit_ratio": self._stats["hits"] / lookups if lookups else 0,
+            }
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_SECONDS)
+
+
+def _default(value):
+    # Как jsonable_encoder: Decimal -> число, остальное -> строка
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def _cache_key(request: Request, dataset: str, version: int) -> tuple:
+    # Порядок параметров и повторяющиеся ключи (?source=a&source=b) не важны
+    params = tuple(sorted(request.query_params.multi_items()))
+    window = int(time.time() // max(RESPONSE_CACHE_TTL_SECONDS, 1))
+    return request.url.path, params, dataset, version, window
+
+
+def _etag(key: tuple) -> str:
+    return '"' + hashlib.sha1(repr(key).encode()).hexdigest() + '"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in tags or "*" in tags
+
+
+def _lookup(request: Request, key: tuple) -> tuple[str, Response | None]:
+    etag = _etag(key)
+    if _not_modified(request, etag):
+        response_cache.count("not_modified")
+        return etag, Response(status_code=304, headers={"ETag": etag})
+    cached = response_cache.get(key)
+    if cached is not None:
+        return etag, _json_response(cached.body, cached.headers, etag, "HIT")
+    return etag, None
+
+
+def _store(key: tuple, etag: str, content, response: Response) -> Response:
+    body = orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    headers = {name: response.headers[name] for name in PAGE_HEADERS if name in response.headers}
+    response_cache.put(key, body, headers)
+    return _json_response(body, headers, etag, "MISS")
+
+
+def _json_response(body: bytes, headers: dict, etag: str, status: str) -> Response:
+    return Response(
+        body,
+        media_type="application/json",
+        headers={**headers, "ETag": etag, CACHE_STATUS_HEADER: status},
+    )
+
+
+def cached_json(request: Request, db: Session, dataset: str, build: Callable[[Response], object]) -> Response:
+    """Ответ из кеша или build(response) — для обычных def-эндпоинтов.
+
+    dataset — набор данных (versions.py), от которого зависит ответ. build
+    получает Response для заголовков страницы (X-Next-Cursor и т. п.), они
+    сохраняются вместе с телом.
+    """
+    key = _cache_key(request, dataset, get_data_version(db, dataset))
+    etag, cached = _lookup(request, key)
+    if cached is not None:
+        return cached
+    response = Response()
+    return _store(key, etag, build(response), response)
+
+
+async def cached_json_async(
+    request: Request, db: AsyncSession, dataset: str, build: Callable[[Response], Awaitable[object]]
+) -> Response:
+    """То же, что cached_json, для async-эндпоинтов."""
+    key = _cache_key(request, dataset, await get_data_version_async(db, dataset))
+    etag, cached = _lookup(request, key)
+    if cached is not None:
+        return cached
+    response = Response()
+    return _store(key, etag, await build(response), response)
+
+
+@router.get("/cache/stats", tags=["Cache"])
+def cache_stats():
+    """Попадания, промахи, 304 и вытеснения кеша ответов с момента запуска воркера."""
+    return response_cache.stats()
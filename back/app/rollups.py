@@ -0,0 +1,119 @@
+"""Материализованные агрегаты CRM для дашборда.
+
+crm_rollups хранит число записей, сумму, число записей с суммой и число
+уникальных доноров в разрезе год/месяц × источник × пол × язык. Таблица
+обновляется инкрементально: после каждой записи в crm_entries (bulk_insert,
+manual_crm_entry) пересчитываются только затронутые месяцы. /crm/analytics
+читает готовые строки вместо выгрузки всего /crm в браузер.
+"""
+from typing import Iterable
+
+from sqlalchemy import and_, delete, func, insert, or_, select
+from sqlalchemy.orm import Session
+
+from .database import lock_crm_writes
+from .crm_fields import MONTH_NAMES
+from .crm_query import json_text
+from .filters import lower_set, month_number
+from .models import CRMEntry, CRMRollup
+
+ROLLUP_PERIODS_CHUNK = 100
+
+DIMENSIONS = ("source", "gender", "language")
+
+
+def _dimension(expr):
+    # Так же, как сравнивают фильтры /crm/filter: lower(trim(...)), пусто -> ''
+    return func.coalesce(func.lower(func.trim(expr)), '')
+
+
+def dimension_exprs() -> dict:
+    return {
+        "source": _dimension(CRMEntry.source),
+        "gender": _dimension(func.coalesce(json_text('gender'), json_text('пол'))),
+        "language": _dimension(func.coalesce(json_text('language'), json_text('язык'))),
+    }
+
+
+def _period_condition(year: int | None, month: int | None):
+    return and_(
+        CRMEntry.year == year if year else CRMEntry.year.is_(None),
+        CRMEntry.month == month if month else CRMEntry.month.is_(None),
+    )
+
+
+def refresh_rollups(db: Session, periods: Iterable[tuple[int | None, int | None]]):
+    """Пересчитывает crm_rollups для переданных пар (год, месяц).
+
+    Вызывается в той же транзакции после записи в crm_entries; commit
+    остаётся за вызывающим. Пересчёт идёт под блокировкой записи CRM:
+    ручной ввод во время загрузки не вставит ту же ячейку
+    ux_crm_rollups_bucket параллельно.
+    """
+    lock_crm_writes(db)
+    periods = sorted({(year or 0, month or 0) for year, month in periods})
+    dims = dimension_exprs()
+    for start in range(0, len(periods), ROLLUP_PERIODS_CHUNK):
+        chunk = periods[start:start + ROLLUP_PERIODS_CHUNK]
+        db.execute(delete(CRMRollup).where(or_(*(
+            and_(CRMRollup.year == year, CRMRollup.month == month) for year, month in chunk
+        ))))
+        year = func.coalesce(CRMEntry.year, 0)
+        month = func.coalesce(CRMEntry.month, 0)
+        aggregates = (
+            select(
+                year,
+                month,
+                dims["source"],
+                dims["gender"],
+                dims["language"],
+                func.count(CRMEntry.id),
+                func.count(CRMEntry.amount),
+                func.coalesce(func.sum(CRMEntry.amount), 0),
+                func.count(CRMEntry.donor_id.distinct()),
+            )
+            .where(or_(*(_period_condition(y, m) for y, m in chunk)))
+            .group_by(year, month, dims["source"], dims["gender"], dims["language"])
+        )
+        db.execute(insert(CRMRollup).from_select([
+            "year", "month", "source", "gender", "language",
+            "entry_count", "amount_count", "total_amount", "donor_count",
+        ], aggregates))
+
+
+def rollup_query(
+    year: int | None = None,
+    month: str | None = None,
+    source: list[str] | None = None,
+    gender: list[str] | None = None,
+    language: list[str] | None = None,
+):
+    """select() строк crm_rollups под фильтры /crm/analytics; None — месяц не распознан."""
+    stmt = select(CRMRollup)
+    if year:
+        stmt = stmt.where(CRMRollup.year == year)
+    if month:
+        number = month_number(month)
+        if number is None:
+            return None
+        stmt = stmt.where(CRMRollup.month == number)
+    for name, values in (("source", source), ("gender", gender), ("language", language)):
+        if values:
+            stmt = stmt.where(getattr(CRMRollup, name).in_(lower_set(values)))
+    return stmt.order_by(
+        CRMRollup.year, CRMRollup.month, CRMRollup.source, CRMRollup.gender, CRMRollup.language
+    )
+
+
+def rollup_to_row(rollup: CRMRollup) -> dict:
+    return {
+        "year": rollup.year or None,
+        "month": MONTH_NAMES[rollup.month - 1] if rollup.month else None,
+        "source": rollup.source or None,
+        "gender": rollup.gender or None,
+        "language": rollup.language or None,
+        "count": rollup.entry_count,
+        "total_amount": float(rollup.total_amount),
+        "average_gift": float(rollup.total_amount / rollup.amount_count) if rollup.amount_count else 0,
+        "unique_donors": rollup.donor_count,
+    }
@@ -10,6 +10,7 @@ import io
 import traceback
 from datetime import datetime
 from .models import ExcelUser
+from .offload import run_blocking
 
 router = APIRouter()
 
@@ -57,12 +58,6 @@ def get_users(db: Session = Depends(database.get_db)):
     return db.query(models.User).all()
 
 
-@router.get("/crm")
-def get_crm(db: Session = Depends(database.get_db)):
-    entries = db.query(models.CRMEntry).all()
-    return [entry.data for entry in entries]
-
-
 # ========================= Профиль пользователя =========================
 
 @router.get("/me/profile", response_model=schemas.UserFullProfile)
@@ -94,7 +89,12 @@ async def upsert_user_profile(
         current_user.city = city
     if address is not None:
         current_user.address = address
+    # Копирование фото и commit блокируют — выполняются в пуле offload
+    await run_blocking(_save_profile, current_user, file, db)
+    return {"message": "Профиль обновлён", "user_id": current_user.id}
 
+
+def _save_profile(current_user: models.User, file: Optional[UploadFile], db: Session):
     if file:
         uploads_dir = "static"
         os.makedirs(uploads_dir, exist_ok=True)
@@ -106,4 +106,3 @@ async def upsert_user_profile(
 
     db.commit()
     db.refresh(current_user)
-    return {"message": "Профиль обновлён", "user_id": current_user.id}
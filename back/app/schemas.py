@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import Optional, Any, Literal
 from fastapi import APIRouter, HTTPException
 from . import models, database
 
@@ -84,12 +84,33 @@ class ExcelUserCreate(BaseModel):
     month: str
     date: str  # Можно заменить на datetime, если нужно строгое хранение даты
     fio: str
-    summa: int
+    summa: float
     payment_id: Optional[str] = None
     phone: Optional[str] = None
     language: Optional[str] = None
     source: str
 
+class ExcelUserFieldUpdate(BaseModel):
+    id: int
+    field: str  # Поле строки; phone/language/gender — синонимы для "телефон"/"язык"/"gender"
+    value: Any = None
+
+
+class CRMExportJobCreate(BaseModel):
+    # Те же фильтры, что у /crm/filter
+    year: Optional[int] = None
+    month: Optional[str] = None
+    amount_from: Optional[float] = None
+    amount_to: Optional[float] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    source: Optional[list[str]] = None
+    type: Optional[list[str]] = None
+    gender: Optional[list[str]] = None
+    language: Optional[list[str]] = None
+    format: Literal["xlsx", "csv", "parquet"] = "xlsx"
+
+
 class ExcelUserOut(ExcelUserCreate):
     id: int
 
@@ -0,0 +1,117 @@
+"""Реестр колонок выгрузок банков и платёжных сервисов.
+
+У каждого канонического поля (дата, сумма, e-mail, телефон, ...) есть
+имя, синонимы — другие названия той же колонки в разных выгрузках — и
+запасные колонки с другим смыслом, из которых поле берётся, если основной
+нет (Кредит/Дебет для суммы, «E-mail & phone number» для контактов).
+Заголовки сравниваются без учёта регистра и пробелов по краям
+(«Номер телефон » с пробелом в конце совпадает с «Номер телефон»).
+
+Заголовок листа сопоставляется с реестром один раз: detect_profile
+кешируется по набору заголовков. Готовый SourceProfile знает, какие
+колонки листа дают каждое поле, поэтому строки читаются без перебора
+синонимов, а rename приводит целый лист к каноническим именам одним
+проходом по колонкам. Новая выгрузка добавляется строкой в FIELDS.
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable
+
+import pandas as pd
+
+SENDER_FIELD = "Отправитель (Наименование, БИК, ИИК, БИН/ИИН)"
+
+
+@dataclass(frozen=True)
+class CanonicalField:
+    name: str
+    synonyms: tuple[str, ...] = ()
+    fallbacks: tuple[str, ...] = ()
+
+
+# Ключ — поле для кода; порядок синонимов и запасных колонок — приоритет
+FIELDS = {
+    "date": CanonicalField("Дата", ("Дата платежа", "Дата и время", "date", "datetime")),
+    "amount": CanonicalField("Сумма", ("Сумма платежа", "Сумма операции"), ("Кредит", "Дебет")),
+    "email": CanonicalField("E-mail", ("Электронная почта",), ("E-mail & phone number",)),
+    "phone": CanonicalField("телефон", ("Номер телефона", "Номер телефон"), ("E-mail & phone number",)),
+    "fio": CanonicalField("ФИО"),
+    "iin": CanonicalField("ИИН"),
+    "sender": CanonicalField(SENDER_FIELD),
+    # Идентификатор платежа в выгрузке банка — по нему повторная загрузка узнаёт строку
+    "payment_id": CanonicalField("Код платежа", ("Уникальный идентификатор", "ID платежа", "Номер транзакции")),
+}
+
+
+# Колонки ключа платежа crm_entries.row_hash — точные имена, как при первых
+# загрузках. Ключи уже лежат в базе, поэтому синонимы из FIELDS и сравнение
+# без регистра сюда не переносятся: иначе повторная загрузка старого файла
+# получит другие row_hash и дедупликация её не узнает.
+ROW_HASH_COLUMNS = {
+    "date": ("Дата", "Дата платежа", "Дата и время"),
+    "amount": ("Сумма", "Сумма операции", "Кредит", "Дебет"),
+    "iin": ("ИИН",),
+    "sender": (SENDER_FIELD,),
+    "payment_id": ("Код платежа", "Уникальный идентификатор", "ID платежа", "Номер транзакции"),
+}
+
+
+def _key(header) -> str:
+    return str(header).strip().lower()
+
+
+def _filled(col: pd.Series) -> pd.Series:
+    return col.notna() & ~col.isin([""])
+
+
+@dataclass(frozen=True)
+class SourceProfile:
+    # поле -> колонки листа в порядке приоритета (имя и синонимы, затем запасные)
+    columns: dict[str, tuple[str, ...]]
+    # каноническое имя -> колонки листа, которые сводятся в него при rename
+    renames: dict[str, tuple[str, ...]]
+
+    def first(self, data: dict, field: str):
+        """Первое непустое значение поля в строке."""
+        for column in self.columns[field]:
+            value = data.get(column)
+            if value is not None and value != "":
+                return value
+        return None
+
+    def rename(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Лист с каноническими именами колонок: синонимы сведены в одну колонку.
+
+        Из нескольких колонок одного поля берётся первое непустое значение
+        по приоритету, пустые значения становятся None.
+        """
+        for name, headers in self.renames.items():
+            merged = df[headers[0]]
+            for header in headers[1:]:
+                merged = merged.where(_filled(merged), df[header])
+            df = df.drop(columns=list(headers[1:])).rename(columns={headers[0]: name})
+            df[name] = merged.astype(object).where(_filled(merged), None)
+        return df
+
+
+@lru_cache(maxsize=1024)
+def _detect(header: tuple) -> SourceProfile:
+    by_key: dict[str, list[str]] = {}
+    for column in header:
+        by_key.setdefault(_key(column), []).append(column)
+
+    def present(names) -> tuple[str, ...]:
+        return tuple(column for name in names for column in by_key.get(_key(name), ()))
+
+    columns, renames = {}, {}
+    for field, spec in FIELDS.items():
+        own = present((spec.name, *spec.synonyms))
+        columns[field] = own + present(spec.fallbacks)
+        if own and own != (spec.name,):
+            renames[spec.name] = own
+    return SourceProfile(columns, renames)
+
+
+def detect_profile(header: Iterable) -> SourceProfile:
+    """Профиль выгрузки по заголовку листа (или ключам строки); кешируется."""
+    return _detect(tuple(header))
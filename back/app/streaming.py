@@ -0,0 +1,51 @@
+"""Потоковая выдача больших списков в формате NDJSON.
+
+Включается параметром ?stream=1 или заголовком Accept: application/x-ndjson.
+Строки читаются из базы серверным курсором (yield_per), сериализуются
+orjson и уходят клиенту пачками по мере чтения, поэтому время до первого
+байта и пиковая память не зависят от размера выборки.
+"""
+import os
+from typing import Callable
+
+import orjson
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Query, Session
+
+from .database import SessionLocal
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_FETCH_SIZE = int(os.getenv("STREAM_FETCH_SIZE", 1000))
+STREAM_FLUSH_BYTES = 64 * 1024
+
+
+def wants_stream(request: Request, stream: bool) -> bool:
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def _dumps(row) -> bytes:
+    return orjson.dumps(row, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+
+
+def ndjson_response(build_query: Callable[[Session], Query], to_row: Callable) -> StreamingResponse:
+    """Отдаёт строки запроса build_query(db) по одной на строку NDJSON.
+
+    Генератор открывает свою сессию: сессия get_db закрывается раньше,
+    чем StreamingResponse дочитает тело ответа.
+    """
+    def generate():
+        db = SessionLocal()
+        try:
+            buffer = bytearray()
+            for entry in build_query(db).yield_per(STREAM_FETCH_SIZE):
+                buffer += _dumps(to_row(entry))
+                if len(buffer) >= STREAM_FLUSH_BYTES:
+                    yield bytes(buffer)
+                    buffer.clear()
+            if buffer:
+                yield bytes(buffer)
+        finally:
+            db.close()
+
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
@@ -1,150 +1,325 @@
 from fastapi import APIRouter, UploadFile, File, Depends, Form
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 from .database import SessionLocal, get_db
-from .models import CRMEntry
+from .models import CRMEntry, ImportJob, ImportedFile
 import pandas as pd
+import numpy as np
 import traceback
 import io
 import logging
 import datetime
 import math
+import os
+import pickle
+import shutil
+import uuid
+import zipfile
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
 from .schemas import ManualCRMEntryCreate
+from .crm_fields import extract_payment_fields, MONTH_NAMES
+from .dates import parse_date_column
+from .source_profiles import SourceProfile, detect_profile
+from .bulk_insert import bulk_insert_crm_entries, crm_row, insert_ignoring_conflicts
+from .donors import DonorResolver, refresh_donor_stats
+from .rollups import refresh_rollups
+from .versions import CRM_ENTRIES, bump_data_version
+from .excel_stream import iter_sheet_chunks, save_upload, upload_suffix
+from .import_jobs import (
+    IMPORT_DIR, QUEUED, PARSING, INSERTING, DONE, NO_VALID_DATA, FAILED,
+    parse_pool, reset_parse_pool, import_runner, set_job,
+)
+from .workbook_inspect import sheet_names, validate_workbook, WorkbookError
+from .offload import run_blocking
 
 logging.basicConfig(level=logging.INFO)
 
 router = APIRouter()
 
 
-def get_month_from_date_string(date_str):
-    if not date_str or pd.isnull(date_str):
-        return None
-    try:
-        date_str = str(date_str).strip()
-        if date_str.lower() in ['nan', 'nat', 'none', '']:
-            return None
-        parsed_date = pd.to_datetime(date_str, errors='coerce', dayfirst=True)
-        return parsed_date.month if pd.notnull(parsed_date) else None
-    except:
-        return None
-
-
 def extract_months_from_excels(files, month_names):
     """Возвращает множество месяцев (имена листов, совпадающие с месяцами) из списка UploadFile."""
-    import io
-    import pandas as pd
     found_months = set()
     for file in files:
-        if hasattr(file, 'read') and callable(file.read):
-            # FastAPI UploadFile (async)
-            content = file.file.read() if hasattr(file.file, 'read') else file.read()
+        if hasattr(file, 'file'):
+            # FastAPI UploadFile — читаем только каталог zip и workbook.xml
+            source = file.file
         else:
             # bytes-like
-            content = file
-        excel = pd.ExcelFile(io.BytesIO(content))
-        for sheet_name in excel.sheet_names:
+            source = io.BytesIO(file)
+        for sheet_name in sheet_names(source):
             if sheet_name in month_names:
                 found_months.add(sheet_name)
     return found_months
 
 
-def convert_timestamps(obj):
-    if isinstance(obj, dict):
-        return {k: convert_timestamps(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_timestamps(i) for i in obj]
-    elif hasattr(obj, 'isoformat') and callable(obj.isoformat):
-        return obj.isoformat()
-    elif obj is None:
+MONTH_COLUMNS = ['month', 'месяц']
+
+# Индекс 12 — «месяц не определён»
+_MONTH_LOOKUP = np.array(MONTH_NAMES + [None], dtype=object)
+
+
+def _json_scalar(value):
+    if value is None:
+        return None
+    if isinstance(value, float):
+        return None if math.isnan(value) or math.isinf(value) else value
+    if value is pd.NaT:
         return None
-    elif isinstance(obj, float):
-        if math.isnan(obj) or math.isinf(obj):
-            return None
-        return obj
+    if hasattr(value, 'isoformat') and callable(value.isoformat):
+        return value.isoformat()
+    return value
+
+
+def _json_column(col: pd.Series) -> pd.Series:
+    """Приводит колонку к JSON-совместимым значениям (NaN/inf -> None, даты -> ISO)."""
+    if pd.api.types.is_datetime64_ns_dtype(col) or pd.api.types.is_datetime64_dtype(col):
+        text = np.datetime_as_string(col.to_numpy(), unit='s')
+        return pd.Series(text, index=col.index, dtype=object).where(col.notna(), None)
+    if pd.api.types.is_float_dtype(col):
+        return col.astype(object).where(np.isfinite(col.to_numpy(dtype=float)), None)
+    if pd.api.types.is_bool_dtype(col) or pd.api.types.is_integer_dtype(col):
+        return col
+    kind = pd.api.types.infer_dtype(col, skipna=True)
+    if kind in ('string', 'empty', 'integer', 'boolean', 'bytes'):
+        return col.astype(object).where(col.notna(), None)
+    # Смешанные колонки (даты вперемешку с текстом, inf и т.п.)
+    return col.map(_json_scalar).astype(object)
+
+
+def sheet_to_records(df: pd.DataFrame, sheet_name: str, profile: SourceProfile | None = None) -> list[dict]:
+    """Преобразует лист Excel в список строк CRM поколоночно, без iterrows.
+
+    Колонки месяца удаляются один раз на лист; месяц берётся из названия
+    листа, а если это не месяц — из колонки даты по схеме листа. Строки без
+    месяца отбрасываются.
+    """
+    profile = profile or detect_profile(df.columns)
+    df = df.drop(columns=[c for c in df.columns if str(c).strip().lower() in MONTH_COLUMNS])
+    if sheet_name in MONTH_NAMES:
+        months = np.full(len(df), sheet_name, dtype=object)
     else:
-        return obj
+        date_col = next(iter(profile.columns["date"]), None)
+        if date_col is None:
+            return []
+        month_num = parse_date_column(df[date_col]).dt.month
+        months = _MONTH_LOOKUP[month_num.fillna(13).astype(int).to_numpy() - 1]
+        keep = pd.notna(months)
+        df = df[keep]
+        months = months[keep]
 
+    keys = list(df.columns) + ['month']
+    columns = [_json_column(df[col]).tolist() for col in df.columns] + [months.tolist()]
+    return [dict(zip(keys, values)) for values in zip(*columns)]
 
-@router.post("/upload_excel", tags=["CRM"])
-async def upload_excel(
-    files: list[UploadFile] = File(...),
-    source: str = Form(None)
-):
-    all_entries = []
-    month_names = ['Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
-                   'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
-    for file in files:
+
+def parse_excel_file(path: str, filename: str, source: str | None, out_path: str) -> dict:
+    """Разбирает один файл в отдельном процессе (см. import_jobs.parse_pool).
+
+    Строки crm_entries пишутся пачками (pickle) в out_path. Ошибка листа не
+    останавливает разбор остальных листов и попадает в sheet_errors.
+    """
+    parsed = rejected = 0
+    sheet_errors = []
+    bad_sheets = set()
+    with open(out_path, "wb") as out:
         try:
-            content = await file.read()
-            excel = pd.ExcelFile(io.BytesIO(content))
-            for sheet_name in excel.sheet_names:
-                df = pd.read_excel(excel, sheet_name=sheet_name)
-                for _, row in df.iterrows():
-                    row_data = row.to_dict()
-                    # Удаляем все варианты ключа 'month' или 'месяц'
-                    for key in list(row_data.keys()):
-                        if key.strip().lower() in ['month', 'месяц']:
-                            del row_data[key]
-                    # Добавляем определение месяца
-                    if sheet_name in month_names:
-                        row_data['month'] = sheet_name
-                    else:
-                        # Пробуем взять месяц из поля "Дата" или "Дата и время"
-                        date_field = None
-                        for k in row_data:
-                            if k.strip().lower() in ['дата', 'дата и время', 'date', 'datetime']:
-                                date_field = row_data[k]
-                                break
-                        month_num = get_month_from_date_string(date_field)
-                        row_data['month'] = month_names[month_num - 1] if month_num and 1 <= month_num <= 12 else None
-
-                    if row_data['month'] is not None:
-                        row_data = convert_timestamps(row_data)
-                        entry_dict = {'data': row_data}
-                        if source:
-                            entry_dict['source'] = source
-                        all_entries.append(entry_dict)
+            for sheet_name, df in iter_sheet_chunks(path):
+                if sheet_name in bad_sheets:
+                    continue
+                try:
+                    # Схема выгрузки определяется по заголовку один раз, строки читаются по ней
+                    profile = detect_profile(df.columns)
+                    records = sheet_to_records(df, sheet_name, profile)
+                    batch = [crm_row(row_data, source, profile) for row_data in records]
+                except Exception as e:
+                    bad_sheets.add(sheet_name)
+                    sheet_errors.append({"file": filename, "sheet": sheet_name, "error": str(e)})
+                    continue
+                if batch:
+                    pickle.dump(batch, out, protocol=pickle.HIGHEST_PROTOCOL)
+                parsed += len(df)
+                rejected += len(df) - len(batch)
         except Exception as e:
-            return {"status": "error", "error": str(e)}
+            # Файл не дочитан — ошибка относится ко всему файлу
+            sheet_errors.append({"file": filename, "sheet": None, "error": str(e)})
+    return {"rows_parsed": parsed, "rows_rejected": rejected, "sheet_errors": sheet_errors}
+
+
+def _spooled_rows(paths: list[str]):
+    for path in paths:
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    batch = pickle.load(f)
+                except EOFError:
+                    break
+                yield from batch
+
+
+def _remember_files(db: Session, job_id: str, uploads: list[tuple[str, str, str]], source: str | None, failed: set[str]):
+    """Отпечатки файлов, разобранных без ошибок, — в той же транзакции, что и строки."""
+    now = datetime.datetime.utcnow()
+    rows = [
+        {"sha256": sha256, "filename": filename, "source": source, "job_id": job_id, "imported_at": now}
+        for _, filename, sha256 in uploads
+        if filename not in failed
+    ]
+    if rows:
+        db.execute(insert_ignoring_conflicts(db, ImportedFile, ["sha256"]), rows)
 
-    if not all_entries:
-        return {"status": "no_valid_data"}
 
+def run_import(job_id: str, uploads: list[tuple[str, str, str]], source: str | None, job_dir: str):
+    """Разбор файлов в пуле процессов и запись строк одной транзакцией."""
+    jobs_db: Session = SessionLocal()
     db: Session = SessionLocal()
     try:
-        for entry in all_entries:
-            db_entry = CRMEntry(data=entry['data'], source=entry.get('source', 'import'))
-            db.add(db_entry)
+        set_job(jobs_db, job_id, status=PARSING)
+        futures = {}
+        for i, (path, filename, _) in enumerate(uploads):
+            out_path = os.path.join(job_dir, f"{i}.rows")
+            futures[parse_pool().submit(parse_excel_file, path, filename, source, out_path)] = out_path
+        parsed = rejected = 0
+        sheet_errors = []
+        for future in as_completed(futures):
+            result = future.result()
+            parsed += result["rows_parsed"]
+            rejected += result["rows_rejected"]
+            sheet_errors += result["sheet_errors"]
+            set_job(jobs_db, job_id, rows_parsed=parsed, rows_rejected=rejected, sheet_errors=sheet_errors)
+
+        set_job(jobs_db, job_id, status=INSERTING)
+        # Файлы строк в порядке загрузки — id записей идут как при синхронной загрузке
+        rows = _spooled_rows([os.path.join(job_dir, f"{i}.rows") for i in range(len(uploads))])
+        def report(saved: int):
+            # Сбой записи прогресса не должен откатывать саму загрузку
+            try:
+                set_job(jobs_db, job_id, rows_inserted=saved)
+            except SQLAlchemyError:
+                jobs_db.rollback()
+
+        stats = bulk_insert_crm_entries(db, rows, progress=report)
+        if not stats["saved"] and not stats["skipped"]:
+            db.rollback()
+            set_job(jobs_db, job_id, status=NO_VALID_DATA, rows_inserted=0)
+            return
+        # Файл с ошибками листов не запоминается — после исправления его можно загрузить снова
+        _remember_files(db, job_id, uploads, source, {error["file"] for error in sheet_errors})
         db.commit()
-        return {"status": "success", "saved": len(all_entries)}
+        set_job(jobs_db, job_id, status=DONE, rows_inserted=stats["saved"], rows_skipped=stats["skipped"])
     except Exception as e:
+        if isinstance(e, BrokenProcessPool):
+            reset_parse_pool()
         db.rollback()
-        return {"status": "error", "error": str(e)}
+        jobs_db.rollback()
+        logging.error("Import job %s failed:\n%s", job_id, traceback.format_exc())
+        set_job(jobs_db, job_id, status=FAILED, rows_inserted=0, error=str(e))
     finally:
         db.close()
+        jobs_db.close()
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
+@router.post("/upload_excel", tags=["CRM"], status_code=202)
+async def upload_excel(
+    files: list[UploadFile] = File(...),
+    source: str = Form(None),
+    db: Session = Depends(get_db),
+):
+    """Принимает файлы и ставит загрузку в фон; ход — GET /crm/import_jobs/{job_id}."""
+    # Проверка и копирование файлов блокируют — выполняются в пуле offload
+    return await run_blocking(_accept_upload, files, source, db)
+
+
+def _accept_upload(files: list[UploadFile], source: str | None, db: Session) -> dict:
+    # Проверяем все файлы до начала записи — по каталогу zip и заголовкам листов
+    for file in files:
+        try:
+            validate_workbook(file.file)
+        except (WorkbookError, zipfile.BadZipFile) as e:
+            return {"status": "error", "error": f"{file.filename}: {e}"}
+
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.abspath(os.path.join(IMPORT_DIR, job_id))
+    os.makedirs(job_dir)
+    saved = []
+    for i, file in enumerate(files):
+        path = os.path.join(job_dir, f"{i}{upload_suffix(file)}")
+        with open(path, "wb") as out:
+            sha256 = save_upload(file, out)
+        saved.append((path, file.filename, sha256))
+
+    # Уже загруженные файлы (и повторы внутри одной загрузки) не разбираются вовсе
+    known = {
+        sha256 for (sha256,) in
+        db.query(ImportedFile.sha256).filter(ImportedFile.sha256.in_([sha256 for _, _, sha256 in saved]))
+    }
+    uploads, files_skipped = [], []
+    for path, filename, sha256 in saved:
+        if sha256 in known:
+            os.remove(path)
+            files_skipped.append(filename)
+        else:
+            known.add(sha256)
+            uploads.append((path, filename, sha256))
+    if not uploads:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return {"status": "already_imported", "files_skipped": files_skipped}
+
+    now = datetime.datetime.utcnow()
+    db.add(ImportJob(
+        id=job_id,
+        source=source,
+        files=[filename for _, filename, _ in uploads],
+        status=QUEUED,
+        rows_parsed=0,
+        rows_inserted=0,
+        rows_rejected=0,
+        rows_skipped=0,
+        sheet_errors=[],
+        files_skipped=files_skipped,
+        created_at=now,
+        updated_at=now,
+    ))
+    db.commit()
+    import_runner.submit(run_import, job_id, uploads, source, job_dir)
+    return {
+        "status": "accepted",
+        "job_id": job_id,
+        "status_url": f"/api/crm/import_jobs/{job_id}",
+        "files_skipped": files_skipped,
+    }
 
 
 @router.post("/get_months_from_excel", tags=["CRM"])
 async def get_months_from_excel(files: list[UploadFile] = File(...)):
     month_names = ['Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
                    'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
-    found_months = set()
-    for file in files:
-        content = await file.read()
-        excel = pd.ExcelFile(io.BytesIO(content))
-        for sheet_name in excel.sheet_names:
-            if sheet_name in month_names:
-                found_months.add(sheet_name)
+    # Имена листов берутся из xl/workbook.xml, данные листов не читаются;
+    # чтение файлов всё равно блокирует — выполняется в пуле offload
+    found_months = await run_blocking(extract_months_from_excels, files, month_names)
     return {"months": sorted(found_months, key=lambda m: month_names.index(m))}
 
 
-@router.post("/manual_crm_entry", tags=["CRM"])
-async def manual_crm_entry(entry: ManualCRMEntryCreate, db: Session = Depends(get_db)):
+def _save_manual_entry(entry: ManualCRMEntryCreate, db: Session) -> dict:
     try:
-        db_entry = CRMEntry(data=entry.data, source=entry.source)
+        fields = extract_payment_fields(entry.data)
+        DonorResolver(db).resolve([fields])
+        db_entry = CRMEntry(data=entry.data, source=entry.source, **fields)
         db.add(db_entry)
+        db.flush()
+        refresh_donor_stats(db, [db_entry.donor_id])
+        refresh_rollups(db, [(db_entry.year, db_entry.month)])
+        bump_data_version(db, CRM_ENTRIES)
         db.commit()
         db.refresh(db_entry)
         return {"status": "success", "id": db_entry.id}
     except Exception as e:
         db.rollback()
         return {"status": "error", "error": str(e)}
+
+
+@router.post("/manual_crm_entry", tags=["CRM"])
+async def manual_crm_entry(entry: ManualCRMEntryCreate, db: Session = Depends(get_db)):
+    return await run_blocking(_save_manual_entry, entry, db)
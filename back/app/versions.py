@@ -0,0 +1,46 @@
+"""Версии наборов данных для сброса кешей, общие для всех воркеров.
+
+Каждый путь записи в том же commit увеличивает версию своего набора, а
+читатели сравнивают её с версией своего снимка одним запросом по ключу.
+Строки наборов создаёт миграция 5d7b2e9f4c18, увеличение — один атомарный
+INSERT ... ON CONFLICT DO UPDATE, поэтому параллельные записи в разных
+воркерах не теряют увеличений.
+"""
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .models import DataVersion
+
+EXCEL_USERS = "excel_users"
+CRM_ENTRIES = "crm_entries"
+
+_UPSERT_DIALECTS = {"postgresql": postgresql, "sqlite": sqlite}
+
+
+def get_data_version(db: Session, name: str) -> int:
+    version = db.query(DataVersion.version).filter(DataVersion.name == name).scalar()
+    return version or 0
+
+
+async def get_data_version_async(db: AsyncSession, name: str) -> int:
+    version = await db.scalar(select(DataVersion.version).where(DataVersion.name == name))
+    return version or 0
+
+
+def bump_data_version(db: Session, name: str):
+    """Увеличивает версию набора; commit остаётся за вызывающим."""
+    dialect = _UPSERT_DIALECTS.get(db.get_bind().dialect.name)
+    if dialect is None:
+        db.execute(
+            update(DataVersion)
+            .where(DataVersion.name == name)
+            .values(version=DataVersion.version + 1)
+        )
+        return
+    db.execute(
+        dialect.insert(DataVersion)
+        .values(name=name, version=1)
+        .on_conflict_do_update(index_elements=[DataVersion.name], set_={"version": DataVersion.version + 1})
+    )
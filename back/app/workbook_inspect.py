@@ -0,0 +1,183 @@
+"""Быстрый просмотр структуры книги Excel без разбора данных.
+
+Для .xlsx список листов лежит в xl/workbook.xml внутри zip-архива, поэтому
+имена листов, оценку числа строк (тег <dimension>) и строку заголовков
+можно получить, прочитав только каталог архива и начало XML каждого листа.
+Для .xls используется xlrd в режиме on_demand.
+"""
+import posixpath
+import re
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+import xlrd
+
+_REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+_DIMENSION_RE = re.compile(r"^[A-Z]+(\d+)(?::[A-Z]+(\d+))?$")
+
+
+class WorkbookError(ValueError):
+    """Файл не является читаемой книгой Excel."""
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _rewind(source):
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+def _sheet_parts(zf: zipfile.ZipFile) -> list[tuple[str, str]]:
+    """[(имя листа, путь к XML листа в архиве)] в порядке книги."""
+    try:
+        rels = {}
+        with zf.open("xl/_rels/workbook.xml.rels") as f:
+            for _, el in iterparse(f):
+                if _local(el.tag) == "Relationship":
+                    target = el.get("Target", "")
+                    if target.startswith("/"):
+                        target = target.lstrip("/")
+                    else:
+                        target = posixpath.normpath(posixpath.join("xl", target))
+                    rels[el.get("Id")] = target
+        sheets = []
+        with zf.open("xl/workbook.xml") as f:
+            for _, el in iterparse(f):
+                if _local(el.tag) == "sheet":
+                    rel_id = el.get(_REL_ID) or next(
+                        (v for k, v in el.attrib.items() if _local(k) == "id"), None
+                    )
+                    sheets.append((el.get("name"), rels.get(rel_id)))
+        return sheets
+    except KeyError as e:
+        raise WorkbookError(f"В архиве нет части книги: {e}") from e
+
+
+def _shared_strings(zf: zipfile.ZipFile, indexes: set[int]) -> dict[int, str]:
+    """Читает sharedStrings.xml только до последнего нужного индекса."""
+    if not indexes or "xl/sharedStrings.xml" not in zf.namelist():
+        return {}
+    result = {}
+    last = max(indexes)
+    idx = -1
+    with zf.open("xl/sharedStrings.xml") as f:
+        for _, el in iterparse(f):
+            if _local(el.tag) != "si":
+                continue
+            idx += 1
+            if idx in indexes:
+                result[idx] = "".join(t.text or "" for t in el.iter() if _local(t.tag) == "t")
+            el.clear()
+            if idx >= last:
+                break
+    return result
+
+
+def _scan_sheet(zf: zipfile.ZipFile, part: str) -> tuple[int | None, list]:
+    """(оценка числа строк, сырые ячейки первой строки) — читает XML только до конца первой строки."""
+    rows = None
+    cells = []
+    with zf.open(part) as f:
+        for event, el in iterparse(f, events=("end",)):
+            tag = _local(el.tag)
+            if tag == "dimension":
+                match = _DIMENSION_RE.match(el.get("ref", ""))
+                if match:
+                    rows = int(match.group(2) or match.group(1))
+            elif tag == "c":
+                cell_type = el.get("t")
+                value = None
+                for child in el:
+                    if _local(child.tag) == "v":
+                        value = child.text
+                    elif _local(child.tag) == "is":
+                        value = "".join(t.text or "" for t in child.iter() if _local(t.tag) == "t")
+                cells.append((el.get("r"), cell_type, value))
+            elif tag == "row":
+                break
+            elif tag == "sheetData":
+                break
+    return rows, cells
+
+
+def _column_index(ref: str | None, default: int) -> int:
+    if not ref:
+        return default
+    letters = re.match(r"[A-Z]+", ref).group(0)
+    index = 0
+    for ch in letters:
+        index = index * 26 + ord(ch) - ord("A") + 1
+    return index - 1
+
+
+def _inspect_xlsx(zf: zipfile.ZipFile, with_headers: bool) -> list[dict]:
+    sheets = []
+    raw = []
+    for name, part in _sheet_parts(zf):
+        rows, cells = _scan_sheet(zf, part) if with_headers and part in zf.namelist() else (None, [])
+        sheets.append({"name": name, "rows": rows, "header": []})
+        raw.append(cells)
+
+    needed = {int(v) for cells in raw for _, t, v in cells if t == "s" and v is not None}
+    strings = _shared_strings(zf, needed)
+    for sheet, cells in zip(sheets, raw):
+        header = []
+        for i, (ref, cell_type, value) in enumerate(cells):
+            col = _column_index(ref, i)
+            header.extend([None] * (col - len(header)))
+            header.append(strings.get(int(value)) if cell_type == "s" and value is not None else value)
+        sheet["header"] = header
+    return sheets
+
+
+def _inspect_xls(source, with_headers: bool) -> list[dict]:
+    try:
+        if isinstance(source, str):
+            book = xlrd.open_workbook(source, on_demand=True)
+        else:
+            book = xlrd.open_workbook(file_contents=_rewind(source).read(), on_demand=True)
+    except xlrd.XLRDError as e:
+        raise WorkbookError(str(e)) from e
+    try:
+        sheets = []
+        for name in book.sheet_names():
+            info = {"name": name, "rows": None, "header": []}
+            if with_headers:
+                sheet = book.sheet_by_name(name)
+                info["rows"] = sheet.nrows
+                info["header"] = sheet.row_values(0) if sheet.nrows else []
+                book.unload_sheet(name)
+            sheets.append(info)
+        return sheets
+    finally:
+        book.release_resources()
+
+
+def inspect_workbook(source, with_headers: bool = True) -> list[dict]:
+    """[{"name", "rows", "header"}] для каждого листа книги.
+
+    source — путь к файлу или открытый файловый объект с seek (UploadFile.file).
+    rows — оценка числа строк по тегу <dimension> (вместе с заголовком),
+    header — значения первой строки листа.
+    """
+    if zipfile.is_zipfile(_rewind(source)):
+        with zipfile.ZipFile(_rewind(source)) as zf:
+            return _inspect_xlsx(zf, with_headers)
+    return _inspect_xls(source, with_headers)
+
+
+def sheet_names(source) -> list[str]:
+    return [sheet["name"] for sheet in inspect_workbook(source, with_headers=False)]
+
+
+def validate_workbook(source) -> list[dict]:
+    """Проверка перед загрузкой: книга читается и в ней есть хотя бы один непустой лист."""
+    sheets = inspect_workbook(source)
+    if not sheets:
+        raise WorkbookError("В книге нет листов")
+    if not any(any(v not in (None, "") for v in sheet["header"]) for sheet in sheets):
+        raise WorkbookError("Во всех листах отсутствует строка заголовков")
+    return sheets
@@ -0,0 +1,89 @@
+"""Задержка apply_filters на колоночном снимке excel_users.
+
+Отдельно меряется построение маски (цель — до 10 мс на 1M строк) и время
+вместе со сборкой строк результата, которое растёт с числом найденных строк.
+
+Запуск из каталога back/:
+    python -m benchmarks.bench_apply_filters --rows 1000000
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app.excel_store import ExcelColumnStore  # noqa: E402
+from app.fio_guess import guess_gender_by_fio, guess_language_by_fio  # noqa: E402
+from app.merge_excel import filter_mask  # noqa: E402
+
+SURNAMES = ["Иванов", "Петрова", "Нурланов", "Smith", "Ахметова", "Ким"]
+PATRONYMICS = ["Петрович", "Сергеевна", "Нурланұлы", "", "Маратқызы", ""]
+SOURCES = ["kaspi", "halyk", "cloudpayments", "сайт"]
+
+CASES = {
+    "source": dict(source=["kaspi"]),
+    "date": dict(date_from="01.03.2025", date_to="07.03.2025"),
+    "amount": dict(amount_from=90_000),
+    "gender+language": dict(gender=["жен"], language=["русский"], amount_from=95_000),
+    "type": dict(type=["frequent"], source=["halyk"], amount_to=1_000),
+    "all": dict(
+        type=["periodic", "frequent"], date_from="01.06.2025", date_to="30.06.2025",
+        amount_from=50_000, gender=["женщина"], language=["другой"], source=["сайт"],
+    ),
+}
+
+
+def synthetic_store(rows: int) -> ExcelColumnStore:
+    rng = np.random.default_rng(42)
+    days = rng.integers(0, 365, rows)
+    amounts = rng.integers(500, 100_000, rows)
+    donors = rng.integers(0, rows // 3, rows)
+    start = date(2025, 1, 1)
+    records = []
+    for i in range(rows):
+        payment_date = start + timedelta(days=int(days[i]))
+        row = {
+            "id": i + 1,
+            "ФИО": f"{SURNAMES[donors[i] % 6]} Д{donors[i]} {PATRONYMICS[donors[i] % 6]}".strip(),
+            "Дата": payment_date.strftime("%d.%m.%Y"),
+            "Сумма": int(amounts[i]),
+            "источник": SOURCES[i % len(SOURCES)],
+        }
+        records.append((
+            row, payment_date, amounts[i], row["источник"],
+            guess_gender_by_fio(row["ФИО"]), guess_language_by_fio(row["ФИО"]),
+        ))
+    return ExcelColumnStore.from_rows(0, records)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    store = synthetic_store(args.rows)
+    print(f"store: {len(store)} rows built in {time.perf_counter() - started:.1f}s")
+
+    for name, params in CASES.items():
+        mask_timings, total_timings = [], []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            mask = filter_mask(store, **params)
+            masked = time.perf_counter()
+            result = store.materialize(mask)
+            mask_timings.append(masked - started)
+            total_timings.append(time.perf_counter() - started)
+        print(
+            f"{name:>16}: filter {statistics.median(mask_timings) * 1000:6.2f} ms, "
+            f"with rows {statistics.median(total_timings) * 1000:7.2f} ms, rows {len(result)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Разбор дат: app/dates.py против прежних построчных путей.
+
+Строки похожи на выгрузки: в основном DD.MM.YYYY, немного DD/MM/YYYY,
+ISO со временем и редкие «свободные» форматы; дни повторяются. Поштучный
+разбор сравнивается с dateutil, strptime-перебором и pd.to_datetime на
+каждую строку, колонка — с прежним pd.to_datetime(dayfirst) + format='mixed'.
+Расхождения колонок — ISO со временем: прежний путь с dayfirst читал
+«2025-04-09T10:15» как 4 сентября.
+
+Запуск из каталога back/:
+    python -m benchmarks.bench_dates --rows 200000
+"""
+import argparse
+import statistics
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from dateutil.parser import parse as dateutil_parse
+
+from app.dates import _parse_text, parse_date, parse_date_column
+
+
+def make_strings(rows: int, days: int) -> list[str]:
+    rng = np.random.default_rng(0)
+    start = date(2024, 1, 1)
+    values = []
+    for offset, kind in zip(rng.integers(0, days, rows), rng.random(rows)):
+        day = start + timedelta(days=int(offset))
+        if kind < 0.80:
+            values.append(day.strftime("%d.%m.%Y"))
+        elif kind < 0.90:
+            values.append(day.strftime("%d/%m/%Y"))
+        elif kind < 0.98:
+            values.append(day.strftime("%Y-%m-%dT10:15:00"))
+        else:
+            values.append(day.strftime("%d %B %Y"))
+    return values
+
+
+def dateutil_path(value):
+    try:
+        return dateutil_parse(value, dayfirst=True).date()
+    except Exception:
+        return None
+
+
+def strptime_path(value):
+    # Прежний crm_fields.parse_payment_date
+    for fmt in ("%d.%m.%Y", "%d/%m/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value[:10], fmt).date()
+        except ValueError:
+            pass
+    return dateutil_path(value)
+
+
+def pandas_path(value):
+    # Прежний upload_excel.get_month_from_date_string
+    parsed = pd.to_datetime(value, errors='coerce', dayfirst=True)
+    return parsed.date() if pd.notnull(parsed) else None
+
+
+def parse_cold(value):
+    return _parse_text.__wrapped__(value)
+
+
+def legacy_column(col: pd.Series) -> pd.Series:
+    text = col.astype(str).str.strip().where(col.notna())
+    parsed = pd.to_datetime(text, errors='coerce', dayfirst=True)
+    missing = parsed.isna() & text.notna()
+    if missing.any():
+        parsed[missing] = pd.to_datetime(text[missing], errors='coerce', dayfirst=True, format='mixed')
+    return parsed
+
+
+def timed(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--days", type=int, default=730, help="Число разных дней в выборке")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--slow-rows", type=int, default=20_000,
+                        help="Сколько строк гонять через медленные построчные пути")
+    args = parser.parse_args()
+
+    values = make_strings(args.rows, args.days)
+    sample = values[:args.slow_rows]
+    scale = args.rows / len(sample)
+
+    def per_row(func, rows):
+        return lambda: [func(value) for value in rows]
+
+    def warm():
+        _parse_text.cache_clear()
+        return [parse_date(value) for value in values]
+
+    print(f"{args.rows} строк, {args.days} разных дней; медленные пути — на {len(sample)} строках, пересчёт на все")
+    results = {
+        "dateutil": timed(per_row(dateutil_path, sample), args.repeat) * scale,
+        "strptime+dateutil": timed(per_row(strptime_path, sample), args.repeat) * scale,
+        "pd.to_datetime/строка": timed(per_row(pandas_path, sample), args.repeat) * scale,
+        "dates без кеша": timed(per_row(parse_cold, values), args.repeat),
+        "dates.parse_date": timed(warm, args.repeat),
+    }
+    for name, seconds in results.items():
+        print(f"{name:>22}: {seconds * 1000:9.1f} ms  ({seconds / args.rows * 1e6:6.2f} мкс/строка)")
+
+    col = pd.Series(values, dtype=object)
+    legacy = timed(lambda: legacy_column(col), args.repeat)
+    vectorized = timed(lambda: parse_date_column(col), args.repeat)
+    differ = (legacy_column(col).dt.date != parse_date_column(col).dt.date).mean()
+    print(f"{'колонка: прежний путь':>22}: {legacy * 1000:9.1f} ms")
+    print(f"{'колонка: dates':>22}: {vectorized * 1000:9.1f} ms  (расходится {differ:.1%} строк)")
+
+
+if __name__ == "__main__":
+    main()
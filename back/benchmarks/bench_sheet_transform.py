@@ -0,0 +1,111 @@
+"""Сравнение построчного (iterrows) и поколоночного преобразования листа Excel.
+
+Запуск из каталога back/:
+    python -m benchmarks.bench_sheet_transform --rows 100000
+    python -m benchmarks.bench_sheet_transform --rows 100000 --xlsx   # через настоящий .xlsx
+"""
+import argparse
+import io
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app.crm_fields import MONTH_NAMES  # noqa: E402
+from app.upload_excel import sheet_to_records  # noqa: E402
+
+
+def get_month_from_date_string(date_str):
+    parsed = pd.to_datetime(date_str, errors='coerce', dayfirst=True)
+    return parsed.month if pd.notnull(parsed) else None
+
+
+def convert_timestamps(obj):
+    if isinstance(obj, dict):
+        return {k: convert_timestamps(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_timestamps(i) for i in obj]
+    elif hasattr(obj, 'isoformat') and callable(obj.isoformat):
+        return obj.isoformat()
+    elif isinstance(obj, float):
+        if math.isnan(obj) or math.isinf(obj):
+            return None
+        return obj
+    else:
+        return obj
+
+
+def legacy_records(df: pd.DataFrame, sheet_name: str) -> list[dict]:
+    """Прежний цикл из upload_excel (до векторизации)."""
+    result = []
+    for _, row in df.iterrows():
+        row_data = row.to_dict()
+        for key in list(row_data.keys()):
+            if key.strip().lower() in ['month', 'месяц']:
+                del row_data[key]
+        if sheet_name in MONTH_NAMES:
+            row_data['month'] = sheet_name
+        else:
+            date_field = None
+            for k in row_data:
+                if k.strip().lower() in ['дата', 'дата и время', 'date', 'datetime']:
+                    date_field = row_data[k]
+                    break
+            month_num = get_month_from_date_string(date_field)
+            row_data['month'] = MONTH_NAMES[month_num - 1] if month_num and 1 <= month_num <= 12 else None
+        if row_data['month'] is not None:
+            result.append(convert_timestamps(row_data))
+    return result
+
+
+def synthetic_sheet(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(42)
+    days = pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D")
+    amounts = rng.integers(500, 100_000, rows).astype(float)
+    amounts[rng.random(rows) < 0.05] = np.nan
+    return pd.DataFrame({
+        "Дата": days.strftime("%d.%m.%Y"),
+        "Дата и время": days,
+        "Сумма": amounts,
+        "ИИН": rng.integers(10**11, 10**12, rows),
+        "ФИО": [f"Иванов Иван {i % 5000}" for i in range(rows)],
+        "Месяц": "Январь",
+    })
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--xlsx", action="store_true", help="записать и прочитать настоящий .xlsx")
+    args = parser.parse_args()
+
+    df = synthetic_sheet(args.rows)
+    if args.xlsx:
+        buffer = io.BytesIO()
+        df.to_excel(buffer, index=False, sheet_name="Лист1")
+        buffer.seek(0)
+        df = pd.read_excel(buffer, sheet_name="Лист1")
+
+    for sheet_name in ("Март", "Лист1"):
+        legacy_time, legacy = timed(legacy_records, df, sheet_name)
+        vector_time, vector = timed(sheet_to_records, df, sheet_name)
+        assert len(legacy) == len(vector), (len(legacy), len(vector))
+        print(
+            f"sheet={sheet_name!r} rows={len(df)}: "
+            f"iterrows {legacy_time:.2f}s, vectorized {vector_time:.2f}s, "
+            f"x{legacy_time / vector_time:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Нагрузочный тест: задержка GET /api/crm во время большой загрузки Excel.
+
+Несколько клиентов непрерывно запрашивают страницу /api/crm, сначала без
+фоновой нагрузки, затем параллельно с POST /api/upload_excel_2025 большой
+книги. Приложение работает в одном event loop с клиентами (httpx
+ASGITransport), поэтому любая блокировка loop сразу видна в p99.
+С --no-offload тяжёлая часть эндпоинтов выполняется прямо в loop — как до
+выноса в пул (см. app/offload.py).
+
+Запуск из каталога back/ (нужен httpx):
+    python -m benchmarks.load_crm_during_upload --upload-rows 50000
+    python -m benchmarks.load_crm_during_upload --upload-rows 50000 --no-offload
+"""
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import tempfile
+import time
+
+_db_dir = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_db_dir}/load.db")
+
+import httpx  # noqa: E402
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from app import merge_excel, routes, upload_excel  # noqa: E402
+from app.bulk_insert import bulk_insert_crm_entries, crm_row  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+def seed_crm(rows: int):
+    db = SessionLocal()
+    try:
+        data = (
+            {"Дата": f"{i % 28 + 1:02d}.03.2025", "Сумма": 100 + i % 900, "ФИО": f"Донор {i % 5000}"}
+            for i in range(rows)
+        )
+        bulk_insert_crm_entries(db, (crm_row(row, "seed") for row in data))
+        db.commit()
+    finally:
+        db.close()
+
+
+def make_workbook(rows: int) -> bytes:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "Дата": [f"{d:02d}.03.2025" for d in rng.integers(1, 29, rows)],
+        "Сумма": rng.integers(100, 50000, rows),
+        "ФИО": [f"Иванов Иван {i}" for i in range(rows)],
+        "E-mail": [f"user{i}@mail.kz" for i in range(rows)],
+    })
+    buf = io.BytesIO()
+    df.to_excel(buf, sheet_name="Март", index=False)
+    return buf.getvalue()
+
+
+async def poll_crm(client: httpx.AsyncClient, stop: asyncio.Event, latencies: list[float]):
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.get("/api/crm", params={"limit": 100})
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.005)
+
+
+def report(name: str, latencies: list[float]):
+    if not latencies:
+        print(f"{name:<16} нет запросов")
+        return
+    q = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    print(
+        f"{name:<16} n={len(latencies):>5}  p50={q[49]:8.1f} ms  p95={q[94]:8.1f} ms  "
+        f"p99={q[98]:8.1f} ms  max={max(latencies):8.1f} ms"
+    )
+
+
+async def run(args):
+    workbook = make_workbook(args.upload_rows)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        baseline: list[float] = []
+        stop = asyncio.Event()
+        pollers = [asyncio.create_task(poll_crm(client, stop, baseline)) for _ in range(args.clients)]
+        await asyncio.sleep(args.baseline_seconds)
+        stop.set()
+        await asyncio.gather(*pollers)
+
+        during: list[float] = []
+        stop = asyncio.Event()
+        pollers = [asyncio.create_task(poll_crm(client, stop, during)) for _ in range(args.clients)]
+        started = time.perf_counter()
+        response = await client.post(
+            "/api/upload_excel_2025",
+            files=[("files", ("load.xlsx", workbook))],
+            data={"sources": "load"},
+        )
+        upload_seconds = time.perf_counter() - started
+        stop.set()
+        await asyncio.gather(*pollers)
+
+    print(f"upload_excel_2025: {args.upload_rows} строк, HTTP {response.status_code}, {upload_seconds:.2f} s")
+    report("/crm без загрузки", baseline)
+    report("/crm с загрузкой", during)
+
+
+async def _inline(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--crm-rows", type=int, default=20000)
+    parser.add_argument("--upload-rows", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--baseline-seconds", type=float, default=3.0)
+    parser.add_argument("--no-offload", action="store_true", help="Выполнять загрузку прямо в event loop")
+    args = parser.parse_args()
+
+    if args.no_offload:
+        for module in (upload_excel, merge_excel, routes):
+            module.run_blocking = _inline
+
+    seed_crm(args.crm_rows)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()